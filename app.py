@@ -1,9 +1,17 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response
+import io
 import os
 import sys
+import time
+import threading
 import pandas as pd
-from src.pipeline.training_pipeline import TrainingPipeline
+from src.pipeline.training_jobs import get_training_job_manager
 from src.pipeline.prediction_pipeline import PredictPipeline
+from src.components.model_registry import get_model_registry
+from src.components.request_coalescer import RequestCoalescer
+from src.components.inference_kernel import synthetic_sample
+from src.components.drift_monitor import get_drift_monitor
+from src.instrumentation import metrics_registry
 from dataclasses import dataclass
 from src.utils import double_log_transform, cube_root_transform
 from src.logger import logging
@@ -12,10 +20,122 @@ from src.exception import CustomError
 @dataclass
 class AppConfig:
     default_data_path = 'notebook/Data/creditcard.csv'
+    training_score_threshold = 0.6
     train_data_description_path = 'artifacts/train_data_describe.csv'
+    target_class = 'Class'
+    default_fraud_prob_threshold = 0.5
+    use_inference_kernel = os.environ.get('USE_INFERENCE_KERNEL', '0') == '1'
+    use_kernel_artifact = os.environ.get('USE_KERNEL_ARTIFACT', '0') == '1' # Serve the memory-mapped kernel artifact, shared by all worker processes
+    coalesce_predictions = os.environ.get('COALESCE_PREDICTIONS', '0') == '1' # Score concurrent /predict_page requests in micro-batches
+    coalesce_window_ms = float(os.environ.get('COALESCE_WINDOW_MS', '2'))
+    coalesce_max_batch_size = int(os.environ.get('COALESCE_MAX_BATCH_SIZE', '64'))
+    warmup_rounds = int(os.environ.get('WARMUP_ROUNDS', '3')) # Rounds of synthetic predictions run by warm_up before serving
+    warmup_batch_size = 256
+    monitor_drift = os.environ.get('MONITOR_DRIFT', '1') == '1' # Follow the feature distribution of prediction traffic against the train data
 
 app = Flask(__name__)
 
+request_duration = metrics_registry.histogram('http_request_duration_seconds', 'Time taken to serve HTTP requests.', ('endpoint', 'method'))
+requests_total = metrics_registry.counter('http_requests_total', 'HTTP requests served.', ('endpoint', 'method', 'status'))
+predictions_total = metrics_registry.counter('predictions_total', 'Transactions scored by prediction requests.', ('endpoint', 'result'))
+
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    if 'request_start_time' in g:
+        request_duration.observe(time.perf_counter() - g.request_start_time, endpoint = endpoint, method = request.method)
+    requests_total.inc(endpoint = endpoint, method = request.method, status = response.status_code)
+    return response
+
+_request_coalescer = None
+_request_coalescer_lock = threading.Lock()
+
+def get_request_coalescer():
+    '''
+    Return the request coalescer of the app, creating it on first use
+    '''
+    global _request_coalescer
+    with _request_coalescer_lock:
+        if _request_coalescer is None:
+            prediction_pipeline = PredictPipeline(AppConfig.use_inference_kernel, AppConfig.use_kernel_artifact)
+            _request_coalescer = RequestCoalescer(prediction_pipeline.score,
+                                                  AppConfig.coalesce_window_ms,
+                                                  AppConfig.coalesce_max_batch_size,
+                                                  prediction_pipeline.input_columns)
+        return _request_coalescer
+
+_warmed_up = False
+
+def warm_up(n_rounds = None):
+    '''
+    Load the model and pre-processor and score synthetic transactions through the single row and batch prediction paths,
+    and compile the templates, so that the first requests do not pay for loading, lazy imports and first call allocations.
+    Run by wsgi.py in the gunicorn master before workers are forked, so that they share the loaded model copy-on-write.
+    Returns the number of seconds taken.
+    '''
+    global _warmed_up
+    n_rounds = AppConfig.warmup_rounds if n_rounds is None else n_rounds
+
+    logging.info('Initiating warm up of the app...')
+    start_time = time.perf_counter()
+
+    prediction_pipeline = PredictPipeline(AppConfig.use_inference_kernel, AppConfig.use_kernel_artifact)
+    model, preprocessor = prediction_pipeline.load_artifacts()
+    input_columns = model.input_columns if preprocessor is None else [str(column) for column in preprocessor.feature_names_in_]
+    X = synthetic_sample(input_columns, n_rows = AppConfig.warmup_batch_size)
+
+    for _ in range(n_rounds):
+        prediction_pipeline.run_pipeline(X.iloc[:1])
+        prediction_pipeline.run_pipeline_batch(X)
+
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+    _warmed_up = True
+    seconds = time.perf_counter() - start_time
+    logging.info(f'Successfully completed warm up of the app in {seconds:.3f} seconds!!!')
+    return seconds
+
+def observe_drift(row = None, X = None):
+    '''
+    Record a prediction row (dictionary) or data frame of rows in the drift monitor, never failing the prediction
+    '''
+    if not AppConfig.monitor_drift:
+        return
+    try:
+        drift_monitor = get_drift_monitor()
+        if drift_monitor is None:
+            return
+        if row is not None:
+            drift_monitor.observe_row(row)
+        else:
+            drift_monitor.observe(X)
+    except Exception:
+        logging.error('Could not record prediction rows in the drift monitor.', exc_info = True)
+
+_train_data_description = (None, None)
+
+def train_data_description():
+    '''
+    Return the min, median and max of every train feature, from the drift reference kept in memory or, for artifacts saved
+    without one, from the train data description file, which is read again only when it changes
+    '''
+    global _train_data_description
+    drift_monitor = get_drift_monitor()
+    if drift_monitor is not None:
+        return drift_monitor.describe()
+
+    mtime_ns = os.stat(AppConfig.train_data_description_path).st_mtime_ns
+    if _train_data_description[0] != mtime_ns:
+        df = pd.read_csv(AppConfig.train_data_description_path, index_col = 0)
+        _train_data_description = (mtime_ns, {var: {'min': df.loc['min', var], 'median': df.loc['50%', var], 'max': df.loc['max', var]}
+                                              for var in df.columns})
+    return _train_data_description[1]
+
 @app.route('/')
 def home():
     return render_template('main_page.html')
@@ -27,42 +147,165 @@ def train_page():
 @app.route('/train', methods=['GET'])
 def train():
     file_path = request.args.get('file', AppConfig.default_data_path)
+    mode = request.args.get('mode', 'full')
+
+    if mode not in ('full', 'incremental'):
+        return jsonify({'success': False, 'message': "Training mode must be 'full' or 'incremental'."}), 400
 
     if os.path.exists(file_path) and os.path.isfile(file_path):
         try:
-            training_pipeline = TrainingPipeline()
-            training_pipeline.run_pipeline(0.6, file_path)
-            return jsonify({'success': True})
+            job = get_training_job_manager().submit(file_path, AppConfig.training_score_threshold, request.args.get('profile', '0') == '1', mode)
+            return jsonify({'success': True, 'job_id': job.job_id, 'status': job.status}), 202
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)}), 500
     else:
         return jsonify({'success': False, 'message': 'File not found.'}), 404
 
+@app.route('/train/jobs', methods=['GET'])
+def training_jobs():
+    return jsonify({'success': True, 'jobs': [job.to_dict() for job in get_training_job_manager().list_jobs()]})
+
+@app.route('/train/jobs/<job_id>', methods=['GET'])
+def training_job_status(job_id):
+    job = get_training_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Training job not found.'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+@app.route('/train/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_training_job(job_id):
+    job = get_training_job_manager().cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Training job not found.'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
 @app.route('/predict_page', methods = ['GET', 'POST'])
 def predict_route():
     try:
         if request.method == 'GET':
-            df = pd.read_csv(AppConfig.train_data_description_path, index_col = 0)
-            variables = df.columns.tolist() 
             variable_data = {}
 
-            for var in variables:
+            for var, stats in train_data_description().items():
                 variable_data[var] = {
-                    'min': round(df.loc['min', var], 2),
-                    'median': round(df.loc['50%', var], 2),
-                    'max': round(df.loc['max', var], 2)
+                    'min': round(stats['min'], 2),
+                    'median': round(stats['median'], 2),
+                    'max': round(stats['max'], 2)
                     }
             return render_template('prediction_page.html', variable_data = variable_data)
         else:
-            df = pd.DataFrame({key:float(value) for key, value in request.get_json().items()}, index = [0])
-            prediction_pipeline = PredictPipeline()
-            result = prediction_pipeline.run_pipeline(df)
+            row = {key:float(value) for key, value in request.get_json().items()}
+            if AppConfig.coalesce_predictions:
+                fraud_prob = get_request_coalescer().predict(row)
+                result = "Fraudulent transaction" if fraud_prob > AppConfig.default_fraud_prob_threshold else "Genuine transaction"
+            else:
+                df = pd.DataFrame(row, index = [0])
+                prediction_pipeline = PredictPipeline(AppConfig.use_inference_kernel, AppConfig.use_kernel_artifact)
+                result = prediction_pipeline.run_pipeline(df)
+            observe_drift(row = row)
+            predictions_total.inc(endpoint = 'predict_page', result = 'fraud' if result == "Fraudulent transaction" else 'genuine')
             return  jsonify({'result': result, 'message': 'Prediction Completed Successfully!!.'})
     except:
         error_obj = CustomError(*sys.exc_info())
         logging.error(error_obj, exc_info = True)
         return render_template('404.html'), 404
     
+def parse_transactions(req):
+    '''
+    Parse the body of a batch prediction request into a data frame of transactions.
+    Supports a JSON array of objects, CSV (text/csv) and NDJSON (application/x-ndjson) bodies.
+    '''
+    content_type = (req.mimetype or '').lower()
+
+    if content_type in ('text/csv', 'application/csv'):
+        df = pd.read_csv(io.BytesIO(req.get_data()))
+    elif content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        df = pd.read_json(io.BytesIO(req.get_data()), lines = True)
+    else:
+        records = req.get_json(force = True)
+        if not isinstance(records, list):
+            raise ValueError('Expected a JSON array of transactions.')
+        df = pd.DataFrame.from_records(records)
+
+    if df.empty:
+        raise ValueError('No transactions found in request body.')
+
+    # The label column may be present in exported files, it is not a predictor
+    return df.drop(columns = AppConfig.target_class, errors = 'ignore').astype(float)
+
+@app.route('/predict_batch', methods = ['POST'])
+def predict_batch():
+    try:
+        fraud_prob_threshold = request.args.get('threshold', AppConfig.default_fraud_prob_threshold, type = float)
+        chunk_size = request.args.get('chunk_size', None, type = int)
+
+        df = parse_transactions(request)
+        prediction_pipeline = PredictPipeline(AppConfig.use_inference_kernel, AppConfig.use_kernel_artifact)
+        result = prediction_pipeline.run_pipeline_batch(df, fraud_prob_threshold, chunk_size)
+        observe_drift(X = df)
+        n_fraud = int(result['is_fraud'].sum())
+        predictions_total.inc(n_fraud, endpoint = 'predict_batch', result = 'fraud')
+        predictions_total.inc(len(result) - n_fraud, endpoint = 'predict_batch', result = 'genuine')
+
+        return jsonify({'success': True,
+                        'count': len(result),
+                        'threshold': fraud_prob_threshold,
+                        'fraud_probability': result['fraud_probability'].tolist(),
+                        'is_fraud': result['is_fraud'].tolist(),
+                        'result': result['result'].tolist(),
+                        'message': 'Batch Prediction Completed Successfully!!.'})
+    except:
+        error_obj = CustomError(*sys.exc_info())
+        logging.error(error_obj, exc_info = True)
+        return jsonify({'success': False, 'message': str(error_obj)}), 400
+
+@app.route('/model_info', methods = ['GET'])
+def model_info():
+    try:
+        model_registry = get_model_registry()
+        model_registry.get()
+        return jsonify({'success': True, **model_registry.info()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/coalescer_metrics', methods = ['GET'])
+def coalescer_metrics():
+    if not AppConfig.coalesce_predictions:
+        return jsonify({'success': True, 'enabled': False})
+    return jsonify({'success': True, 'enabled': True, **get_request_coalescer().stats()})
+
+@app.route('/healthz', methods = ['GET'])
+def liveness():
+    return jsonify({'alive': True, 'pid': os.getpid()})
+
+@app.route('/readyz', methods = ['GET'])
+def readiness():
+    # Ready once the model and pre-processor the predictions are served with can be loaded
+    try:
+        PredictPipeline(AppConfig.use_inference_kernel, AppConfig.use_kernel_artifact).load_artifacts()
+    except Exception as e:
+        return jsonify({'ready': False, 'warmed_up': _warmed_up, 'message': str(e)}), 503
+
+    model_version = get_model_registry().info().get('version')
+    return jsonify({'ready': True, 'warmed_up': _warmed_up, 'version': model_version, 'pid': os.getpid()})
+
+@app.route('/drift', methods = ['GET'])
+def drift():
+    drift_monitor = get_drift_monitor() if AppConfig.monitor_drift else None
+    if drift_monitor is None:
+        return jsonify({'success': True, 'enabled': AppConfig.monitor_drift, 'message': 'No drift reference, train a model first.' if AppConfig.monitor_drift else 'Drift monitoring is disabled.'})
+    return jsonify({'success': True, 'enabled': True, **drift_monitor.report()})
+
+@app.route('/drift/reset', methods = ['POST'])
+def reset_drift():
+    drift_monitor = get_drift_monitor() if AppConfig.monitor_drift else None
+    if drift_monitor is not None:
+        drift_monitor.reset()
+    return jsonify({'success': True})
+
+@app.route('/metrics', methods = ['GET'])
+def metrics():
+    return Response(metrics_registry.render(), mimetype = 'text/plain; version=0.0.4')
+
 @app.route('/404', methods=['GET'])
 def error_404():
     return render_template('404.html')
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.pipeline.training_pipeline import TrainingPipeline
+from src.components.data_ingestion import DataIngestion
+from src.components.data_transformation import DataPreProcessor
+from src.components.data_resampler import DataResampler
+from src.components.model_trainer import ModelTrainer
+from src.components.model_evaluator import ModelEvaluator
+from src.utils import load_object, save_json
+
+from benchmarks.synthetic_data import write_creditcard_csv
+
+@dataclass
+class DtypeValidationConfig:
+    '''
+    A data class for storing paths and settings of the compute dtype validation report
+    '''
+    n_rows = 100000 # Rows of synthetic data, when no csv file is given
+    fraud_rate = 0.00172
+    random_state = 42
+    test_size = 0.33
+    dtypes = ('float64', 'float32') # The first is the reference the others are compared against
+    models_data_path = os.path.join("notebook", "models", "models_data.pkl")
+    report_path = os.path.join("benchmarks", "results", "dtype_validation.json")
+    tolerance = 0.001 # Largest acceptable absolute difference of test PR-AUC against the reference dtype
+
+def train_candidates_in_dtype(csv_path, dtype, validation_config):
+    '''
+    Ingest the csv file with features in dtype and train every candidate of models_data on it.
+    Returns a tuple of format (results by candidate name, test fraud probabilities by candidate name, bytes of the features).
+    '''
+    X_train, X_test, Y_train, Y_test = DataIngestion().ingest_data(csv_path, 'Class', validation_config.test_size,
+                                                                   validation_config.random_state, dtype)
+    training_pipeline = TrainingPipeline()
+    model_evaluator = ModelEvaluator()
+    results, test_scores = {}, {}
+
+    for model in load_object(validation_config.models_data_path):
+        candidate = training_pipeline.prepare_candidate(model)
+        start_time = time.perf_counter()
+
+        X_train_transformed = DataPreProcessor().fit_transform(candidate['pre-processor'], X_train, Y_train)
+        X_train_resampled, Y_train_resampled = DataResampler().fit_resample(training_pipeline.scalable_resampler(candidate['resampler']),
+                                                                            X_train_transformed, Y_train)
+        ModelTrainer().train_model(candidate['model'], candidate['best_params'], X_train_resampled, Y_train_resampled)
+        train_seconds = time.perf_counter() - start_time
+
+        test_scores[candidate['name']] = model_evaluator.predict_scores(candidate['pre-processor'], candidate['model'], X_test)
+        test_report = model_evaluator.evaluate_report(candidate['pre-processor'], candidate['model'], X_test, Y_test, 'test')
+
+        results[candidate['name']] = {'pr_auc': test_report['pr_auc'],
+                                      'roc_auc': test_report['roc_auc'],
+                                      'train_seconds': train_seconds,
+                                      'transformed_dtype': str(np.asarray(X_train_resampled).dtype),
+                                      'resampled_train_bytes': int(np.asarray(X_train_resampled).nbytes)}
+
+    feature_bytes = int(X_train.memory_usage(index = False).sum() + X_test.memory_usage(index = False).sum())
+    return (results, test_scores, feature_bytes)
+
+def validate_compute_dtypes(csv_path, validation_config):
+    '''
+    Train every candidate in each dtype of the config and return a report comparing them against the first one:
+    the difference in test PR-AUC, the largest difference of a test fraud probability, the agreement of labels at 0.5,
+    the training time and the memory of the features
+    '''
+    reference_dtype = validation_config.dtypes[0]
+    runs = {dtype: train_candidates_in_dtype(csv_path, dtype, validation_config) for dtype in validation_config.dtypes}
+    reference_results, reference_scores, _ = runs[reference_dtype]
+
+    candidates = {}
+    for name, reference in reference_results.items():
+        candidates[name] = {reference_dtype: reference}
+        for dtype in validation_config.dtypes[1:]:
+            results, scores, _ = runs[dtype]
+            candidates[name][dtype] = {**results[name],
+                                       'pr_auc_difference': results[name]['pr_auc'] - reference['pr_auc'],
+                                       'max_abs_probability_difference': float(np.max(np.abs(scores[name] - reference_scores[name]))),
+                                       'label_agreement': float(np.mean((scores[name] > 0.5) == (reference_scores[name] > 0.5)))}
+
+    max_abs_pr_auc_difference = max((abs(candidate[dtype]['pr_auc_difference']) for candidate in candidates.values()
+                                     for dtype in validation_config.dtypes[1:]), default = 0.0)
+
+    return {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'reference_dtype': reference_dtype,
+            'feature_bytes': {dtype: runs[dtype][2] for dtype in validation_config.dtypes},
+            'candidates': candidates,
+            'max_abs_pr_auc_difference': max_abs_pr_auc_difference,
+            'tolerance': validation_config.tolerance,
+            'passed': max_abs_pr_auc_difference <= validation_config.tolerance}
+
+def print_report(report):
+    reference_dtype = report['reference_dtype']
+    print(f"{'candidate':<40} {'dtype':<8} {'PR-AUC':>9} {'diff':>10} {'max |dp|':>10} {'train s':>8}")
+    for name, candidate in report['candidates'].items():
+        for dtype, result in candidate.items():
+            difference = '' if dtype == reference_dtype else f"{result['pr_auc_difference']:+.2e}"
+            max_difference = '' if dtype == reference_dtype else f"{result['max_abs_probability_difference']:.2e}"
+            print(f"{name:<40} {dtype:<8} {result['pr_auc']:>9.5f} {difference:>10} {max_difference:>10} {result['train_seconds']:>8.2f}")
+    for dtype, n_bytes in report['feature_bytes'].items():
+        print(f'Features in {dtype}: {n_bytes / 2**20:.1f} MiB')
+    print(f"Largest PR-AUC difference {report['max_abs_pr_auc_difference']:.2e}, tolerance {report['tolerance']:.0e}: "
+          f"{'passed' if report['passed'] else 'FAILED'}")
+
+def main(argv = None):
+    validation_config = DtypeValidationConfig()
+
+    parser = argparse.ArgumentParser(description = 'Compare PR-AUC of the models trained in float32 against float64')
+    parser.add_argument('--csv', default = None, help = 'csv file in the schema of the credit card data set, synthetic data is used if not given')
+    parser.add_argument('--rows', type = int, default = validation_config.n_rows)
+    parser.add_argument('--fraud-rate', type = float, default = validation_config.fraud_rate)
+    parser.add_argument('--tolerance', type = float, default = validation_config.tolerance)
+    parser.add_argument('--output', default = validation_config.report_path, help = 'json file the report is written to')
+    args = parser.parse_args(argv)
+
+    validation_config.tolerance = args.tolerance
+
+    work_dir = tempfile.mkdtemp(prefix = 'dtype-validation-')
+    try:
+        csv_path = args.csv or write_creditcard_csv(os.path.join(work_dir, 'creditcard.csv'), args.rows, args.fraud_rate,
+                                                    random_state = validation_config.random_state)
+        report = validate_compute_dtypes(csv_path, validation_config)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    report['data'] = args.csv or f'synthetic, {args.rows} rows, fraud rate {args.fraud_rate}'
+    save_json(args.output, report)
+    print_report(report)
+    print(f'Report written to {args.output}')
+
+    if not report['passed']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
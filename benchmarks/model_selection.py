@@ -0,0 +1,103 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from dataclasses import dataclass
+
+from src.pipeline.training_pipeline import TrainingPipeline
+from src.components.successive_halving import SuccessiveHalving, SuccessiveHalvingConfig
+from src.components.data_ingestion import DataIngestion
+from src.utils import load_object, save_json
+
+from benchmarks.synthetic_data import write_creditcard_csv
+
+@dataclass
+class ModelSelectionBenchmarkConfig:
+    '''
+    A data class for storing paths and settings of the model selection benchmark
+    '''
+    n_rows = 100000 # Rows of synthetic data, when no csv file is given
+    fraud_rate = 0.00172
+    random_state = 42
+    test_size = 0.33
+    models_data_path = os.path.join("notebook", "models", "models_data.pkl")
+    report_path = os.path.join("benchmarks", "results", "model_selection.json")
+
+def compare_model_selection(csv_path, benchmark_config, time_budget = None, n_workers = None):
+    '''
+    Select the best candidate of models_data by exhaustive training and by successive halving on the same data and return
+    a report of the wall time of both, the model each one chose and its test score. The transformation cache is switched
+    off, so that neither run reuses the pre-processing of the other.
+    '''
+    X_train, X_test, Y_train, Y_test = DataIngestion().ingest_data(csv_path, 'Class', benchmark_config.test_size, benchmark_config.random_state)
+    models_data = load_object(benchmark_config.models_data_path)
+
+    training_pipeline = TrainingPipeline()
+    training_pipeline.training_pipeline_config.use_transformation_cache = False
+
+    start_time = time.perf_counter()
+    candidates = training_pipeline.train_candidates(models_data, X_train, Y_train, X_test, Y_test, n_workers)
+    exhaustive_seconds = time.perf_counter() - start_time
+    exhaustive_best = candidates[training_pipeline.find_best_model(candidates, metric = training_pipeline.training_pipeline_config.selection_metric)]
+
+    successive_halving_config = SuccessiveHalvingConfig()
+    successive_halving_config.time_budget_seconds = time_budget
+    start_time = time.perf_counter()
+    finalists, selection_report = SuccessiveHalving(training_pipeline, successive_halving_config).run(models_data, X_train, Y_train, X_test, Y_test, n_workers)
+    halving_seconds = time.perf_counter() - start_time
+    halving_best = finalists[training_pipeline.find_best_model(finalists, metric = training_pipeline.training_pipeline_config.selection_metric)]
+    selection_report.pop('worker_stages')
+
+    return {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'candidates': len(models_data),
+            'train_rows': len(X_train),
+            'exhaustive': {'seconds': exhaustive_seconds,
+                           'best_model': exhaustive_best['name'],
+                           'test_score': exhaustive_best['test_score'],
+                           'candidate_seconds': {candidate['name']: candidate.get('train_seconds') for candidate in candidates}},
+            'successive_halving': {'seconds': halving_seconds,
+                                   'best_model': halving_best['name'],
+                                   'test_score': halving_best['test_score'],
+                                   'report': selection_report},
+            'seconds_saved': exhaustive_seconds - halving_seconds,
+            'speedup': exhaustive_seconds / halving_seconds if halving_seconds else None,
+            'same_best_model': exhaustive_best['name'] == halving_best['name']}
+
+def print_report(report):
+    print(f"{'selection':<20} {'seconds':>9} {'best model':<30} {'test PR-AUC':>11}")
+    for selection in ('exhaustive', 'successive_halving'):
+        result = report[selection]
+        print(f"{selection:<20} {result['seconds']:>9.2f} {result['best_model']:<30} {result['test_score']:>11.5f}")
+    for rung in report['successive_halving']['report']['rungs']:
+        print(f"rung {rung['rung']}: {rung['candidates']} candidates on {rung['train_rows']} rows ({rung['budget']:.2f}), {rung['seconds']:.2f} s")
+    print(f"Saved {report['seconds_saved']:.2f} seconds, speedup {report['speedup']:.2f}x, "
+          f"{'same' if report['same_best_model'] else 'DIFFERENT'} best model")
+
+def main(argv = None):
+    benchmark_config = ModelSelectionBenchmarkConfig()
+
+    parser = argparse.ArgumentParser(description = 'Compare successive halving model selection against exhaustive training')
+    parser.add_argument('--csv', default = None, help = 'csv file in the schema of the credit card data set, synthetic data is used if not given')
+    parser.add_argument('--rows', type = int, default = benchmark_config.n_rows)
+    parser.add_argument('--fraud-rate', type = float, default = benchmark_config.fraud_rate)
+    parser.add_argument('--time-budget', type = float, default = None, help = 'wall-clock seconds of successive halving')
+    parser.add_argument('--workers', type = int, default = None, help = 'processes training candidates in parallel')
+    parser.add_argument('--output', default = benchmark_config.report_path, help = 'json file the report is written to')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix = 'model-selection-')
+    try:
+        csv_path = args.csv or write_creditcard_csv(os.path.join(work_dir, 'creditcard.csv'), args.rows, args.fraud_rate,
+                                                    random_state = benchmark_config.random_state)
+        report = compare_model_selection(csv_path, benchmark_config, args.time_budget, args.workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    report['data'] = args.csv or f'synthetic, {args.rows} rows, fraud rate {args.fraud_rate}'
+    save_json(args.output, report)
+    print_report(report)
+    print(f'Report written to {args.output}')
+
+if __name__ == "__main__":
+    main()
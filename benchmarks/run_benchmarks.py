@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import socket
+import argparse
+import tempfile
+import subprocess
+import threading
+import urllib.request
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from src.pipeline.training_pipeline import TrainingPipeline
+from src.pipeline.prediction_pipeline import PredictPipeline, PredictionPipelineConfig
+from src.components.data_ingestion import DataIngestion
+from src.components.data_transformation import DataPreProcessor
+from src.components.data_resampler import DataResampler
+from src.components.model_trainer import ModelTrainer
+from src.components.model_evaluator import ModelEvaluator
+from src.utils import load_object, save_object, save_json, load_json, area_under_precision_recall_curve
+
+from benchmarks.synthetic_data import write_creditcard_csv
+
+@dataclass
+class BenchmarkConfig:
+    '''
+    A data class for storing paths and settings of the benchmark suite
+    '''
+    n_rows = 100000
+    fraud_rate = 0.00172
+    random_state = 42
+    test_size = 0.33
+    models_data_path = os.path.join("notebook", "models", "models_data.pkl")
+    single_row_requests = 200 # Calls of PredictPipeline.run_pipeline timed one by one
+    batch_rows = 10000 # Rows scored by one call of PredictPipeline.run_pipeline_batch
+    flask_requests = 500 # Requests sent to every Flask endpoint
+    flask_concurrency = 8 # Clients sending those requests at the same time
+    gunicorn_workers = None # Worker processes of the production server benchmark, None uses all cores
+    server_start_timeout = 60
+    results_path = os.path.join("benchmarks", "results", "latest.json")
+    baseline_path = os.path.join("benchmarks", "results", "baseline.json")
+    tolerance = 0.10 # Relative change of a metric beyond which it counts as a regression or an improvement
+    repeat = 3 # Stages are run this many times and the fastest run is reported, which filters out noise from other processes
+
+def timed(func, *args, repeat = 1, **kwargs):
+    '''
+    Call func repeat times and return a tuple of format (result of the last call, wall clock seconds of the fastest call)
+    '''
+    best_seconds = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        best_seconds = min(best_seconds, time.perf_counter() - start_time)
+    return (result, best_seconds)
+
+def latency_metrics(prefix, latencies):
+    '''
+    Return the p50, p95 and p99 latencies in milliseconds of given latencies in seconds, keyed under prefix
+    '''
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {f'{prefix}.p50_ms': p50, f'{prefix}.p95_ms': p95, f'{prefix}.p99_ms': p99}
+
+def benchmark_training_stages(csv_path, benchmark_config, metrics):
+    '''
+    Time ingestion and, for every candidate of models_data, pre-processing, resampling, training, evaluation and the evaluation report.
+    The components are called directly, so the dataset and transformation caches of the training pipeline do not hide the cost of a stage.
+    Returns the candidate with the best test score along with the train and test sets.
+    '''
+    (X_train, X_test, Y_train, Y_test), metrics['ingest_data.seconds'] = timed(DataIngestion().ingest_data, csv_path, 'Class',
+                                                                                benchmark_config.test_size, benchmark_config.random_state,
+                                                                                repeat = benchmark_config.repeat)
+    metrics['ingest_data.rows_per_second'] = (len(X_train) + len(X_test)) / metrics['ingest_data.seconds']
+
+    training_pipeline = TrainingPipeline()
+    candidates = []
+    for model in load_object(benchmark_config.models_data_path):
+        candidate = training_pipeline.prepare_candidate(model)
+        name = candidate['name']
+
+        X_train_transformed, metrics[f'fit_transform.{name}.seconds'] = timed(DataPreProcessor().fit_transform, candidate['pre-processor'], X_train, Y_train,
+                                                                              repeat = benchmark_config.repeat)
+        (X_train_transformed, Y_train_transformed), metrics[f'fit_resample.{name}.seconds'] = timed(DataResampler().fit_resample, candidate['resampler'],
+                                                                                                   X_train_transformed, Y_train,
+                                                                                                   repeat = benchmark_config.repeat)
+        _, metrics[f'train_model.{name}.seconds'] = timed(ModelTrainer().train_model, candidate['model'], candidate['best_params'],
+                                                          X_train_transformed, Y_train_transformed, repeat = benchmark_config.repeat)
+        candidate['test_score'], metrics[f'evaluate.{name}.seconds'] = timed(ModelEvaluator().evaluate, candidate['pre-processor'], candidate['model'],
+                                                                             X_test, Y_test, area_under_precision_recall_curve, 'test',
+                                                                             repeat = benchmark_config.repeat)
+        _, metrics[f'evaluate_report.{name}.seconds'] = timed(ModelEvaluator().evaluate_report, candidate['pre-processor'], candidate['model'],
+                                                              X_test, Y_test, 'test', repeat = benchmark_config.repeat)
+        candidates.append(candidate)
+
+    best_candidate = candidates[training_pipeline.find_best_model(candidates)]
+    return (best_candidate, X_train, X_test)
+
+def benchmark_prediction(X_test, benchmark_config, metrics):
+    '''
+    Time single-row and batch predictions of PredictPipeline, with the model registry warmed up beforehand
+    '''
+    prediction_pipeline = PredictPipeline()
+    prediction_pipeline.load_artifacts()
+
+    rows = [X_test.iloc[[i % len(X_test)]] for i in range(benchmark_config.single_row_requests)]
+    latencies = [timed(prediction_pipeline.run_pipeline, row)[1] for row in rows]
+    metrics.update(latency_metrics('predict_single', latencies))
+
+    X_batch = pd.concat([X_test] * (benchmark_config.batch_rows // len(X_test) + 1)).iloc[:benchmark_config.batch_rows]
+    _, seconds = timed(prediction_pipeline.run_pipeline_batch, X_batch, repeat = benchmark_config.repeat)
+    metrics['predict_batch.seconds'] = seconds
+    metrics['predict_batch.rows_per_second'] = len(X_batch) / seconds
+
+def benchmark_http(base_url, name_prefix, X_test, benchmark_config, metrics):
+    '''
+    Measure the throughput and latency of the /predict_page and /predict_batch endpoints of the app served at base_url
+    '''
+    def post(path, body):
+        request = urllib.request.Request(base_url + path, data = json.dumps(body).encode(), headers = {'Content-Type': 'application/json'})
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - start_time
+
+    records = X_test.to_dict('records')
+    batch_records = records[:1000]
+    endpoints = {f'{name_prefix}_predict_page': ('/predict_page', [records[i % len(records)] for i in range(benchmark_config.flask_requests)]),
+                 f'{name_prefix}_predict_batch': ('/predict_batch', [batch_records] * max(1, benchmark_config.flask_requests // 10))}
+
+    for name, (path, bodies) in endpoints.items():
+        post(path, bodies[0]) # Warming up the endpoint
+        with ThreadPoolExecutor(max_workers = benchmark_config.flask_concurrency) as executor:
+            latencies, seconds = timed(lambda: list(executor.map(lambda body: post(path, body), bodies)))
+        metrics[f'{name}.requests_per_second'] = len(bodies) / seconds
+        metrics.update(latency_metrics(name, latencies))
+
+def benchmark_flask(X_test, benchmark_config, metrics):
+    '''
+    Measure the endpoints served over HTTP by a threaded development server in this process
+    '''
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server('127.0.0.1', 0, app, threaded = True)
+    server_thread = threading.Thread(target = server.serve_forever, daemon = True)
+    server_thread.start()
+
+    try:
+        benchmark_http(f'http://127.0.0.1:{server.server_port}', 'flask', X_test, benchmark_config, metrics)
+    finally:
+        server.shutdown()
+        server_thread.join()
+
+def benchmark_gunicorn(work_dir, X_test, benchmark_config, metrics):
+    '''
+    Measure the endpoints served by the production server (gunicorn.conf.py and wsgi.py) started in work_dir,
+    whose artifacts directory holds the model and pre-processor. The time until the server is ready is reported too.
+    '''
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        port = free_socket.getsockname()[1]
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ,
+               PYTHONPATH = os.pathsep.join(filter(None, (repo_dir, os.environ.get('PYTHONPATH')))),
+               PORT = str(port),
+               WEB_CONCURRENCY = str(benchmark_config.gunicorn_workers or os.cpu_count() or 1),
+               RELOAD_ON_NEW_ARTIFACTS = '0')
+    base_url = f'http://127.0.0.1:{port}'
+
+    # The logger reads its config relative to the working directory
+    if not os.path.exists(os.path.join(work_dir, 'src')):
+        os.symlink(os.path.join(repo_dir, 'src'), os.path.join(work_dir, 'src'))
+
+    start_time = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(repo_dir, 'gunicorn.conf.py'), 'wsgi:app'],
+                              cwd = work_dir, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with code {server.returncode}')
+            if time.perf_counter() - start_time > benchmark_config.server_start_timeout:
+                raise RuntimeError('gunicorn did not become ready in time')
+            try:
+                with urllib.request.urlopen(base_url + '/readyz') as response:
+                    response.read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        metrics['gunicorn.seconds_to_ready'] = time.perf_counter() - start_time
+
+        benchmark_http(base_url, 'gunicorn', X_test, benchmark_config, metrics)
+    finally:
+        server.terminate()
+        server.wait()
+
+def run_benchmarks(benchmark_config, skip_flask = False, gunicorn = False):
+    '''
+    Run every benchmark on freshly generated synthetic data and return the results as a json serializable dictionary
+    '''
+    work_dir = tempfile.mkdtemp(prefix = 'benchmarks-')
+    saved_paths = (PredictionPipelineConfig.model_file_path, PredictionPipelineConfig.preprocessor_path)
+    metrics = {}
+
+    try:
+        csv_path = write_creditcard_csv(os.path.join(work_dir, 'creditcard.csv'), benchmark_config.n_rows, benchmark_config.fraud_rate,
+                                        random_state = benchmark_config.random_state)
+
+        best_candidate, X_train, X_test = benchmark_training_stages(csv_path, benchmark_config, metrics)
+
+        # Pointing the prediction pipeline, and the app with it, at the artifacts of the best candidate
+        PredictionPipelineConfig.model_file_path = os.path.join(work_dir, 'artifacts', 'model.pkl')
+        PredictionPipelineConfig.preprocessor_path = os.path.join(work_dir, 'artifacts', 'preprocessor.pkl')
+        save_object(PredictionPipelineConfig.model_file_path, best_candidate['model'])
+        save_object(PredictionPipelineConfig.preprocessor_path, best_candidate['pre-processor'])
+
+        benchmark_prediction(X_test, benchmark_config, metrics)
+        if not skip_flask:
+            benchmark_flask(X_test, benchmark_config, metrics)
+        if gunicorn:
+            benchmark_gunicorn(work_dir, X_test, benchmark_config, metrics)
+    finally:
+        PredictionPipelineConfig.model_file_path, PredictionPipelineConfig.preprocessor_path = saved_paths
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    return {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'cpu_count': os.cpu_count(),
+                            'numpy': np.__version__,
+                            'pandas': pd.__version__,
+                            'scikit-learn': sklearn.__version__},
+            'settings': {'n_rows': benchmark_config.n_rows,
+                         'fraud_rate': benchmark_config.fraud_rate,
+                         'random_state': benchmark_config.random_state,
+                         'repeat': benchmark_config.repeat,
+                         'single_row_requests': benchmark_config.single_row_requests,
+                         'batch_rows': benchmark_config.batch_rows,
+                         'flask_requests': benchmark_config.flask_requests,
+                         'flask_concurrency': benchmark_config.flask_concurrency,
+                         'gunicorn_workers': benchmark_config.gunicorn_workers},
+            'best_model': best_candidate['name'],
+            'metrics': {name: float(value) for name, value in metrics.items()}}
+
+def compare_results(results, baseline, tolerance):
+    '''
+    Compare the metrics of results against those of a baseline and return one row per common metric.
+    Metrics ending in _per_second are better when higher, all others (seconds and latencies) when lower.
+    '''
+    rows = []
+    for name in sorted(set(results['metrics']) & set(baseline['metrics'])):
+        current, previous = results['metrics'][name], baseline['metrics'][name]
+        change = (current - previous) / previous if previous else 0.0
+        # Positive when the metric got better
+        gain = change if name.endswith('_per_second') else -change
+        status = 'improved' if gain > tolerance else 'regressed' if gain < -tolerance else 'unchanged'
+        rows.append({'metric': name, 'baseline': previous, 'current': current, 'change': change, 'status': status})
+    return rows
+
+def print_comparison(rows):
+    print(f"{'metric':<48} {'baseline':>12} {'current':>12} {'change':>9}  status")
+    for row in rows:
+        print(f"{row['metric']:<48} {row['baseline']:>12.4g} {row['current']:>12.4g} {row['change']:>+9.1%}  {row['status']}")
+
+def main(argv = None):
+    benchmark_config = BenchmarkConfig()
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the training and prediction pipelines on synthetic data')
+    parser.add_argument('--rows', type = int, default = benchmark_config.n_rows)
+    parser.add_argument('--fraud-rate', type = float, default = benchmark_config.fraud_rate)
+    parser.add_argument('--random-state', type = int, default = benchmark_config.random_state)
+    parser.add_argument('--output', default = benchmark_config.results_path, help = 'json file the results are written to')
+    parser.add_argument('--baseline', default = benchmark_config.baseline_path, help = 'json file of earlier results to compare against')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'also save the results as the new baseline')
+    parser.add_argument('--tolerance', type = float, default = benchmark_config.tolerance)
+    parser.add_argument('--repeat', type = int, default = benchmark_config.repeat, help = 'runs per stage, the fastest is reported')
+    parser.add_argument('--skip-flask', action = 'store_true', help = 'skip the Flask endpoint benchmarks')
+    parser.add_argument('--gunicorn', action = 'store_true', help = 'also benchmark the endpoints served by the production server')
+    parser.add_argument('--gunicorn-workers', type = int, default = benchmark_config.gunicorn_workers)
+    parser.add_argument('--fail-on-regression', action = 'store_true', help = 'exit with status 1 if any metric regressed')
+    args = parser.parse_args(argv)
+
+    benchmark_config.n_rows = args.rows
+    benchmark_config.fraud_rate = args.fraud_rate
+    benchmark_config.random_state = args.random_state
+    benchmark_config.repeat = args.repeat
+
+    benchmark_config.gunicorn_workers = args.gunicorn_workers
+
+    results = run_benchmarks(benchmark_config, args.skip_flask, args.gunicorn)
+    save_json(args.output, results)
+    print(f'Benchmark results written to {args.output}')
+
+    regressed = False
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        baseline = load_json(args.baseline)
+        if baseline['settings'] != results['settings'] or baseline['environment'] != results['environment']:
+            print(f'Warning: baseline {args.baseline} was recorded with different settings or environment')
+        rows = compare_results(results, baseline, args.tolerance)
+        print_comparison(rows)
+        regressed = any(row['status'] == 'regressed' for row in rows)
+    else:
+        for name, value in results['metrics'].items():
+            print(f'{name:<48} {value:>12.4g}')
+
+    if args.save_baseline:
+        save_json(args.baseline, results)
+        print(f'Baseline saved to {args.baseline}')
+
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+@dataclass
+class SyntheticDataConfig:
+    '''
+    A data class for storing settings of the synthetic data generator
+    '''
+    n_rows = 100000
+    fraud_rate = 0.00172 # Share of fraudulent transactions in the Kaggle data set
+    duplicate_rate = 0.0038 # Share of rows repeated exactly, the ingestion drops them
+    time_span_seconds = 172800 # Two days of transactions
+    amount_log_mean = 3.0 # Amount is log-normal with a median of about 20 and a long right tail
+    amount_log_std = 1.5
+    fraud_shift_low = 0.5 # Fraudulent transactions have the V columns shifted by a per column amount drawn from [low, high)
+    fraud_shift_high = 2.5
+    random_state = 42
+
+def generate_creditcard_data(n_rows = None, fraud_rate = None, duplicate_rate = None, random_state = None):
+    '''
+    Generate a data frame in the schema of the credit card data set (Time, V1 to V28, Amount, Class).
+    V columns are standard normal for genuine transactions and shifted per column for fraudulent ones, Time is sorted
+    over two days and Amount is log-normal, so pre-processing, resampling and training behave as on the real data.
+    '''
+    synthetic_data_config = SyntheticDataConfig()
+    n_rows = synthetic_data_config.n_rows if n_rows is None else n_rows
+    fraud_rate = synthetic_data_config.fraud_rate if fraud_rate is None else fraud_rate
+    duplicate_rate = synthetic_data_config.duplicate_rate if duplicate_rate is None else duplicate_rate
+    random_state = synthetic_data_config.random_state if random_state is None else random_state
+
+    rng = np.random.default_rng(random_state)
+    n_duplicates = int(n_rows * duplicate_rate)
+    n_unique = n_rows - n_duplicates
+
+    labels = (rng.random(n_unique) < fraud_rate).astype(np.int64)
+    # A few fraudulent transactions at least, so that stratified splits and SMOTE neighbours work on small data
+    min_frauds = min(10, n_unique)
+    if labels.sum() < min_frauds:
+        labels[rng.choice(n_unique, size = min_frauds, replace = False)] = 1
+
+    V = rng.standard_normal((n_unique, 28))
+    fraud_shift = rng.uniform(synthetic_data_config.fraud_shift_low, synthetic_data_config.fraud_shift_high, size = 28)
+    V[labels == 1] += fraud_shift
+
+    df = pd.DataFrame(V, columns = [f'V{i}' for i in range(1, 29)])
+    df.insert(0, 'Time', np.sort(rng.uniform(0, synthetic_data_config.time_span_seconds, size = n_unique)).round())
+    df['Amount'] = rng.lognormal(synthetic_data_config.amount_log_mean, synthetic_data_config.amount_log_std, size = n_unique).round(2)
+    df['Class'] = labels
+
+    if n_duplicates:
+        duplicates = df.iloc[rng.choice(n_unique, size = n_duplicates)]
+        df = pd.concat((df, duplicates)).sort_values('Time', kind = 'stable').reset_index(drop = True)
+
+    return df
+
+def write_creditcard_csv(path, n_rows = None, fraud_rate = None, duplicate_rate = None, random_state = None):
+    '''
+    Generate synthetic credit card data and save it as a csv file in given path, returning the path
+    '''
+    dir_path = os.path.dirname(path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok = True)
+
+    generate_creditcard_data(n_rows, fraud_rate, duplicate_rate, random_state).to_csv(path, index = False)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Generate synthetic data in the schema of the credit card data set')
+    parser.add_argument('output_path')
+    parser.add_argument('--rows', type = int, default = None)
+    parser.add_argument('--fraud-rate', type = float, default = None)
+    parser.add_argument('--duplicate-rate', type = float, default = None)
+    parser.add_argument('--random-state', type = int, default = None)
+    args = parser.parse_args()
+
+    write_creditcard_csv(args.output_path, args.rows, args.fraud_rate, args.duplicate_rate, args.random_state)
@@ -0,0 +1,52 @@
+'''
+gunicorn settings of the production server, every setting can be overridden with the environment variable next to it
+'''
+import os
+import time
+import signal
+import threading
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count())) # Worker processes
+threads = int(os.environ.get('GUNICORN_THREADS', '4')) # Threads per worker process
+worker_class = 'gthread'
+preload_app = True # Load and warm up the model in the master, see wsgi.py
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30')) # Time given to a worker to finish its requests on reload
+keepalive = 5
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') # e.g. '-' for stdout, no access log by default
+
+reload_on_new_artifacts = os.environ.get('RELOAD_ON_NEW_ARTIFACTS', '1') == '1'
+artifacts_check_interval = float(os.environ.get('ARTIFACTS_CHECK_INTERVAL', '5')) # Seconds between two checks for new artifacts
+
+def watch_artifacts(server):
+    '''
+    Poll the model and pre-processor files from the gunicorn master. When a new pair lands, warm it up in the master and
+    gracefully replace the workers (SIGHUP), so that new workers are forked with the new model loaded and shared,
+    while old workers finish their requests with the old one.
+    '''
+    from app import warm_up
+    from src.components.model_registry import get_model_registry
+
+    model_registry = get_model_registry()
+    fingerprint = model_registry.fingerprint()
+
+    while True:
+        time.sleep(artifacts_check_interval)
+        if model_registry.fingerprint() == fingerprint:
+            continue
+
+        try:
+            warm_up()
+        except Exception:
+            server.log.exception('Could not warm up new artifacts, retrying on the next check')
+            continue
+
+        fingerprint = model_registry.get().fingerprint
+        server.log.info(f'New artifacts warmed up, version {model_registry.info().get("version")}, reloading workers')
+        os.kill(server.pid, signal.SIGHUP)
+
+def when_ready(server):
+    if reload_on_new_artifacts:
+        threading.Thread(target = watch_artifacts, args = (server,), name = 'artifacts-watcher', daemon = True).start()
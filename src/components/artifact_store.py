@@ -0,0 +1,300 @@
+import os
+import stat
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from src.logger import logging
+from src.utils import save_json, load_json, FileLock
+
+@dataclass
+class ArtifactStoreConfig:
+    '''
+    A data class for storing paths and settings related to the artifact store
+    '''
+    store_dir = os.path.join('artifacts', 'store')
+    artifacts_dir = 'artifacts' # Files of the current version are published here, where the app and the model registry read them
+    keep_versions = 5 # Versions kept besides the current one, older ones are evicted with the blobs no kept version refers to
+    max_size_mb = None # Versions are also evicted, oldest first, while the blobs take more space than this
+    link_published_files = True # Publish files as hard links to their read-only blobs, copies are made where links are not supported
+    background_writes = True # Write and publish the artifacts of training in a background thread, off its critical path
+    chunk_size = 1 << 20 # Bytes read at a time when hashing or copying files
+    published_last = ('meta.json', 'manifest.json', 'model_version.json') # Files readers open first to find the others, placed after every other file in this order
+
+class ArtifactStore:
+    '''
+    A class for keeping every saved version of the artifacts in a content-addressed store.
+    File contents are stored once as read-only blobs named after their sha256, so a file unchanged between versions, e.g. the
+    raw dataset, is only referenced again. A version is a manifest mapping the relative path of every file to its blob; it is
+    written only once all of its blobs are, and made current by atomically replacing the CURRENT pointer. Publishing a version
+    places its files in the artifacts directory one atomic rename at a time, the files they describe before the manifests and
+    the version file last, and removes the files of the previous version which it does not have. Rolling back publishes an earlier manifest, and garbage collection evicts old
+    versions and the blobs only they refer to.
+    '''
+    def __init__(self, store_dir = None, artifacts_dir = None):
+        self.artifact_store_config = ArtifactStoreConfig()
+        self.store_dir = store_dir or self.artifact_store_config.store_dir
+        self.artifacts_dir = artifacts_dir or self.artifact_store_config.artifacts_dir
+        self.blobs_dir = os.path.join(self.store_dir, 'blobs')
+        self.versions_dir = os.path.join(self.store_dir, 'versions')
+        self.staging_root = os.path.join(self.store_dir, 'staging')
+        self.current_path = os.path.join(self.store_dir, 'CURRENT')
+        self.digests_path = os.path.join(self.store_dir, 'file_digests.json')
+        self.lock_path = os.path.join(self.store_dir, '.store.lock')
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256[:2], sha256)
+
+    def file_sha256(self, path):
+        '''
+        Return the sha256 of a file, reading it in chunks
+        '''
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file_obj:
+            for chunk in iter(lambda: file_obj.read(self.artifact_store_config.chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _external_file_sha256(self, path):
+        '''
+        Return the sha256 of a file outside the store, remembered by path, size and modification time so that an
+        unchanged file, like the raw dataset of the last run, is not read again
+        '''
+        digests = load_json(self.digests_path) if os.path.exists(self.digests_path) else {}
+        stat_result = os.stat(path)
+        key = os.path.abspath(path)
+        fingerprint = [stat_result.st_size, stat_result.st_mtime_ns]
+
+        if key in digests and digests[key]['fingerprint'] == fingerprint:
+            return digests[key]['sha256']
+
+        sha256 = self.file_sha256(path)
+        digests[key] = {'fingerprint': fingerprint, 'sha256': sha256}
+        save_json(self.digests_path, digests)
+        return sha256
+
+    def put_file(self, path, move = False):
+        '''
+        Add the contents of a file to the store and return a tuple of format (sha256, size). With move, the file is
+        moved into the store, or removed if the store has it already; otherwise it is copied unless the store has it.
+        The store lock must be held, so that garbage collection does not remove a blob before a manifest refers to it.
+        '''
+        sha256 = self.file_sha256(path) if move else self._external_file_sha256(path)
+        size = os.path.getsize(path)
+        blob_path = self.blob_path(sha256)
+
+        if os.path.exists(blob_path):
+            if move:
+                os.remove(path)
+            return (sha256, size)
+
+        os.makedirs(os.path.dirname(blob_path), exist_ok = True)
+        if move:
+            os.replace(path, blob_path)
+        else:
+            temp_blob_path = f'{blob_path}.{os.getpid()}.tmp'
+            shutil.copyfile(path, temp_blob_path)
+            os.replace(temp_blob_path, blob_path)
+        os.chmod(blob_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        return (sha256, size)
+
+    def staging_dir(self):
+        '''
+        Return a new empty directory, in which the files of a version are written before commit
+        '''
+        os.makedirs(self.staging_root, exist_ok = True)
+        return tempfile.mkdtemp(prefix = 'version-', dir = self.staging_root)
+
+    def commit(self, staging_dir, version, metadata = None, external_files = None):
+        '''
+        Move the files written in staging_dir into the store, add the files of external_files (relative path to a path
+        anywhere, copied unless already stored) and write the manifest of version. Returns the manifest.
+        '''
+        files = {}
+        with FileLock(self.lock_path):
+            for dir_path, _, file_names in os.walk(staging_dir):
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    sha256, size = self.put_file(path, move = True)
+                    files[os.path.relpath(path, staging_dir).replace(os.sep, '/')] = {'sha256': sha256, 'size': size}
+
+            for relative_path, path in (external_files or {}).items():
+                sha256, size = self.put_file(path)
+                files[relative_path] = {'sha256': sha256, 'size': size}
+
+            manifest = {'version': version,
+                        'created_at': time.time(),
+                        'files': files,
+                        'metadata': metadata or {}}
+            save_json(os.path.join(self.versions_dir, f'{version}.json'), manifest)
+
+        shutil.rmtree(staging_dir, ignore_errors = True)
+        logging.info(f'Committed artifacts version {version}, {len(files)} files, {sum(entry["size"] for entry in files.values())} bytes')
+        return manifest
+
+    def load_manifest(self, version):
+        return load_json(os.path.join(self.versions_dir, f'{version}.json'))
+
+    def current_version(self):
+        '''
+        Return the version currently published, or None
+        '''
+        if not os.path.exists(self.current_path):
+            return None
+        return load_json(self.current_path)['version']
+
+    def list_versions(self):
+        '''
+        Return the manifests of every stored version, newest first
+        '''
+        if not os.path.isdir(self.versions_dir):
+            return []
+        manifests = [load_json(os.path.join(self.versions_dir, file_name)) for file_name in os.listdir(self.versions_dir) if file_name.endswith('.json')]
+        return sorted(manifests, key = lambda manifest: manifest['created_at'], reverse = True)
+
+    def _place(self, blob_path, target_path):
+        '''
+        Atomically replace target_path with the contents of a blob, as a hard link to it where possible
+        '''
+        # A file linked to the blob by an earlier publish is in place already, and renaming a link onto it would do nothing
+        if os.path.exists(target_path) and os.path.samefile(blob_path, target_path):
+            return
+
+        os.makedirs(os.path.dirname(target_path) or '.', exist_ok = True)
+        temp_path = f'{target_path}.{os.getpid()}.tmp'
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+
+        try:
+            if not self.artifact_store_config.link_published_files:
+                raise OSError('Hard links are switched off')
+            os.link(blob_path, temp_path)
+        except OSError:
+            shutil.copyfile(blob_path, temp_path)
+        os.replace(temp_path, target_path)
+
+    def _placement_order(self, relative_path):
+        published_last = self.artifact_store_config.published_last
+        file_name = relative_path.rsplit('/', 1)[-1]
+        return published_last.index(file_name) + 1 if file_name in published_last else 0
+
+    def publish(self, version):
+        '''
+        Place the files of version in the artifacts directory and make it the current version.
+        Data files are placed before the manifests describing them, e.g. the weights of the kernel artifact before its
+        manifest.json, and the version file (model_version.json) last, so a reader which finds a new manifest finds its files
+        and the model registry only picks the new version up once all of its files are in place. Files of the previous
+        version missing from this one are removed afterwards.
+        Returns the manifest.
+        '''
+        with FileLock(self.lock_path):
+            manifest = self.load_manifest(version)
+            previous_version = self.current_version()
+            previous_files = self.load_manifest(previous_version)['files'] if previous_version and previous_version != version else {}
+
+            for relative_path in sorted(manifest['files'], key = self._placement_order):
+                self._place(self.blob_path(manifest['files'][relative_path]['sha256']), os.path.join(self.artifacts_dir, relative_path))
+
+            for relative_path in set(previous_files) - set(manifest['files']):
+                try:
+                    os.remove(os.path.join(self.artifacts_dir, relative_path))
+                except FileNotFoundError:
+                    pass
+
+            save_json(self.current_path, {'version': version, 'previous': previous_version, 'published_at': time.time()})
+
+        logging.info(f'Published artifacts version {version}')
+        return manifest
+
+    def rollback(self, version = None):
+        '''
+        Publish given version again, by default the newest version older than the current one. Returns its manifest.
+        '''
+        if version is None:
+            current_version = self.current_version()
+            manifests = self.list_versions()
+            versions = [manifest['version'] for manifest in manifests]
+            if current_version not in versions or versions.index(current_version) + 1 >= len(versions):
+                raise ValueError('There is no earlier version to roll back to.')
+            version = versions[versions.index(current_version) + 1]
+        elif not os.path.exists(os.path.join(self.versions_dir, f'{version}.json')):
+            raise ValueError(f'Version {version} is not in the artifact store.')
+
+        logging.info(f'Rolling back artifacts from version {self.current_version()} to {version}')
+        return self.publish(version)
+
+    def gc(self, keep_versions = None, max_size_mb = None):
+        '''
+        Evict the versions beyond the newest keep_versions besides the current one, then older ones while the blobs take
+        more than max_size_mb, and remove the blobs no remaining version refers to. Returns a dictionary of what was removed.
+        '''
+        keep_versions = self.artifact_store_config.keep_versions if keep_versions is None else keep_versions
+        max_size_mb = self.artifact_store_config.max_size_mb if max_size_mb is None else max_size_mb
+
+        with FileLock(self.lock_path):
+            current_version = self.current_version()
+            manifests = self.list_versions()
+            kept = [manifest for manifest in manifests if manifest['version'] == current_version]
+            others = [manifest for manifest in manifests if manifest['version'] != current_version]
+            kept, evicted = kept + others[:keep_versions], others[keep_versions:]
+
+            def blob_bytes(manifests):
+                sizes = {entry['sha256']: entry['size'] for manifest in manifests for entry in manifest['files'].values()}
+                return sum(sizes.values())
+
+            if max_size_mb is not None:
+                while len(kept) > 1 and blob_bytes(kept) > max_size_mb * 2**20 and kept[-1]['version'] != current_version:
+                    evicted.append(kept.pop())
+
+            for manifest in evicted:
+                os.remove(os.path.join(self.versions_dir, f'{manifest["version"]}.json'))
+
+            referenced = {entry['sha256'] for manifest in kept for entry in manifest['files'].values()}
+            removed_blobs, removed_bytes = 0, 0
+            if os.path.isdir(self.blobs_dir):
+                for dir_path, _, file_names in os.walk(self.blobs_dir):
+                    for file_name in file_names:
+                        if file_name not in referenced and not file_name.endswith('.tmp'):
+                            path = os.path.join(dir_path, file_name)
+                            removed_bytes += os.path.getsize(path)
+                            os.remove(path)
+                            removed_blobs += 1
+
+        if evicted or removed_blobs:
+            logging.info(f'Evicted {len(evicted)} artifacts versions and {removed_blobs} blobs, {removed_bytes} bytes')
+        return {'evicted_versions': [manifest['version'] for manifest in evicted], 'removed_blobs': removed_blobs, 'removed_bytes': removed_bytes}
+
+_writer = None
+_pending_writes = []
+_writer_lock = threading.Lock()
+
+def submit_write(function, *args, **kwargs):
+    '''
+    Run function in the background thread writing artifacts and return its future. Writes run one at a time in order of
+    submission, and the interpreter waits for pending writes before it exits.
+    '''
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'artifact-writer')
+        future = _writer.submit(function, *args, **kwargs)
+        _pending_writes.append(future)
+    return future
+
+def wait_for_writes():
+    '''
+    Wait until every submitted write is done, then raise the error of the first one that failed, if any
+    '''
+    with _writer_lock:
+        futures = list(_pending_writes)
+        _pending_writes.clear()
+
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
@@ -0,0 +1,178 @@
+import os
+import numbers
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn.utils import check_random_state
+from sklearn.utils._param_validation import Interval
+from threadpoolctl import threadpool_limits
+from imblearn.over_sampling import SMOTE
+from imblearn.over_sampling.base import BaseOverSampler
+
+from src.logger import logging
+
+class MinorityNeighborIndex:
+    '''
+    A class holding the k nearest neighbours of every row of a minority class, each row excluding itself, sorted by distance.
+    Candidate neighbours are found by brute force in float32 chunks, in parallel threads, and re-ranked with exact distances
+    in the dtype of the data. In approximate mode candidates are searched in a random projection of the rows to
+    approximate_dim dimensions, so that very large minority classes can be indexed faster at the cost of exactness.
+    '''
+    def __init__(self, X, k_neighbors, chunk_size = 4096, n_jobs = None, approximate = False, approximate_dim = 8, random_state = None):
+        self.X = X
+        self.k_neighbors = k_neighbors
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.approximate = approximate
+
+        # Searching a few more candidates than required, so that float32 rounding does not leave out a true neighbour
+        self.n_candidates = min(len(X), (4 if approximate else 2) * (k_neighbors + 1))
+
+        X_search = X.astype(np.float32)
+        if approximate and X.shape[1] > approximate_dim:
+            projection = check_random_state(random_state).standard_normal((X.shape[1], approximate_dim)).astype(np.float32)
+            X_search = X_search @ (projection / np.sqrt(approximate_dim))
+        self.X_search = np.ascontiguousarray(X_search)
+        self.squared_norms = np.einsum('ij,ij->i', self.X_search, self.X_search)
+
+        self.neighbors = self._build()
+
+    def _query_chunk(self, start):
+        '''
+        Return the k nearest neighbours of rows start to start + chunk_size, excluding the rows themselves
+        '''
+        stop = min(start + self.chunk_size, len(self.X))
+        queries = self.X_search[start:stop]
+
+        # Squared euclidean distances through one matrix product per chunk
+        distances = self.squared_norms[start:stop, None] - 2 * queries @ self.X_search.T + self.squared_norms[None, :]
+        if self.n_candidates < len(self.X):
+            candidates = np.argpartition(distances, self.n_candidates - 1, axis = 1)[:, :self.n_candidates]
+        else:
+            candidates = np.broadcast_to(np.arange(len(self.X)), distances.shape)
+
+        # Exact distances of the candidates, sorted with ties broken by index as a brute force search does
+        exact_distances = ((self.X[candidates] - self.X[start:stop, None, :]) ** 2).sum(axis = 2)
+        order = np.lexsort((candidates, exact_distances), axis = 1)
+        candidates = np.take_along_axis(candidates, order, axis = 1)
+
+        # The row itself comes first (at distance 0) and is dropped, as SMOTE does
+        return candidates[:, 1:self.k_neighbors + 1]
+
+    def _build(self):
+        starts = range(0, len(self.X), self.chunk_size)
+        if self.n_jobs == 1 or len(starts) == 1:
+            return np.vstack([self._query_chunk(start) for start in starts])
+
+        # Threads share the index, and BLAS is limited to one thread each so that they do not oversubscribe the cores
+        with threadpool_limits(limits = 1), ThreadPoolExecutor(max_workers = self.n_jobs) as executor:
+            return np.vstack(list(executor.map(self._query_chunk, starts)))
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+_index_cache_size = 8
+
+def get_neighbor_index(X, k_neighbors, chunk_size = 4096, n_jobs = None, approximate = False, approximate_dim = 8, random_state = None):
+    '''
+    Return the MinorityNeighborIndex of X, reusing the one built earlier in this process for the same rows and settings,
+    so that candidates resampling identically pre-processed data build it once
+    '''
+    key = (hashlib.sha256(np.ascontiguousarray(X).tobytes()).hexdigest(), X.shape, X.dtype.str, k_neighbors,
+           approximate, approximate_dim if approximate else None, random_state if approximate else None)
+
+    with _index_cache_lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+
+    logging.info(f'Building the {"approximate " if approximate else ""}neighbour index of {len(X)} minority rows')
+    index = MinorityNeighborIndex(X, k_neighbors, chunk_size, n_jobs, approximate, approximate_dim, random_state)
+
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > _index_cache_size:
+            _index_cache.popitem(last = False)
+
+    return index
+
+class ChunkedSMOTE(BaseOverSampler):
+    '''
+    A drop-in replacement of imblearn's SMOTE for large data sets.
+    The neighbour index of the minority class is built once per distinct minority data (see get_neighbor_index),
+    neighbour queries run in parallel float32 chunks, and the resampled data is written into one preallocated array
+    block by block instead of being stacked from copies. Given the same random_state it draws the same random numbers
+    as SMOTE, so the result is the same as SMOTE's up to ties between neighbour distances.
+    '''
+    _parameter_constraints: dict = {
+        **BaseOverSampler._parameter_constraints,
+        "k_neighbors": [Interval(numbers.Integral, 1, None, closed = "left")],
+        "chunk_size": [Interval(numbers.Integral, 1, None, closed = "left")],
+        "n_jobs": [None, Interval(numbers.Integral, 1, None, closed = "left")],
+        "approximate": ["boolean"],
+        "approximate_dim": [Interval(numbers.Integral, 1, None, closed = "left")],
+    }
+
+    def __init__(self, *, sampling_strategy = 'auto', random_state = None, k_neighbors = 5, chunk_size = 4096, n_jobs = None,
+                 approximate = False, approximate_dim = 8):
+        super().__init__(sampling_strategy = sampling_strategy)
+        self.random_state = random_state
+        self.k_neighbors = k_neighbors
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.approximate = approximate
+        self.approximate_dim = approximate_dim
+
+    def _fit_resample(self, X, y):
+        if not isinstance(X, np.ndarray):
+            raise TypeError('ChunkedSMOTE supports dense data only')
+
+        n_new = sum(self.sampling_strategy_.values())
+        X_resampled = np.empty((len(X) + n_new, X.shape[1]), dtype = X.dtype)
+        y_resampled = np.empty(len(X) + n_new, dtype = y.dtype)
+        X_resampled[:len(X)] = X
+        y_resampled[:len(X)] = y
+
+        position = len(X)
+        for class_sample, n_samples in self.sampling_strategy_.items():
+            if n_samples == 0:
+                continue
+
+            X_class = X[y == class_sample]
+            if len(X_class) <= self.k_neighbors:
+                raise ValueError(f'Expected more than k_neighbors = {self.k_neighbors} samples of class {class_sample}, got {len(X_class)}')
+
+            neighbors = get_neighbor_index(X_class, self.k_neighbors, self.chunk_size, self.n_jobs,
+                                           self.approximate, self.approximate_dim, self.random_state).neighbors
+
+            # Same random draws as SMOTE._make_samples
+            random_state = check_random_state(self.random_state)
+            samples_indices = random_state.randint(low = 0, high = neighbors.size, size = n_samples)
+            steps = random_state.uniform(size = n_samples)[:, np.newaxis]
+            rows = np.floor_divide(samples_indices, neighbors.shape[1])
+            cols = np.mod(samples_indices, neighbors.shape[1])
+
+            # Generating synthetic rows block by block straight into the output
+            for start in range(0, n_samples, self.chunk_size):
+                block = slice(start, start + self.chunk_size)
+                base = X_class[rows[block]]
+                diffs = X_class[neighbors[rows[block], cols[block]]] - base
+                X_resampled[position + start:position + start + len(base)] = base + steps[block] * diffs
+
+            y_resampled[position:position + n_samples] = class_sample
+            position += n_samples
+
+        return (X_resampled, y_resampled)
+
+def as_chunked_smote(resampler, **settings):
+    '''
+    Return a ChunkedSMOTE with the parameters of resampler if it is an imblearn SMOTE with an integer k_neighbors, else resampler itself
+    '''
+    if type(resampler) is SMOTE and isinstance(resampler.k_neighbors, numbers.Integral):
+        return ChunkedSMOTE(sampling_strategy = resampler.sampling_strategy,
+                            random_state = resampler.random_state,
+                            k_neighbors = resampler.k_neighbors,
+                            **settings)
+    return resampler
@@ -0,0 +1,193 @@
+import os
+import time
+import multiprocessing
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from threadpoolctl import threadpool_limits
+
+from src.components.data_transformation import DataPreProcessor
+from src.components.data_resampler import DataResampler
+from src.components.model_trainer import ModelTrainer
+from src.components.model_evaluator import ModelEvaluator, metric_greater_is_better
+from src.components.shared_data import SharedDataStore, load_shared
+from src.logger import logging
+
+@dataclass
+class CrossValidationConfig:
+    '''
+    A data class for storing settings related to cross-validated model selection
+    '''
+    n_splits = int(os.environ.get('CV_FOLDS', '5'))
+    random_state = 42
+    n_workers = -1 # Processes running fold × candidate fits, -1 uses all cores
+    mp_start_method = "spawn"
+
+def stratified_fold_ids(Y, n_splits, random_state = 42):
+    '''
+    Return an int8 array holding the fold of every row of Y, folds keeping the class proportions of Y.
+    One array of fold ids stands for all the train and validation index arrays of the folds.
+    '''
+    fold_ids = np.empty(len(Y), dtype = np.int8)
+    folds = StratifiedKFold(n_splits = n_splits, shuffle = True, random_state = random_state)
+    for fold, (_, validation_positions) in enumerate(folds.split(np.zeros((len(Y), 1)), np.asarray(Y))):
+        fold_ids[validation_positions] = fold
+
+    return fold_ids
+
+def evaluate_fold(candidate, fold, X, Y, fold_ids):
+    '''
+    Fit unfitted copies of the pre-processor, resampler and model of a candidate on the rows of X, Y outside fold and
+    return the evaluation report of the rows in fold, along with the seconds it took.
+    Pre-processing and resampling are fitted within the fold, so the validation rows are never seen by them.
+    '''
+    start_time = time.perf_counter()
+    pre_processor, resampler, model = (clone(candidate[key]) for key in ('pre-processor', 'resampler', 'model'))
+
+    is_validation = fold_ids == fold
+    X_fold, Y_fold = X.iloc[np.flatnonzero(~is_validation)], Y.iloc[np.flatnonzero(~is_validation)]
+
+    X_fold_transformed = DataPreProcessor().fit_transform(pre_processor, X_fold, Y_fold)
+    X_fold_resampled, Y_fold_resampled = DataResampler().fit_resample(resampler, X_fold_transformed, Y_fold)
+    ModelTrainer().train_model(model, candidate['best_params'], X_fold_resampled, Y_fold_resampled)
+
+    report = ModelEvaluator().evaluate_report(pre_processor, model, X.iloc[np.flatnonzero(is_validation)], Y.iloc[np.flatnonzero(is_validation)], f'fold {fold}')
+    return {'fold': fold, 'report': report, 'seconds': time.perf_counter() - start_time}
+
+def evaluate_fold_in_worker(candidate, fold, shared_data, n_threads):
+    '''
+    Evaluate one fold of one candidate inside a worker process, on train data and fold ids memory-mapped from a SharedDataStore.
+    The estimator and the native thread pools are limited to n_threads.
+    '''
+    X, Y, fold_ids = (load_shared(shared_data[name]) for name in ('X_train', 'Y_train', 'fold_ids'))
+
+    if 'n_jobs' in candidate['model'].get_params():
+        candidate['model'].set_params(n_jobs = n_threads)
+
+    with threadpool_limits(limits = n_threads):
+        return evaluate_fold(candidate, fold, X, Y, fold_ids)
+
+class CrossValidation:
+    '''
+    A class for choosing among the candidates of models_data on stratified k-fold cross-validation of the train set instead of
+    a single test split. Fold ids are computed once and shared with the worker processes through memory-mapped shared memory
+    along with the train set, and every (candidate, fold) pair is a task of one process pool, so k folds of n candidates
+    take about k * n / workers fits of wall time. The candidate with the best mean score is then trained on the whole
+    train set and evaluated on the test set, as the saved model and the score threshold are.
+    '''
+    def __init__(self, training_pipeline, cross_validation_config = None):
+        self.training_pipeline = training_pipeline
+        self.cross_validation_config = cross_validation_config or CrossValidationConfig()
+
+    def cross_validate(self, models_data, X_train, Y_train, n_workers = None):
+        '''
+        Return a dictionary of the fold results of every candidate of models_data, by candidate name.
+        A candidate which fails on any fold gets an 'error' entry instead of fold results.
+        '''
+        n_splits = self.cross_validation_config.n_splits
+        if n_workers is None:
+            n_workers = self.cross_validation_config.n_workers
+        if n_workers == -1:
+            n_workers = os.cpu_count()
+        n_workers = max(1, min(n_workers, len(models_data) * n_splits))
+
+        fold_ids = stratified_fold_ids(Y_train, n_splits, self.cross_validation_config.random_state)
+
+        # Candidates are prepared once, with the resampler the training pipeline would use, and cloned for every fold
+        candidates = []
+        for model in models_data:
+            candidate = self.training_pipeline.prepare_candidate(model)
+            candidate['resampler'] = self.training_pipeline.scalable_resampler(candidate['resampler'])
+            candidates.append(candidate)
+        results = {candidate['name']: {'folds': [None] * n_splits} for candidate in candidates}
+
+        def record(candidate, fold, run):
+            try:
+                results[candidate['name']]['folds'][fold] = run()
+            except Exception as e:
+                results[candidate['name']]['error'] = f'{type(e).__name__}: {e}'
+                logging.error(f'Cross-validation of model - {candidate['name'].replace("_", " ")} failed on fold {fold}.', exc_info = True)
+
+        if n_workers == 1:
+            for candidate in candidates:
+                self.training_pipeline.report_progress(f'cross_validate_{candidate['name']}', 'started')
+                for fold in range(n_splits):
+                    record(candidate, fold, lambda: evaluate_fold(candidate, fold, X_train, Y_train, fold_ids))
+                self.training_pipeline.report_progress(f'cross_validate_{candidate['name']}', 'finished')
+            return results
+
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        logging.info(f'Cross-validating {len(candidates)} candidates on {n_splits} folds with {n_workers} workers of {n_threads} threads each...')
+
+        with SharedDataStore() as shared_data_store:
+            shared_data = {'X_train': shared_data_store.share('X_train', X_train),
+                           'Y_train': shared_data_store.share('Y_train', Y_train),
+                           'fold_ids': shared_data_store.share('fold_ids', fold_ids)}
+
+            mp_context = multiprocessing.get_context(self.cross_validation_config.mp_start_method)
+            with ProcessPoolExecutor(max_workers = n_workers, mp_context = mp_context) as executor:
+                futures = {(candidate['name'], fold): executor.submit(evaluate_fold_in_worker, candidate, fold, shared_data, n_threads)
+                           for candidate in candidates for fold in range(n_splits)}
+                for candidate in candidates:
+                    self.training_pipeline.report_progress(f'cross_validate_{candidate['name']}', 'started')
+
+                try:
+                    for candidate in candidates:
+                        for fold in range(n_splits):
+                            record(candidate, fold, futures[(candidate['name'], fold)].result)
+                        self.training_pipeline.report_progress(f'cross_validate_{candidate['name']}', 'finished')
+                except BaseException:
+                    for future in futures.values():
+                        future.cancel()
+                    raise
+
+        return results
+
+    def run(self, models_data, X_train, Y_train, X_test, Y_test, n_workers = None):
+        '''
+        Cross-validate models_data and return a tuple of format (best candidate trained on the full train set, report).
+        The report has the score of every fold and their mean, standard deviation and variance for every candidate,
+        on the selection metric of the training pipeline (PR-AUC by default).
+        '''
+        start_time = time.perf_counter()
+        metric = self.training_pipeline.training_pipeline_config.selection_metric or 'pr_auc'
+        greater_is_better = metric_greater_is_better(metric)
+
+        results = self.cross_validate(models_data, X_train, Y_train, n_workers)
+        cv_seconds = time.perf_counter() - start_time
+
+        candidates = {}
+        for name, result in results.items():
+            if 'error' in result:
+                candidates[name] = {'error': result['error']}
+                continue
+            scores = np.array([fold['report'][metric] for fold in result['folds']])
+            candidates[name] = {'fold_scores': scores.tolist(),
+                                'mean': float(scores.mean()),
+                                'std': float(scores.std(ddof = 1)) if len(scores) > 1 else 0.0,
+                                'variance': float(scores.var(ddof = 1)) if len(scores) > 1 else 0.0,
+                                'fit_seconds': float(sum(fold['seconds'] for fold in result['folds']))}
+
+        ranked = sorted((name for name in candidates if 'error' not in candidates[name]),
+                        key = lambda name: candidates[name]['mean'], reverse = greater_is_better)
+        if not ranked:
+            raise RuntimeError('Cross-validation failed for every model in models data.')
+        best_name = ranked[0]
+        logging.info(f'Best model on {self.cross_validation_config.n_splits}-fold cross-validation - {best_name.replace("_", " ")}, '
+                     f'mean {metric} {candidates[best_name]["mean"]} (std {candidates[best_name]["std"]})')
+
+        # Training the chosen candidate alone on the whole train set
+        finalists = self.training_pipeline.train_candidates([model for model in models_data if model['name'] == best_name],
+                                                            X_train, Y_train, X_test, Y_test, 1)
+
+        report = {'strategy': 'cross_validation',
+                  'n_splits': self.cross_validation_config.n_splits,
+                  'metric': metric,
+                  'candidates': candidates,
+                  'ranking': ranked,
+                  'cross_validation_seconds': cv_seconds,
+                  'seconds': time.perf_counter() - start_time}
+        return (finalists, report)
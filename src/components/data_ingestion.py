@@ -1,22 +1,85 @@
 from src.logger import logging
+from src.instrumentation import instrument_stage
+import os
+import glob
+import shutil
+from dataclasses import dataclass, field
+import numpy as np
 import pandas as pd
 
 from sklearn.model_selection import train_test_split
 
+@dataclass
+class DataIngestionConfig:
+    '''
+    A data class for storing paths and settings related to chunked data ingestion
+    '''
+    shards_dir = os.path.join("artifacts", "shards")
+    chunk_size = 100000 # Number of csv rows parsed at a time
+    memory_overhead_factor = 4 # Peak bytes used per parsed row relative to its compact size (parser buffers, hashes, split copies)
+    column_dtypes: dict = field(default_factory = lambda: {'Time': 'float32',
+                                                           **{f'V{i}': 'float32' for i in range(1, 29)},
+                                                           'Amount': 'float32',
+                                                           'Class': 'int8'})
+
+class RowHashSet:
+    '''
+    A set of 64 bit row hashes kept as a few sorted NumPy arrays of doubling sizes, which costs 8 bytes per unique row.
+    New hashes are added as a sorted run and runs of similar size are merged, so inserts stay O(log n) amortized per hash.
+    '''
+    def __init__(self):
+        self._runs = []
+
+    def __len__(self):
+        return sum(len(run) for run in self._runs)
+
+    def _contains(self, hashes):
+        found = np.zeros(len(hashes), dtype = bool)
+        for run in self._runs:
+            positions = np.searchsorted(run, hashes).clip(max = len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    def add_new(self, hashes):
+        '''
+        Add hashes to the set and return a boolean mask marking the first occurrence of every hash not seen before
+        '''
+        hashes = np.asarray(hashes, dtype = np.uint64)
+        new_mask = np.zeros(len(hashes), dtype = bool)
+        new_mask[np.unique(hashes, return_index = True)[1]] = True
+        new_mask &= ~self._contains(hashes)
+
+        run = np.sort(hashes[new_mask])
+        while self._runs and len(self._runs[-1]) <= 2 * len(run):
+            run = np.concatenate((self._runs.pop(), run))
+            run.sort(kind = 'mergesort')
+        if len(run):
+            self._runs.append(run)
+
+        return new_mask
+
 class DataIngestion:
     '''
     A class for ingesting data to be used in training pipeline
     '''
-    def ingest_data(self, path, target_class, test_size, random_state):
+    def __init__(self):
+        self.data_ingestion_config = DataIngestionConfig()
+
+    @instrument_stage('data_ingestion.ingest_data', rows_out = lambda data_arr: len(data_arr[0]) + len(data_arr[1]))
+    def ingest_data(self, path, target_class, test_size, random_state, dtype = None):
         '''
         Method Description: Data ingestion method
         Loads the data from given csv file path, drops duplicates and splits the data into train-test data.
+        If dtype is given, the features are parsed straight into it, e.g. float32, without a float64 copy.
         Returns the splitted data as a tuple of format (X_train, X_test, Y_train, Y_test)
         '''
         logging.info('Initiating data ingestion...')
 
         # Load data and drop duplicates
-        df = pd.read_csv(path)
+        column_dtypes = None
+        if dtype is not None:
+            column_dtypes = {column: dtype for column in pd.read_csv(path, nrows = 0).columns if column != target_class}
+        df = pd.read_csv(path, dtype = column_dtypes)
         df.drop_duplicates(inplace = True)
 
         # Split the dataset
@@ -27,4 +90,97 @@ class DataIngestion:
                                                             random_state = random_state)
 
         logging.info("Successfully completed data ingestion!!!")
-        return (X_train, X_test, Y_train, Y_test)
\ No newline at end of file
+        return (X_train, X_test, Y_train, Y_test)
+
+    def chunk_size_for_memory(self, max_memory_mb):
+        '''
+        Return the number of rows per chunk which keeps the chunk buffers of ingest_data_chunked within max_memory_mb
+        '''
+        bytes_per_row = sum(np.dtype(dtype).itemsize for dtype in self.data_ingestion_config.column_dtypes.values())
+        return max(1, int(max_memory_mb * 2**20 // (bytes_per_row * self.data_ingestion_config.memory_overhead_factor)))
+
+    @instrument_stage('data_ingestion.ingest_data_chunked')
+    def ingest_data_chunked(self, path, target_class, test_size, random_state, chunk_size = None, max_memory_mb = None, shards_dir = None):
+        '''
+        Method Description: Streaming data ingestion method
+        Reads the csv file in chunks with the compact dtypes of the config, drops duplicates across chunks with a row hash set
+        and splits every chunk stratified by target_class, keeping the test share of each class at test_size of the rows seen so far.
+        Train and test rows are written as binary .npy shards, structured arrays of the compact dtypes along with the row index, and the
+        lists of shard paths are returned as a tuple of format (train_shards, test_shards).
+        Memory is that of one chunk (sized from max_memory_mb if given) plus the hash set, which is not bounded: it grows by 8 bytes
+        per unique row of the file. max_memory_mb only budgets this step; load_shards then holds the whole data set in memory.
+        '''
+        logging.info('Initiating chunked data ingestion...')
+
+        if max_memory_mb is not None:
+            chunk_size = self.chunk_size_for_memory(max_memory_mb)
+        if chunk_size is None:
+            chunk_size = self.data_ingestion_config.chunk_size
+        shards_dir = shards_dir or self.data_ingestion_config.shards_dir
+
+        # Start from empty shard directories
+        shutil.rmtree(shards_dir, ignore_errors = True)
+        train_dir, test_dir = os.path.join(shards_dir, 'train'), os.path.join(shards_dir, 'test')
+        os.makedirs(train_dir)
+        os.makedirs(test_dir)
+
+        rng = np.random.default_rng(random_state)
+        row_hashes = RowHashSet()
+        class_seen, class_test = {}, {}
+        train_shards, test_shards = [], []
+        n_rows, n_unique = 0, 0
+
+        for chunk_number, chunk in enumerate(pd.read_csv(path, dtype = self.data_ingestion_config.column_dtypes, chunksize = chunk_size)):
+            n_rows += len(chunk)
+
+            # Drop rows seen before in this or an earlier chunk
+            chunk = chunk[row_hashes.add_new(pd.util.hash_pandas_object(chunk, index = False).to_numpy())]
+            n_unique += len(chunk)
+
+            # Pick test rows of each class at random so that the test share of the class stays at test_size
+            is_test = np.zeros(len(chunk), dtype = bool)
+            labels = chunk[target_class].to_numpy()
+            for label in np.unique(labels):
+                positions = np.flatnonzero(labels == label)
+                class_seen[label] = class_seen.get(label, 0) + len(positions)
+                n_test = int(round(test_size * class_seen[label])) - class_test.get(label, 0)
+                n_test = min(max(n_test, 0), len(positions))
+                is_test[rng.choice(positions, size = n_test, replace = False)] = True
+                class_test[label] = class_test.get(label, 0) + n_test
+
+            for shard_dir, shards, rows in ((train_dir, train_shards, chunk[~is_test]), (test_dir, test_shards, chunk[is_test])):
+                shard_path = os.path.join(shard_dir, f'part-{chunk_number:05d}.npy')
+                np.save(shard_path, rows.to_records(index = True))
+                shards.append(shard_path)
+
+            logging.info(f'Ingested chunk {chunk_number} with {len(chunk)} unique rows out of {n_rows} rows read so far')
+
+        logging.info(f'Successfully completed chunked data ingestion of {n_unique} unique rows out of {n_rows} rows!!!')
+        return (train_shards, test_shards)
+
+    @instrument_stage('data_ingestion.load_shards', rows_out = lambda data_arr: len(data_arr[0]))
+    def load_shards(self, shard_paths, target_class):
+        '''
+        Method Description: Shard loading method
+        Loads the .npy shards written by ingest_data_chunked, or every shard of a directory, and returns them as a tuple of format (X, Y).
+        The shards are memory-mapped and copied column by column into arrays of the total size, so no csv is parsed again and
+        the memory used is about the size of the loaded data in its compact dtypes.
+        '''
+        if isinstance(shard_paths, str):
+            shard_paths = sorted(glob.glob(os.path.join(shard_paths, '*.npy')))
+
+        shards = [np.load(shard_path, mmap_mode = 'r') for shard_path in shard_paths]
+        fields = shards[0].dtype.names
+        n_rows = sum(len(shard) for shard in shards)
+
+        columns = {name: np.empty(n_rows, dtype = shards[0].dtype[name]) for name in fields}
+        start = 0
+        for shard in shards:
+            for name in fields:
+                columns[name][start:start + len(shard)] = shard[name]
+            start += len(shard)
+
+        index = pd.Index(columns.pop(fields[0]))
+        df = pd.DataFrame(columns, index = index, copy = False)
+
+        return (df.drop(target_class, axis = 1), df[target_class])
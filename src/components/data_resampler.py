@@ -1,4 +1,5 @@
 from src.logger import logging
+from src.instrumentation import instrument_stage
 
 from imblearn.over_sampling import SMOTE
 
@@ -6,6 +7,7 @@ class DataResampler:
     '''
     A class for data resampling of pre-processed train data so that it can be used for training pipeline
     '''
+    @instrument_stage('data_resampler.fit_resample', rows_in = 'X_train', rows_out = lambda data_arr: len(data_arr[0]))
     def fit_resample(self, resampler, X_train, Y_train):
         '''
         Method Description: Resampler fit and transform method.
@@ -1,8 +1,10 @@
 from src.logger import logging
+from src.instrumentation import instrument_stage
 
 from sklearn.preprocessing import StandardScaler, FunctionTransformer
 from sklearn.compose import ColumnTransformer
 from sklearn.decomposition import PCA
+from sklearn.pipeline import Pipeline as SklearnPipeline
 from imblearn.pipeline import Pipeline
 
 class DataPreProcessor:
@@ -10,6 +12,7 @@ class DataPreProcessor:
     A class for data pre-processing of raw data so that it can be used for training pipeline or prediction pipeline
     '''
 
+    @instrument_stage('data_transformation.transform', rows_in = 'X', rows_out = len)
     def transform(self, pre_processor, X):
         '''
         Method Description: Pre-processor transform method.
@@ -22,6 +25,24 @@ class DataPreProcessor:
         logging.info('Successfully completed data pre-processing for model evaluation or prediction!!!')
         return X_transformed
 
+    def set_in_place(self, pre_processor):
+        '''
+        Method Description: In-place pre-processing method.
+        Takes in an unfitted pre-processor and lets its StandardScaler and PCA steps transform their input in place when the
+        pipeline starts with a ColumnTransformer, whose output is a new array owned by the pipeline. Returns the pre-processor.
+        '''
+        if not isinstance(pre_processor, (Pipeline, SklearnPipeline)):
+            return pre_processor
+
+        steps = [step for _, step in pre_processor.steps if step is not None and step != 'passthrough']
+        if steps and isinstance(steps[0], ColumnTransformer):
+            for step in steps[1:]:
+                if isinstance(step, (StandardScaler, PCA)):
+                    step.set_params(copy = False)
+
+        return pre_processor
+
+    @instrument_stage('data_transformation.fit_transform', rows_in = 'X_train', rows_out = len)
     def fit_transform(self, pre_processor, X_train, Y_train):
         '''
         Method Description: Pre-processor fit and transform method.
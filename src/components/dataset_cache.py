@@ -0,0 +1,203 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from src.logger import logging
+from src.utils import file_sha256, save_json, load_json
+
+@dataclass
+class DatasetCacheConfig:
+    '''
+    A data class for storing paths related to the dataset cache
+    '''
+    cache_dir = os.path.join("artifacts", "dataset_cache")
+    index_file_name = "index.json" # Maps (path, size, mtime) of ingested files to the sha256 of their content
+    max_size_mb = 4096 # Least recently used entries are evicted once the cache grows beyond this size
+    max_entries = 8 # or holds more entries than this
+
+class DatasetCache:
+    '''
+    A class for caching ingested (de-duplicated and split) datasets as memory-mappable .npy files.
+    Entries are keyed by the sha256 of the source file and the ingestion settings; the hash of a file is computed once
+    and remembered for its (path, size, mtime), so later runs only stat the file.
+    Rows are stored train rows first, then test rows, in one column-major array, so the train and test data frames
+    are views of the memory-mapped file and are loaded without copying.
+    Index entries of files which have changed or been removed are dropped when an entry is stored, along with the entries of
+    content no index entry refers to any more; the least recently used entries are then evicted while the cache is larger
+    than its size or entry limit.
+    '''
+    _index_lock = threading.Lock()
+
+    def __init__(self, cache_dir = None, max_size_mb = None, max_entries = None):
+        self.dataset_cache_config = DatasetCacheConfig()
+        self.cache_dir = cache_dir or self.dataset_cache_config.cache_dir
+        self.max_size_mb = self.dataset_cache_config.max_size_mb if max_size_mb is None else max_size_mb
+        self.max_entries = self.dataset_cache_config.max_entries if max_entries is None else max_entries
+        self.index_path = os.path.join(self.cache_dir, self.dataset_cache_config.index_file_name)
+
+    def content_hash(self, path):
+        '''
+        Return the sha256 of the file at path, reusing the one computed earlier for the same path, size and modification time
+        '''
+        stat_result = os.stat(path)
+        quick_key = f'{os.path.abspath(path)}|{stat_result.st_size}|{stat_result.st_mtime_ns}'
+
+        with self._index_lock:
+            index = load_json(self.index_path) if os.path.exists(self.index_path) else {}
+            if quick_key in index:
+                return index[quick_key]
+
+        logging.info(f'Computing content hash of {path}...')
+        sha256 = file_sha256(path)
+
+        with self._index_lock:
+            index = load_json(self.index_path) if os.path.exists(self.index_path) else {}
+            index[quick_key] = sha256
+            save_json(self.index_path, index)
+
+        return sha256
+
+    def entry_dir(self, path, **ingestion_settings):
+        '''
+        Return the directory of the cache entry for the file at path ingested with given settings
+        '''
+        key = '|'.join([self.content_hash(path)] + [f'{name}={ingestion_settings[name]}' for name in sorted(ingestion_settings)])
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest()[:16])
+
+    def load(self, path, **ingestion_settings):
+        '''
+        Return the cached (X_train, X_test, Y_train, Y_test) of the file at path ingested with given settings, or None on a cache miss
+        '''
+        entry_dir = self.entry_dir(path, **ingestion_settings)
+        data_arr = self.load_entry(entry_dir)
+        if data_arr is not None:
+            # Mark the entry as recently used
+            os.utime(os.path.join(entry_dir, 'meta.json'))
+            logging.info(f'Loaded {path} from dataset cache entry {entry_dir}')
+        return data_arr
+
+    def load_entry(self, entry_dir):
+        '''
+        Return the (X_train, X_test, Y_train, Y_test) stored in entry_dir by store_entry as memory-mapped views, or None if there is none
+        '''
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+
+        meta = load_json(meta_path)
+        n_train = meta['n_train']
+
+        X = np.load(os.path.join(entry_dir, 'features.npy'), mmap_mode = 'r')
+        Y = np.load(os.path.join(entry_dir, 'target.npy'), mmap_mode = 'r')
+        index = np.load(os.path.join(entry_dir, 'index.npy'), mmap_mode = 'r')
+
+        X_train = pd.DataFrame(X[:n_train], index = pd.Index(index[:n_train]), columns = meta['columns'], copy = False)
+        X_test = pd.DataFrame(X[n_train:], index = pd.Index(index[n_train:]), columns = meta['columns'], copy = False)
+        Y_train = pd.Series(Y[:n_train], index = X_train.index, name = meta['target_class'], copy = False)
+        Y_test = pd.Series(Y[n_train:], index = X_test.index, name = meta['target_class'], copy = False)
+
+        return (X_train, X_test, Y_train, Y_test)
+
+    def store(self, path, X_train, X_test, Y_train, Y_test, **ingestion_settings):
+        '''
+        Store the ingested data of the file at path in the cache, replacing any existing entry for the same settings,
+        then evict stale and old entries if required
+        '''
+        stat_result = os.stat(path)
+        entry_dir = self.store_entry(self.entry_dir(path, **ingestion_settings), X_train, X_test, Y_train, Y_test,
+                                     {'source_path': os.path.abspath(path),
+                                      'source_size': stat_result.st_size,
+                                      'source_mtime_ns': stat_result.st_mtime_ns,
+                                      'content_sha256': self.content_hash(path),
+                                      'ingestion_settings': ingestion_settings})
+
+        logging.info(f'Stored {path} in dataset cache entry {entry_dir}')
+        self.evict(keep = os.path.basename(entry_dir))
+
+    def prune_index(self):
+        '''
+        Drop the index entries of files which have changed or been removed since they were hashed and return the sha256
+        of the content still referenced by the index
+        '''
+        with self._index_lock:
+            index = load_json(self.index_path) if os.path.exists(self.index_path) else {}
+            current_index = {}
+            for quick_key, sha256 in index.items():
+                path, size, mtime_ns = quick_key.rsplit('|', 2)
+                try:
+                    stat_result = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if (stat_result.st_size, stat_result.st_mtime_ns) == (int(size), int(mtime_ns)):
+                    current_index[quick_key] = sha256
+
+            if len(current_index) != len(index):
+                save_json(self.index_path, current_index)
+
+        return set(current_index.values())
+
+    def evict(self, keep = None):
+        '''
+        Remove the entries of content the index no longer refers to, then least recently used entries, except keep,
+        until the cache fits within its size and entry limits
+        '''
+        referenced = self.prune_index()
+
+        entries = []
+        total_size, n_entries = 0, 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            meta_path = os.path.join(entry_dir, 'meta.json')
+            if key.endswith('.tmp') or not os.path.exists(meta_path):
+                continue
+
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+            if key != keep and load_json(meta_path).get('content_sha256') not in referenced:
+                shutil.rmtree(entry_dir, ignore_errors = True)
+                logging.info(f'Removed dataset cache entry {key}, its source file has changed or been removed')
+                continue
+
+            total_size += size
+            n_entries += 1
+            if key != keep:
+                entries.append((os.stat(meta_path).st_mtime, size, key))
+
+        for _, size, key in sorted(entries):
+            if total_size <= self.max_size_mb * 2**20 and n_entries <= self.max_entries:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors = True)
+            total_size -= size
+            n_entries -= 1
+            logging.info(f'Evicted dataset cache entry {key}')
+
+    def store_entry(self, entry_dir, X_train, X_test, Y_train, Y_test, meta = None):
+        '''
+        Store train and test sets in entry_dir, replacing what is there, with meta added to its meta.json. Returns entry_dir.
+        '''
+        temp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+        shutil.rmtree(temp_dir, ignore_errors = True)
+        os.makedirs(temp_dir)
+
+        features = np.asfortranarray(np.concatenate((X_train.to_numpy(), X_test.to_numpy())))
+        np.save(os.path.join(temp_dir, 'features.npy'), features)
+        np.save(os.path.join(temp_dir, 'target.npy'), np.concatenate((Y_train.to_numpy(), Y_test.to_numpy())))
+        np.save(os.path.join(temp_dir, 'index.npy'), np.concatenate((X_train.index.to_numpy(), X_test.index.to_numpy())))
+
+        save_json(os.path.join(temp_dir, 'meta.json'), {**(meta or {}),
+                                                        'columns': X_train.columns.tolist(),
+                                                        'target_class': Y_train.name,
+                                                        'n_train': len(X_train),
+                                                        'n_test': len(X_test),
+                                                        'created_at': time.time()})
+
+        # Publishing the entry in one rename, so that a reader never sees a partial entry
+        shutil.rmtree(entry_dir, ignore_errors = True)
+        os.replace(temp_dir, entry_dir)
+
+        return entry_dir
@@ -0,0 +1,293 @@
+import os
+import json
+import glob
+import time
+import shutil
+import hashlib
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.logger import logging
+from src.utils import save_json, load_json, FileLock
+
+@dataclass
+class DriftMonitorConfig:
+    '''
+    A data class for storing paths and settings related to the drift monitor
+    '''
+    reference_path = os.path.join('artifacts', 'drift_reference.json')
+    live_counts_dir = os.path.join('artifacts', 'drift_live') # Live histograms of every worker process, merged on read
+    n_bins = 10 # Quantile bins per feature, the live histogram of a feature has the same bins
+    flush_rows = 1024 # Observed single rows are buffered and binned together once this many have arrived
+    flush_interval = 1.0 # or once the oldest of them has waited this many seconds
+    psi_warning = 0.1 # Population stability index above which a feature is reported as drifting
+    psi_alert = 0.25 # and above which it is reported as drifted
+    min_rows = 100 # Live rows required before drift is reported
+    ignored_features = ('Time',) # Seconds since the first transaction of the data set, live traffic is always past the train range
+    check_interval = 1.0 # Minimum number of seconds between two checks of the reference file on disk
+    epsilon = 1e-6 # Floor of bin proportions in the PSI, so that empty bins do not make it infinite
+
+def build_reference(X, n_bins = None, version = None):
+    '''
+    Compute the drift reference of the training features X: per feature, the edges of n_bins quantile bins, the share of rows
+    in every bin, and the min, median and max. Features with ties (e.g. many zero amounts) get fewer, unique edges.
+    Returns a json serializable dictionary.
+    '''
+    n_bins = n_bins or DriftMonitorConfig().n_bins
+    quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+    features = {}
+
+    for column in X.columns:
+        values = X[column].to_numpy(dtype = np.float64)
+        values = values[~np.isnan(values)]
+        edges = np.unique(np.quantile(values, quantiles)) if len(values) else np.empty(0)
+        counts = np.bincount(np.searchsorted(edges, values, side = 'right'), minlength = len(edges) + 1)
+
+        features[str(column)] = {'edges': edges.tolist(),
+                                 'proportions': (counts / max(len(values), 1)).tolist(),
+                                 'min': float(values.min()) if len(values) else None,
+                                 'median': float(np.median(values)) if len(values) else None,
+                                 'max': float(values.max()) if len(values) else None}
+
+    return {'version': version, 'n_rows': len(X), 'n_bins': n_bins, 'created_at': time.time(), 'features': features}
+
+def save_reference(X, path = None, n_bins = None, version = None):
+    '''
+    Compute the drift reference of the training features X and save it as a json file, returning it
+    '''
+    reference = build_reference(X, n_bins, version)
+    save_json(path or DriftMonitorConfig().reference_path, reference)
+    return reference
+
+def reference_key(reference):
+    '''
+    Return a short hash of a drift reference, naming the directory of the live histograms observed against it
+    '''
+    return hashlib.sha256(json.dumps(reference, sort_keys = True).encode()).hexdigest()[:16]
+
+class DriftMonitor:
+    '''
+    A class for following the distribution of the features of prediction traffic against the training distribution.
+    Every feature keeps a histogram of live rows over the quantile bins of its reference, so memory is fixed per feature
+    whatever the traffic. Single rows are buffered and binned in blocks, which keeps the cost per prediction to an append.
+    Drift is reported as the population stability index (PSI) and the largest difference between the binned cumulative
+    distributions (a KS statistic at the bin edges).
+    Every worker process adds its rows to its own memory-mapped count file in the live counts directory of the reference,
+    and reports merge the files of all workers, so that drift covers the traffic of the whole server.
+    '''
+    def __init__(self, reference, live_counts_dir = None):
+        self.drift_monitor_config = DriftMonitorConfig()
+        self.reference = reference
+        self.columns = list(reference['features'])
+        self.edges = [np.asarray(reference['features'][column]['edges']) for column in self.columns]
+        self.reference_proportions = [np.asarray(reference['features'][column]['proportions']) for column in self.columns]
+
+        # Layout of a count file: the number of rows, the missing values of every feature, then the histogram of every feature
+        self.bin_offsets = np.cumsum([1 + len(self.columns)] + [len(edges) + 1 for edges in self.edges])
+        self.live_counts_dir = os.path.join(live_counts_dir or self.drift_monitor_config.live_counts_dir, reference_key(reference))
+        self.lock_path = os.path.join(self.live_counts_dir, 'counts.lock')
+        self.meta_path = os.path.join(self.live_counts_dir, 'meta.json')
+        os.makedirs(self.live_counts_dir, exist_ok = True)
+        with FileLock(self.lock_path):
+            if not os.path.exists(self.meta_path):
+                save_json(self.meta_path, {'started_at': time.time()})
+
+        self._counts = None
+        self._counts_pid = None
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def remove_stale_counts(self):
+        '''
+        Remove the live counts directories of other references, which no worker adds to once they moved to this one
+        '''
+        parent_dir = os.path.dirname(self.live_counts_dir)
+        for entry in os.scandir(parent_dir):
+            if entry.is_dir() and entry.path != self.live_counts_dir:
+                shutil.rmtree(entry.path, ignore_errors = True)
+
+    def _worker_counts(self):
+        '''
+        Return the memory-mapped count array of the current process, created on first use so that forked workers get their own
+        '''
+        if self._counts_pid != os.getpid():
+            counts_path = os.path.join(self.live_counts_dir, f'{os.getpid()}.npy')
+            if os.path.exists(counts_path):
+                self._counts = np.load(counts_path, mmap_mode = 'r+')
+            else:
+                self._counts = np.lib.format.open_memmap(counts_path, mode = 'w+', dtype = np.int64, shape = (int(self.bin_offsets[-1]),))
+            self._counts_pid = os.getpid()
+        return self._counts
+
+    def observe_row(self, row):
+        '''
+        Record one prediction row given as a dictionary of feature values; it is binned with the next block of rows
+        '''
+        with self._lock:
+            self._pending.append([row.get(column, np.nan) for column in self.columns])
+            if (len(self._pending) >= self.drift_monitor_config.flush_rows
+                    or time.monotonic() - self._last_flush >= self.drift_monitor_config.flush_interval):
+                self._flush()
+
+    def observe(self, X):
+        '''
+        Record the rows of a data frame of predictions
+        '''
+        values = X.reindex(columns = self.columns).to_numpy(dtype = np.float64)
+        with self._lock:
+            self._update(values)
+
+    def _flush(self):
+        if self._pending:
+            self._update(np.asarray(self._pending, dtype = np.float64))
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def _update(self, values):
+        '''
+        Add a (n_rows, n_features) array to the live histograms of the process, the lock must be held
+        '''
+        is_missing = np.isnan(values)
+        update = np.zeros(int(self.bin_offsets[-1]), dtype = np.int64)
+        update[0] = len(values)
+        update[1:self.bin_offsets[0]] = is_missing.sum(axis = 0)
+        for index, edges in enumerate(self.edges):
+            column = values[~is_missing[:, index], index]
+            update[self.bin_offsets[index]:self.bin_offsets[index + 1]] = np.bincount(np.searchsorted(edges, column, side = 'right'),
+                                                                                        minlength = len(edges) + 1)
+        with FileLock(self.lock_path):
+            self._worker_counts()[:] += update
+
+    def merged_counts(self):
+        '''
+        Return the sum of the count arrays of all worker processes, and the time the live rows were first observed since
+        '''
+        merged = np.zeros(int(self.bin_offsets[-1]), dtype = np.int64)
+        with FileLock(self.lock_path):
+            for counts_path in glob.glob(os.path.join(self.live_counts_dir, '*.npy')):
+                merged += np.load(counts_path)
+            started_at = load_json(self.meta_path)['started_at']
+        return merged, started_at
+
+    def reset(self):
+        '''
+        Forget the live rows observed so far by all worker processes
+        '''
+        with self._lock:
+            self._pending = []
+            with FileLock(self.lock_path):
+                for counts_path in glob.glob(os.path.join(self.live_counts_dir, '*.npy')):
+                    counts = np.load(counts_path, mmap_mode = 'r+')
+                    counts[:] = 0
+                    counts.flush()
+                save_json(self.meta_path, {'started_at': time.time()})
+
+    def report(self):
+        '''
+        Return a dictionary with the PSI, the KS statistic and a status ('ok', 'warning' or 'alert') of every feature,
+        along with the features drifting the most. Status is 'insufficient_data' until min_rows live rows were observed,
+        and 'ignored' for the ignored features of the config, which are left out of max_psi and drifted_features.
+        '''
+        with self._lock:
+            self._flush()
+        merged, started_at = self.merged_counts()
+        n_rows = int(merged[0])
+        missing = merged[1:self.bin_offsets[0]]
+        counts = [merged[self.bin_offsets[index]:self.bin_offsets[index + 1]] for index in range(len(self.columns))]
+
+        epsilon = self.drift_monitor_config.epsilon
+        features = {}
+        for index, column in enumerate(self.columns):
+            n_values = counts[index].sum()
+            live = counts[index] / max(n_values, 1)
+            expected = self.reference_proportions[index]
+
+            live_floor, expected_floor = np.maximum(live, epsilon), np.maximum(expected, epsilon)
+            psi = float(np.sum((live_floor - expected_floor) * np.log(live_floor / expected_floor)))
+            ks = float(np.max(np.abs(np.cumsum(live) - np.cumsum(expected))))
+
+            if column in self.drift_monitor_config.ignored_features:
+                status = 'ignored'
+            elif n_values < self.drift_monitor_config.min_rows:
+                status = 'insufficient_data'
+            elif psi >= self.drift_monitor_config.psi_alert:
+                status = 'alert'
+            elif psi >= self.drift_monitor_config.psi_warning:
+                status = 'warning'
+            else:
+                status = 'ok'
+
+            features[column] = {'psi': psi, 'ks': ks, 'status': status, 'missing': int(missing[index])}
+
+        ranked = sorted((column for column in features if features[column]['status'] != 'ignored'),
+                        key = lambda column: features[column]['psi'], reverse = True)
+        return {'reference_version': self.reference.get('version'),
+                'reference_rows': self.reference.get('n_rows'),
+                'live_rows': n_rows,
+                'since': started_at,
+                'max_psi': features[ranked[0]]['psi'] if ranked else 0.0,
+                'drifted_features': [column for column in ranked if features[column]['status'] in ('warning', 'alert')],
+                'features': features}
+
+    def describe(self):
+        '''
+        Return the min, median and max of every training feature, as shown on the prediction page
+        '''
+        return {column: {name: self.reference['features'][column][name] for name in ('min', 'median', 'max')} for column in self.columns}
+
+class DriftMonitorRegistry:
+    '''
+    A class for keeping the drift monitor of a reference file in memory, replacing it with a fresh one when training saves a new reference
+    '''
+    def __init__(self, reference_path):
+        self.drift_monitor_config = DriftMonitorConfig()
+        self.reference_path = reference_path
+        self._monitor = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _reference_fingerprint(self):
+        try:
+            stat_result = os.stat(self.reference_path)
+        except FileNotFoundError:
+            return None
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+    def get(self):
+        '''
+        Return the drift monitor of the current reference, or None if there is no reference file
+        '''
+        now = time.monotonic()
+        if now - self._last_check < self.drift_monitor_config.check_interval:
+            return self._monitor
+
+        with self._lock:
+            self._last_check = now
+            fingerprint = self._reference_fingerprint()
+            if fingerprint != self._fingerprint:
+                self._monitor = None if fingerprint is None else DriftMonitor(load_json(self.reference_path))
+                self._fingerprint = fingerprint
+                if self._monitor is not None:
+                    self._monitor.remove_stale_counts()
+                    logging.info(f'Drift monitor started for reference version {self._monitor.reference.get("version")}')
+            return self._monitor
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_drift_monitor(reference_path = None):
+    '''
+    Return the process wide drift monitor of given reference file, or None if the file does not exist
+    '''
+    reference_path = os.path.abspath(reference_path or DriftMonitorConfig().reference_path)
+
+    with _registries_lock:
+        if reference_path not in _registries:
+            _registries[reference_path] = DriftMonitorRegistry(reference_path)
+        registry = _registries[reference_path]
+
+    return registry.get()
@@ -0,0 +1,432 @@
+import json
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+from sklearn.pipeline import Pipeline as SklearnPipeline
+from sklearn.preprocessing import StandardScaler, FunctionTransformer
+from sklearn.compose import ColumnTransformer
+from sklearn.decomposition import PCA
+from imblearn.pipeline import Pipeline
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier
+from xgboost import XGBClassifier
+
+from src.logger import logging
+
+def _double_log_transform_inplace(x):
+    '''In-place equivalent of src.utils.double_log_transform'''
+    x += 1
+    np.log10(x, out = x)
+    x += 1
+    np.log10(x, out = x)
+
+def _cube_root_transform_inplace(x):
+    '''In-place equivalent of src.utils.cube_root_transform'''
+    np.cbrt(x, out = x)
+
+# Element-wise functions used inside FunctionTransformers which can be compiled, keyed by function name
+ELEMENTWISE_FUNCTIONS = {
+    'double_log_transform': _double_log_transform_inplace,
+    'cube_root_transform': _cube_root_transform_inplace
+}
+
+class InferenceKernel(ABC):
+    '''
+    An abstract class holding a fitted pre-processor and model compiled into plain NumPy arrays, subclasses implement the model head.
+    Rows are gathered into a preallocated per-thread buffer, the element-wise column functions are applied in place,
+    followed by the affine steps (StandardScaler, PCA) and the model head.
+    '''
+    def __init__(self, input_columns, column_groups, n_features, affine_steps, positive_class):
+        self.input_columns = list(input_columns)
+        self.column_groups = column_groups # list of (function names, input indices, output indices)
+        self.n_features = n_features
+        self.affine_steps = affine_steps # list of ('scaler', mean, scale) or ('pca', mean, components, whiten_scale)
+        self.positive_class = positive_class
+        self._workspace = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_workspace']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._workspace = threading.local()
+
+    def _buffer(self, n_rows):
+        '''
+        Return a preallocated (n_rows, n_features) buffer owned by the calling thread, growing it if required
+        '''
+        buffer = getattr(self._workspace, 'buffer', None)
+        if buffer is None or buffer.shape[0] < n_rows:
+            buffer = np.empty((max(n_rows, 1), self.n_features), dtype = np.float64)
+            self._workspace.buffer = buffer
+        return buffer[:n_rows]
+
+    def _input_array(self, X):
+        '''
+        Return X as a float64 array with columns in the order seen by the pre-processor during fit
+        '''
+        if isinstance(X, pd.DataFrame):
+            if X.columns.tolist() != self.input_columns:
+                X = X[self.input_columns]
+            return X.to_numpy(dtype = np.float64)
+        return np.asarray(X, dtype = np.float64)
+
+    def column_features(self, X):
+        '''
+        Apply the column selection and element-wise column functions, i.e. the output of the ColumnTransformer
+        '''
+        X = self._input_array(X)
+        U = self._buffer(len(X))
+
+        for function_names, input_indices, output_indices in self.column_groups:
+            block = X[:, input_indices]
+            for function_name in function_names:
+                ELEMENTWISE_FUNCTIONS[function_name](block)
+            U[:, output_indices] = block
+
+        return U
+
+    def transformed_features(self, X):
+        '''
+        Apply the whole pre-processor, i.e. the equivalent of pre_processor.transform(X)
+        '''
+        Z = self.column_features(X)
+
+        for step in self.affine_steps:
+            if step[0] == 'scaler':
+                _, mean, scale = step
+                if mean is not None:
+                    Z -= mean
+                if scale is not None:
+                    Z /= scale
+            else:
+                _, mean, components, whiten_scale = step
+                Z_new = Z @ components.T
+                Z_new -= mean.reshape(1, -1) @ components.T
+                if whiten_scale is not None:
+                    Z_new /= whiten_scale
+                Z = Z_new
+
+        return Z
+
+    @abstractmethod
+    def predict_fraud_proba(self, X):
+        '''
+        Return the probability of the positive (fraud) class for every row of X
+        '''
+
+    def predict_proba(self, X):
+        '''
+        Return class probabilities in the same (n_rows, 2) layout as the predict_proba of the original model
+        '''
+        fraud_prob = self.predict_fraud_proba(X)
+        return np.column_stack((1 - fraud_prob, fraud_prob))
+
+    def check_parity(self, pre_processor, model, X, atol = 1e-6):
+        '''
+        Compare the kernel against the original pre-processor and model on X.
+        Returns the maximum absolute difference between fraud probabilities and raises a ValueError if it is more than atol.
+        '''
+        expected = model.predict_proba(pre_processor.transform(X))[:, 1]
+        actual = self.predict_fraud_proba(X)
+
+        difference = np.abs(expected - actual)
+        max_abs_diff = float(np.nanmax(difference)) if np.any(~np.isnan(difference)) else 0.0
+
+        if not np.allclose(actual, expected, rtol = 0, atol = atol, equal_nan = True):
+            raise ValueError(f'Inference kernel does not match the original model, maximum absolute difference is {max_abs_diff}')
+
+        return max_abs_diff
+
+class LinearInferenceKernel(InferenceKernel):
+    '''
+    Inference kernel for linear models, where the affine pre-processing steps and the coefficients are fused into one weight vector
+    '''
+    def __init__(self, input_columns, column_groups, n_features, affine_steps, positive_class, coef, intercept):
+        super().__init__(input_columns, column_groups, n_features, affine_steps, positive_class)
+
+        # Fold the affine steps into the coefficients: z = u @ A + c, logit = z @ coef + intercept = u @ w + b
+        A, c = np.eye(n_features), np.zeros(n_features)
+        for step in affine_steps:
+            if step[0] == 'scaler':
+                _, mean, scale = step
+                if mean is not None:
+                    c = c - mean
+                if scale is not None:
+                    A, c = A / scale, c / scale
+            else:
+                _, mean, components, whiten_scale = step
+                A, c = A @ components.T, (c - mean) @ components.T
+                if whiten_scale is not None:
+                    A, c = A / whiten_scale, c / whiten_scale
+
+        self.weights = np.ascontiguousarray(A @ coef)
+        self.bias = float(c @ coef + intercept)
+
+    def predict_fraud_proba(self, X):
+        logit = self.column_features(X) @ self.weights
+        logit += self.bias
+        np.negative(logit, out = logit)
+        np.exp(logit, out = logit)
+        logit += 1
+        return np.reciprocal(logit, out = logit)
+
+class TreeInferenceKernel(InferenceKernel):
+    '''
+    Inference kernel for decision trees and gradient boosted trees.
+    All trees are flattened into shared node arrays and evaluated level by level for all rows and trees at once.
+    Children of leaves point to the leaf itself, so rows that reached a leaf stay there.
+    '''
+    def __init__(self, input_columns, column_groups, n_features, affine_steps, positive_class,
+                 roots, feature, threshold, left, right, missing, value, max_depth, strict_less_than, base_margin, logistic_link):
+        super().__init__(input_columns, column_groups, n_features, affine_steps, positive_class)
+        self.roots = np.asarray(roots, dtype = np.intp)
+        self.feature = np.asarray(feature, dtype = np.intp)
+        self.threshold = np.asarray(threshold, dtype = np.float64)
+        self.left = np.asarray(left, dtype = np.intp)
+        self.right = np.asarray(right, dtype = np.intp)
+        self.missing = None if missing is None else np.asarray(missing, dtype = np.intp)
+        self.value = np.asarray(value, dtype = np.float64)
+        self.max_depth = int(max_depth)
+        self.strict_less_than = strict_less_than # XGBoost goes left on x < threshold, scikit-learn on x <= threshold
+        self.base_margin = float(base_margin)
+        self.logistic_link = logistic_link
+
+    def predict_fraud_proba(self, X):
+        # Both scikit-learn trees and XGBoost compare float32 features against the thresholds
+        Z = np.asarray(self.transformed_features(X), dtype = np.float32)
+        row_offsets = (np.arange(len(Z)) * Z.shape[1])[:, None]
+        Z = Z.ravel()
+        node = np.broadcast_to(self.roots, (len(row_offsets), len(self.roots))).copy()
+
+        for _ in range(self.max_depth):
+            x = Z.take(row_offsets + self.feature.take(node))
+            threshold = self.threshold.take(node)
+            go_left = np.less(x, threshold) if self.strict_less_than else np.less_equal(x, threshold)
+            next_node = np.where(go_left, self.left.take(node), self.right.take(node))
+            if self.missing is not None:
+                next_node = np.where(np.isnan(x), self.missing.take(node), next_node)
+            node = next_node
+
+        output = self.value[node].sum(axis = 1)
+        output += self.base_margin
+
+        if self.logistic_link:
+            return 1 / (1 + np.exp(-output))
+        return output
+
+def _column_indices(columns, feature_names):
+    '''
+    Resolve the column specification of a ColumnTransformer entry to a list of input indices
+    '''
+    if isinstance(columns, slice):
+        return list(range(len(feature_names)))[columns]
+    columns = list(np.atleast_1d(columns))
+    if len(columns) and isinstance(columns[0], (bool, np.bool_)):
+        return [index for index, selected in enumerate(columns) if selected]
+    if len(columns) and isinstance(columns[0], str):
+        return [feature_names.index(column) for column in columns]
+    return [int(column) for column in columns]
+
+def _function_name(transformer):
+    '''
+    Return the name of the compilable element-wise function of a FunctionTransformer or raise a TypeError
+    '''
+    function_name = getattr(transformer.func, '__name__', None)
+    if transformer.func is None:
+        return None
+    if function_name not in ELEMENTWISE_FUNCTIONS or transformer.kw_args:
+        raise TypeError(f'Cannot compile FunctionTransformer with function {function_name}')
+    return function_name
+
+def compile_preprocessor(pre_processor):
+    '''
+    Compile a fitted pre-processor into (input columns, column groups, number of features, affine steps).
+    Supports a Pipeline of an optional ColumnTransformer with FunctionTransformers of known element-wise functions,
+    drop and passthrough entries, followed by StandardScaler and PCA steps.
+    '''
+    steps = [step for _, step in pre_processor.steps] if isinstance(pre_processor, (Pipeline, SklearnPipeline)) else [pre_processor]
+    steps = [step for step in steps if step is not None and step != 'passthrough']
+
+    input_columns = [str(column) for column in getattr(pre_processor, 'feature_names_in_', [])]
+    if not input_columns:
+        raise TypeError('Pre-processor must be fitted on a data frame to be compiled')
+
+    column_groups = []
+    affine_steps = []
+    n_features = 0
+
+    if isinstance(steps[0], ColumnTransformer):
+        for _, transformer, columns in steps.pop(0).transformers_:
+            if isinstance(transformer, str) and transformer == 'drop':
+                continue
+            input_indices = _column_indices(columns, input_columns)
+            if not input_indices:
+                continue
+            if isinstance(transformer, str) and transformer == 'passthrough':
+                function_names = []
+            elif isinstance(transformer, FunctionTransformer):
+                function_name = _function_name(transformer)
+                function_names = [] if function_name is None else [function_name]
+            else:
+                raise TypeError(f'Cannot compile {type(transformer).__name__} inside a ColumnTransformer')
+
+            output_indices = list(range(n_features, n_features + len(input_indices)))
+            column_groups.append((function_names, np.asarray(input_indices), np.asarray(output_indices)))
+            n_features += len(input_indices)
+    else:
+        n_features = len(input_columns)
+        column_groups.append(([], np.arange(n_features), np.arange(n_features)))
+
+    for step in steps:
+        if isinstance(step, FunctionTransformer) and not affine_steps:
+            function_name = _function_name(step)
+            if function_name is not None:
+                for function_names, _, _ in column_groups:
+                    function_names.append(function_name)
+        elif isinstance(step, StandardScaler):
+            affine_steps.append(('scaler',
+                                 step.mean_ if step.with_mean else None,
+                                 step.scale_ if step.with_std else None))
+        elif isinstance(step, PCA):
+            whiten_scale = None
+            if step.whiten:
+                whiten_scale = np.sqrt(step.explained_variance_)
+                whiten_scale[whiten_scale < np.finfo(whiten_scale.dtype).eps] = np.finfo(whiten_scale.dtype).eps
+            affine_steps.append(('pca', step.mean_, step.components_, whiten_scale))
+        else:
+            raise TypeError(f'Cannot compile pre-processing step {type(step).__name__}')
+
+    return (input_columns, column_groups, n_features, affine_steps)
+
+def _flatten_sklearn_tree(model):
+    '''
+    Flatten a fitted DecisionTreeClassifier into node arrays with the fraud probability as leaf value
+    '''
+    tree = model.tree_
+    node_ids = np.arange(tree.node_count)
+    is_leaf = tree.children_left == -1
+
+    proba = tree.value[:, 0, :]
+    normalizer = proba.sum(axis = 1, keepdims = True)
+    normalizer[normalizer == 0] = 1
+    value = np.where(is_leaf, (proba / normalizer)[:, 1], 0.0)
+
+    return {'roots': [0],
+            'feature': np.where(is_leaf, 0, tree.feature),
+            'threshold': np.where(is_leaf, 0.0, tree.threshold),
+            'left': np.where(is_leaf, node_ids, tree.children_left),
+            'right': np.where(is_leaf, node_ids, tree.children_right),
+            'missing': None,
+            'value': value,
+            'max_depth': tree.max_depth,
+            'strict_less_than': False,
+            'base_margin': 0.0,
+            'logistic_link': False}
+
+def _flatten_xgboost_trees(model):
+    '''
+    Flatten all trees of a fitted binary XGBClassifier into shared node arrays with leaf margins as values
+    '''
+    booster = model.get_booster()
+    config = json.loads(booster.save_config())
+    objective = config['learner']['objective']['name']
+    if objective != 'binary:logistic':
+        raise TypeError(f'Cannot compile XGBoost objective {objective}')
+    if config['learner']['gradient_booster']['name'] != 'gbtree':
+        raise TypeError('Only gbtree XGBoost models can be compiled')
+
+    base_score = float(config['learner']['learner_model_param']['base_score'])
+    feature_names = booster.feature_names
+
+    feature, threshold, left, right, missing, value, roots = [], [], [], [], [], [], []
+    max_depth = 0
+
+    for tree_dump in booster.get_dump(dump_format = 'json'):
+        offset = len(feature)
+        nodes = {}
+        stack = [(json.loads(tree_dump), 0)]
+        while stack:
+            node, depth = stack.pop()
+            nodes[node['nodeid']] = node
+            max_depth = max(max_depth, depth)
+            stack.extend((child, depth + 1) for child in node.get('children', []))
+
+        roots.append(offset)
+        for node_id in range(len(nodes)):
+            node = nodes[node_id]
+            if 'leaf' in node:
+                feature.append(0)
+                threshold.append(0.0)
+                left.append(offset + node_id)
+                right.append(offset + node_id)
+                missing.append(offset + node_id)
+                value.append(node['leaf'])
+            else:
+                split = node['split']
+                feature.append(feature_names.index(split) if feature_names else int(split[1:]))
+                threshold.append(np.float32(node['split_condition']))
+                left.append(offset + node['yes'])
+                right.append(offset + node['no'])
+                missing.append(offset + node['missing'])
+                value.append(0.0)
+
+    return {'roots': roots,
+            'feature': feature,
+            'threshold': threshold,
+            'left': left,
+            'right': right,
+            'missing': missing,
+            'value': value,
+            'max_depth': max_depth,
+            'strict_less_than': True,
+            'base_margin': np.log(base_score / (1 - base_score)),
+            'logistic_link': True}
+
+def compile_inference_kernel(pre_processor, model):
+    '''
+    Compile a fitted pre-processor and model into an InferenceKernel.
+    Supports LogisticRegression, DecisionTreeClassifier and XGBClassifier for binary classification and raises a TypeError otherwise.
+    '''
+    input_columns, column_groups, n_features, affine_steps = compile_preprocessor(pre_processor)
+    if len(model.classes_) != 2:
+        raise TypeError('Only binary classifiers can be compiled')
+    positive_class = model.classes_[1]
+
+    if isinstance(model, LogisticRegression):
+        return LinearInferenceKernel(input_columns, column_groups, n_features, affine_steps, positive_class,
+                                     model.coef_[0], model.intercept_[0])
+    if isinstance(model, DecisionTreeClassifier):
+        return TreeInferenceKernel(input_columns, column_groups, n_features, affine_steps, positive_class,
+                                   **_flatten_sklearn_tree(model))
+    if isinstance(model, XGBClassifier):
+        return TreeInferenceKernel(input_columns, column_groups, n_features, affine_steps, positive_class,
+                                   **_flatten_xgboost_trees(model))
+
+    raise TypeError(f'Cannot compile model {type(model).__name__}')
+
+def synthetic_sample(input_columns, n_rows = 256, random_state = 42):
+    '''
+    Return a data frame of non-negative random values with given columns, used for parity checks when no real data is at hand
+    '''
+    rng = np.random.default_rng(random_state)
+    return pd.DataFrame(np.abs(rng.standard_normal((n_rows, len(input_columns)))) * 10, columns = input_columns)
+
+def export_inference_kernel(pre_processor, model, X, atol = 1e-6):
+    '''
+    Compile the pre-processor and model and check the kernel against them on X.
+    Returns a tuple of format (kernel, max absolute difference).
+    '''
+    logging.info('Initiating compilation of inference kernel...')
+
+    kernel = compile_inference_kernel(pre_processor, model)
+    max_abs_diff = kernel.check_parity(pre_processor, model, X, atol)
+
+    logging.info(f'Successfully compiled {type(kernel).__name__} with maximum absolute difference of {max_abs_diff}!!!')
+    return (kernel, max_abs_diff)
@@ -0,0 +1,242 @@
+import os
+import glob
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.logger import logging
+from src.components.inference_kernel import InferenceKernel, LinearInferenceKernel, TreeInferenceKernel
+from src.utils import file_sha256, save_json, load_json
+
+@dataclass
+class KernelArtifactConfig:
+    '''
+    A data class for storing paths and settings related to the memory-mappable inference kernel artifact
+    '''
+    artifact_dir = os.path.join('artifacts', 'inference_kernel')
+    manifest_file_name = 'manifest.json'
+    format_version = 1
+    alignment = 64 # Every array starts at a multiple of this many bytes of the data file
+    verify_checksum = True # Check the sha256 of the data file against the manifest when loading
+    check_interval = 1.0 # Minimum number of seconds between two checks of the manifest on disk
+
+# Arrays and scalars stored for every kind of kernel, besides those of the pre-processor
+KERNEL_FIELDS = {
+    'LinearInferenceKernel': (LinearInferenceKernel, ('weights',), ('bias',)),
+    'TreeInferenceKernel': (TreeInferenceKernel,
+                            ('roots', 'feature', 'threshold', 'left', 'right', 'missing', 'value'),
+                            ('max_depth', 'strict_less_than', 'base_margin', 'logistic_link'))
+}
+
+def _to_json_scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+class ArtifactWriter:
+    '''
+    Collects named arrays into one data file, each aligned to KernelArtifactConfig.alignment bytes
+    '''
+    def __init__(self, alignment):
+        self.alignment = alignment
+        self.arrays = {}
+        self.chunks = []
+        self.n_bytes = 0
+
+    def add(self, name, array):
+        '''
+        Add an array, or None, and return the name it is stored under in the manifest
+        '''
+        if array is None:
+            return None
+
+        array = np.ascontiguousarray(array)
+        padding = -self.n_bytes % self.alignment
+        self.chunks.append(b'\0' * padding)
+        self.n_bytes += padding
+
+        self.arrays[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': self.n_bytes}
+        self.chunks.append(array.tobytes())
+        self.n_bytes += array.nbytes
+
+        return name
+
+def save_kernel_artifact(kernel, artifact_dir = None, metadata = None):
+    '''
+    Save an InferenceKernel as a data file of aligned arrays and a JSON manifest describing them, without pickling.
+    The data file is named after its checksum and the manifest is replaced last, so a reader sees either the old or the new kernel.
+    Returns the path of the manifest.
+    '''
+    kernel_artifact_config = KernelArtifactConfig()
+    artifact_dir = artifact_dir or kernel_artifact_config.artifact_dir
+    kernel_type = type(kernel).__name__
+    if kernel_type not in KERNEL_FIELDS:
+        raise TypeError(f'Cannot save kernel {kernel_type} as an artifact')
+    _, array_fields, scalar_fields = KERNEL_FIELDS[kernel_type]
+
+    writer = ArtifactWriter(kernel_artifact_config.alignment)
+
+    column_groups = [{'functions': list(function_names),
+                      'input_indices': writer.add(f'column_groups.{index}.input_indices', input_indices),
+                      'output_indices': writer.add(f'column_groups.{index}.output_indices', output_indices)}
+                     for index, (function_names, input_indices, output_indices) in enumerate(kernel.column_groups)]
+
+    affine_steps = []
+    for index, step in enumerate(kernel.affine_steps):
+        names = ('mean', 'scale') if step[0] == 'scaler' else ('mean', 'components', 'whiten_scale')
+        affine_steps.append({'type': step[0], **{name: writer.add(f'affine_steps.{index}.{name}', array) for name, array in zip(names, step[1:])}})
+
+    manifest = {'format_version': kernel_artifact_config.format_version,
+                'kernel_type': kernel_type,
+                'input_columns': kernel.input_columns,
+                'n_features': kernel.n_features,
+                'positive_class': _to_json_scalar(kernel.positive_class),
+                'column_groups': column_groups,
+                'affine_steps': affine_steps,
+                'fields': {name: writer.add(name, getattr(kernel, name)) for name in array_fields},
+                'scalars': {name: _to_json_scalar(getattr(kernel, name)) for name in scalar_fields},
+                'arrays': writer.arrays,
+                'metadata': metadata or {}}
+
+    data = b''.join(writer.chunks)
+    data_sha256 = hashlib.sha256(data).hexdigest()
+    data_file_name = f'weights-{data_sha256[:16]}.bin'
+    manifest.update({'data_file': data_file_name, 'data_bytes': len(data), 'data_sha256': data_sha256, 'created_at': time.time()})
+
+    os.makedirs(artifact_dir, exist_ok = True)
+    data_path = os.path.join(artifact_dir, data_file_name)
+    temp_data_path = f'{data_path}.{os.getpid()}.tmp'
+    with open(temp_data_path, 'wb') as file_obj:
+        file_obj.write(data)
+    os.replace(temp_data_path, data_path)
+
+    manifest_path = os.path.join(artifact_dir, kernel_artifact_config.manifest_file_name)
+    save_json(manifest_path, manifest)
+
+    # Data files of older kernels stay valid for processes which mapped them, unlinking only hides them from new readers
+    for old_data_path in glob.glob(os.path.join(artifact_dir, 'weights-*.bin')):
+        if os.path.basename(old_data_path) != data_file_name:
+            os.remove(old_data_path)
+
+    logging.info(f'Saved {kernel_type} artifact of {len(data)} bytes to {artifact_dir}')
+    return manifest_path
+
+def load_kernel_artifact(artifact_dir = None, verify_checksum = None):
+    '''
+    Load an InferenceKernel saved by save_kernel_artifact. Its arrays are read-only views of the memory-mapped data file,
+    so loading takes no time beyond reading the manifest and processes loading the same file share one copy of the weights.
+    Raises a ValueError if the data file does not match the manifest.
+    '''
+    kernel_artifact_config = KernelArtifactConfig()
+    artifact_dir = artifact_dir or kernel_artifact_config.artifact_dir
+    verify_checksum = kernel_artifact_config.verify_checksum if verify_checksum is None else verify_checksum
+
+    manifest = load_json(os.path.join(artifact_dir, kernel_artifact_config.manifest_file_name))
+    if manifest['format_version'] != kernel_artifact_config.format_version:
+        raise ValueError(f'Unsupported kernel artifact format version {manifest["format_version"]}')
+    if manifest['kernel_type'] not in KERNEL_FIELDS:
+        raise ValueError(f'Unknown kernel type {manifest["kernel_type"]}')
+    kernel_class, array_fields, scalar_fields = KERNEL_FIELDS[manifest['kernel_type']]
+
+    data_path = os.path.join(artifact_dir, manifest['data_file'])
+    if os.path.getsize(data_path) != manifest['data_bytes']:
+        raise ValueError(f'Kernel artifact data file {data_path} does not have the size recorded in the manifest')
+    if verify_checksum and file_sha256(data_path) != manifest['data_sha256']:
+        raise ValueError(f'Kernel artifact data file {data_path} does not match the checksum recorded in the manifest')
+
+    data = np.memmap(data_path, dtype = np.uint8, mode = 'r') if manifest['data_bytes'] else np.empty(0, dtype = np.uint8)
+
+    def array(name):
+        if name is None:
+            return None
+        spec = manifest['arrays'][name]
+        return np.ndarray(tuple(spec['shape']), dtype = np.dtype(spec['dtype']), buffer = data, offset = spec['offset'])
+
+    # The arrays are set directly, as the constructors would fold or copy them
+    kernel = kernel_class.__new__(kernel_class)
+    InferenceKernel.__init__(kernel,
+                             manifest['input_columns'],
+                             [(group['functions'], array(group['input_indices']), array(group['output_indices'])) for group in manifest['column_groups']],
+                             manifest['n_features'],
+                             [(step['type'], array(step['mean']), array(step['scale'])) if step['type'] == 'scaler'
+                              else (step['type'], array(step['mean']), array(step['components']), array(step['whiten_scale']))
+                              for step in manifest['affine_steps']],
+                             manifest['positive_class'])
+    for name in array_fields:
+        setattr(kernel, name, array(manifest['fields'][name]))
+    for name in scalar_fields:
+        setattr(kernel, name, manifest['scalars'][name])
+    kernel.metadata = manifest['metadata']
+
+    return kernel
+
+def remove_kernel_artifact(artifact_dir = None):
+    '''
+    Remove the manifest of the kernel artifact, if any, so that readers fall back to the pickled model and pre-processor
+    '''
+    kernel_artifact_config = KernelArtifactConfig()
+    manifest_path = os.path.join(artifact_dir or kernel_artifact_config.artifact_dir, kernel_artifact_config.manifest_file_name)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+class KernelArtifactCache:
+    '''
+    A class for keeping the loaded kernel artifact of a directory in memory and reloading it when a new one is saved
+    '''
+    def __init__(self, artifact_dir):
+        self.kernel_artifact_config = KernelArtifactConfig()
+        self.manifest_path = os.path.join(artifact_dir, self.kernel_artifact_config.manifest_file_name)
+        self.artifact_dir = artifact_dir
+
+        self._kernel = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _manifest_fingerprint(self):
+        try:
+            stat_result = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+    def get(self):
+        '''
+        Return the current kernel of the artifact directory, or None if there is no artifact
+        '''
+        now = time.monotonic()
+        if self._fingerprint is not None and now - self._last_check < self.kernel_artifact_config.check_interval:
+            return self._kernel
+
+        with self._lock:
+            self._last_check = now
+            fingerprint = self._manifest_fingerprint()
+            if fingerprint == self._fingerprint:
+                return self._kernel
+
+            if fingerprint is None:
+                self._kernel = None
+            else:
+                start_time = time.perf_counter()
+                self._kernel = load_kernel_artifact(self.artifact_dir)
+                logging.info(f'Loaded kernel artifact version {self._kernel.metadata.get("version")} in {time.perf_counter() - start_time:.4f} seconds')
+            self._fingerprint = fingerprint
+
+            return self._kernel
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_kernel_artifact(artifact_dir = None):
+    '''
+    Return the process wide kernel of given artifact directory, or None if it has no artifact
+    '''
+    artifact_dir = os.path.abspath(artifact_dir or KernelArtifactConfig().artifact_dir)
+
+    with _caches_lock:
+        if artifact_dir not in _caches:
+            _caches[artifact_dir] = KernelArtifactCache(artifact_dir)
+        cache = _caches[artifact_dir]
+
+    return cache.get()
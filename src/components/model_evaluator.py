@@ -1,4 +1,7 @@
 from src.logger import logging
+from src.instrumentation import instrument_stage
+from dataclasses import dataclass
+import numpy as np
 
 from sklearn.preprocessing import StandardScaler, FunctionTransformer
 from sklearn.compose import ColumnTransformer
@@ -11,10 +14,99 @@ from xgboost import XGBClassifier
 
 from sklearn.metrics import auc, precision_recall_curve
 
+@dataclass
+class ModelEvaluatorConfig:
+    '''
+    A data class for storing settings of the evaluation report
+    '''
+    chunk_size = 100000 # Rows transformed and scored at a time
+    precision_at_k = (100, 500, 1000) # Precision among the k highest scoring transactions, as reviewed by an analyst team of fixed capacity
+    recall_at_fpr = (0.001, 0.01) # Recall achievable while flagging at most this share of genuine transactions
+    false_positive_cost = 1.0 # Cost of reviewing a genuine transaction flagged as fraudulent
+    false_negative_cost = 100.0 # Cost of a missed fraudulent transaction, relative to false_positive_cost
+    lower_is_better = ('min_cost', 'min_cost_per_transaction') # Report metrics ranked in ascending order
+
+def curve_metrics(y_true, y_score, precision_at_k = None, recall_at_fpr = None, false_positive_cost = None, false_negative_cost = None):
+    '''
+    Compute every curve based metric of binary labels y_true and fraud scores y_score from a single sort of the scores and return them as a dictionary.
+    pr_auc is computed exactly as area_under_precision_recall_curve does. The cost-optimal threshold t minimizes
+    false_positive_cost * FP + false_negative_cost * FN when transactions with score > t are flagged as fraudulent.
+    '''
+    model_evaluator_config = ModelEvaluatorConfig()
+    precision_at_k = model_evaluator_config.precision_at_k if precision_at_k is None else precision_at_k
+    recall_at_fpr = model_evaluator_config.recall_at_fpr if recall_at_fpr is None else recall_at_fpr
+    false_positive_cost = model_evaluator_config.false_positive_cost if false_positive_cost is None else false_positive_cost
+    false_negative_cost = model_evaluator_config.false_negative_cost if false_negative_cost is None else false_negative_cost
+
+    y_true = np.asarray(y_true) == 1
+    y_score = np.asarray(y_score, dtype = np.float64)
+    n_rows = len(y_true)
+    n_positive = int(y_true.sum())
+    n_negative = n_rows - n_positive
+
+    # Sorting once by descending score, then counting true and false positives at every distinct score
+    order = np.argsort(y_score, kind = 'mergesort')[::-1]
+    y_score, y_true = y_score[order], y_true[order]
+    distinct_idx = np.flatnonzero(np.diff(y_score))
+    threshold_idx = np.r_[distinct_idx, n_rows - 1]
+    tps = np.cumsum(y_true, dtype = np.float64)[threshold_idx]
+    fps = 1 + threshold_idx - tps
+    thresholds = y_score[threshold_idx]
+
+    # Precision recall curve, in the same order of points as sklearn's precision_recall_curve, so that the area matches it exactly
+    predicted_positive = tps + fps
+    precision = np.zeros_like(tps)
+    np.divide(tps, predicted_positive, out = precision, where = predicted_positive != 0)
+    recall = np.ones_like(tps) if tps[-1] == 0 else tps / tps[-1]
+    pr_auc = auc(np.hstack((recall[::-1], 0)), np.hstack((precision[::-1], 1)))
+
+    # ROC curve starting at (0, 0)
+    tpr = np.r_[0, tps / n_positive] if n_positive else np.full(len(tps) + 1, np.nan)
+    fpr = np.r_[0, fps / n_negative] if n_negative else np.full(len(fps) + 1, np.nan)
+    roc_auc = float(auc(fpr, tpr)) if n_positive and n_negative else float('nan')
+
+    report = {'n_rows': n_rows,
+              'n_positive': n_positive,
+              'pr_auc': float(pr_auc),
+              'roc_auc': roc_auc}
+
+    for k in precision_at_k:
+        report[f'precision_at_{k}'] = float(y_true[:k].mean()) if n_rows else float('nan')
+
+    for max_fpr in recall_at_fpr:
+        # fpr never decreases along the curve, so the last point within max_fpr has the highest recall
+        report[f'recall_at_fpr_{max_fpr}'] = float(tpr[np.searchsorted(fpr, max_fpr, side = 'right') - 1]) if n_positive and n_negative else float('nan')
+
+    # Cost of flagging nothing, then of flagging every score down to each distinct score
+    costs = np.r_[false_negative_cost * n_positive, false_positive_cost * fps + false_negative_cost * (n_positive - tps)]
+    best = int(np.argmin(costs))
+    if best == 0:
+        cost_optimal_threshold = y_score[0] if n_rows else 0.5
+    elif best < len(thresholds):
+        # Any t between the lowest flagged score and the next lower score flags the same transactions
+        cost_optimal_threshold = (thresholds[best - 1] + thresholds[best]) / 2
+    else:
+        cost_optimal_threshold = np.nextafter(thresholds[-1], -np.inf)
+
+    report.update({'cost_optimal_threshold': float(cost_optimal_threshold),
+                   'min_cost': float(costs[best]),
+                   'min_cost_per_transaction': float(costs[best] / n_rows) if n_rows else float('nan')})
+    return report
+
+def metric_greater_is_better(metric):
+    '''
+    Return whether a higher value of given report metric is better
+    '''
+    return metric not in ModelEvaluatorConfig.lower_is_better
+
 class ModelEvaluator:
     '''
     A class for evaluating our model on given data.
     '''
+    def __init__(self):
+        self.model_evaluator_config = ModelEvaluatorConfig()
+
+    @instrument_stage('model_evaluator.evaluate', rows_in = 'X')
     def evaluate(self, pre_processor, model, X, Y, scorer_func, name_for_data):
         '''
         Method Description: Model evaluation method.
@@ -28,4 +120,37 @@ class ModelEvaluator:
         score = scorer_func(Y, Y_pred[:, 1])
 
         logging.info(f'Successfully completed model evaluation for {name_for_data} data set with score  = {score}!!!')
-        return score 
\ No newline at end of file
+        return score
+
+    def predict_scores(self, pre_processor, model, X, chunk_size = None):
+        '''
+        Method Description: Chunked scoring method.
+        Transforms and scores X in chunks of chunk_size rows, so that every row is transformed once and memory stays bounded,
+        and returns the fraud probability of every row.
+        '''
+        chunk_size = chunk_size or self.model_evaluator_config.chunk_size
+        scores = np.empty(len(X), dtype = np.float64)
+
+        for start in range(0, len(X), chunk_size):
+            X_chunk = X.iloc[start:start + chunk_size] if hasattr(X, 'iloc') else X[start:start + chunk_size]
+            scores[start:start + len(X_chunk)] = model.predict_proba(pre_processor.transform(X_chunk))[:, 1]
+
+        return scores
+
+    @instrument_stage('model_evaluator.evaluate_report', rows_in = 'X')
+    def evaluate_report(self, pre_processor, model, X, Y, name_for_data, chunk_size = None):
+        '''
+        Method Description: Multi-metric model evaluation method.
+        Takes in the pre-processor, model, X, Y and name or title of the data set, scores X once and returns a report dictionary
+        with PR-AUC, ROC-AUC, precision@k, recall at fixed false positive rates and the cost-optimal threshold.
+        '''
+        logging.info(f'Initiating model evaluation report for {name_for_data} data set...')
+
+        report = curve_metrics(Y, self.predict_scores(pre_processor, model, X, chunk_size),
+                               self.model_evaluator_config.precision_at_k,
+                               self.model_evaluator_config.recall_at_fpr,
+                               self.model_evaluator_config.false_positive_cost,
+                               self.model_evaluator_config.false_negative_cost)
+
+        logging.info(f'Successfully completed model evaluation report for {name_for_data} data set with PR-AUC = {report["pr_auc"]}, ROC-AUC = {report["roc_auc"]}!!!')
+        return report
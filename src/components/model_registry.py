@@ -0,0 +1,232 @@
+import os
+import time
+import hashlib
+import threading
+from dataclasses import dataclass, field
+
+from src.logger import logging
+from src.instrumentation import instrument_stage
+from src.components.inference_kernel import compile_inference_kernel, synthetic_sample
+from src.utils import load_object_from_bytes, load_json
+
+@dataclass
+class ModelRegistryConfig:
+    '''
+    A data class for storing paths and settings related to the model registry
+    '''
+    model_file_path = os.path.join('artifacts', 'model.pkl')
+    preprocessor_path = os.path.join('artifacts', 'preprocessor.pkl')
+    model_version_path = os.path.join('artifacts', 'model_version.json')
+    check_interval = 1.0 # Minimum number of seconds between two checks of the files on disk
+    load_retries = 5 # Number of attempts made to load a consistent pair while it is being written
+    load_retry_delay = 0.1
+
+@dataclass(frozen = True)
+class ModelVersion:
+    '''
+    An immutable snapshot of a loaded model and pre-processor pair.
+    The registry swaps whole snapshots, so a reader always gets a model and pre-processor that belong together.
+    '''
+    version: str
+    model: object
+    preprocessor: object
+    fingerprint: tuple
+    loaded_at: float
+    load_seconds: float
+    metadata: dict = field(default_factory = dict)
+
+class ModelRegistry:
+    '''
+    A class for keeping the model and pre-processor in memory and hot-swapping them when new ones are saved
+    '''
+    def __init__(self, model_file_path = None, preprocessor_path = None, model_version_path = None, check_interval = None):
+        self.model_registry_config = ModelRegistryConfig()
+        self.model_file_path = model_file_path or self.model_registry_config.model_file_path
+        self.preprocessor_path = preprocessor_path or self.model_registry_config.preprocessor_path
+        self.model_version_path = model_version_path or self.model_registry_config.model_version_path
+        self.check_interval = self.model_registry_config.check_interval if check_interval is None else check_interval
+
+        self._current = None
+        self._kernels = {}
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'cache_hits': 0, 'loads': 0, 'swaps': 0, 'failed_loads': 0, 'total_load_seconds': 0.0}
+
+    def _stat(self, path):
+        '''
+        Return (modification time in ns, size) of given path or None if it does not exist
+        '''
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+    def fingerprint(self):
+        '''
+        Return a cheap fingerprint of the files on disk used to detect that a new pair was saved
+        '''
+        return (self._stat(self.model_file_path), self._stat(self.preprocessor_path), self._stat(self.model_version_path))
+
+    def _read_pair(self):
+        '''
+        Read the model and pre-processor files and return their bytes along with the version information.
+        Raises a RuntimeError if the files on disk do not match the version file, i.e. a pair is still being written.
+        '''
+        fingerprint = self.fingerprint()
+
+        with open(self.model_file_path, 'rb') as file_obj:
+            model_bytes = file_obj.read()
+        with open(self.preprocessor_path, 'rb') as file_obj:
+            preprocessor_bytes = file_obj.read()
+
+        model_sha256 = hashlib.sha256(model_bytes).hexdigest()
+        preprocessor_sha256 = hashlib.sha256(preprocessor_bytes).hexdigest()
+
+        metadata = {}
+        if os.path.exists(self.model_version_path):
+            metadata = load_json(self.model_version_path)
+            if metadata.get('model_sha256') != model_sha256 or metadata.get('preprocessor_sha256') != preprocessor_sha256:
+                raise RuntimeError('Model and pre-processor on disk do not match the version file, a new pair is being written.')
+        elif fingerprint != self.fingerprint():
+            raise RuntimeError('Model or pre-processor changed while being read.')
+
+        version = metadata.get('version', hashlib.sha256((model_sha256 + preprocessor_sha256).encode()).hexdigest()[:12])
+
+        return (model_bytes, preprocessor_bytes, version, fingerprint, metadata)
+
+    @instrument_stage('model_registry.load')
+    def _load(self):
+        '''
+        Load a consistent model and pre-processor pair from disk and return it as a ModelVersion
+        '''
+        logging.info('Loading model and pre-processor into model registry...')
+        start_time = time.perf_counter()
+
+        for attempt in range(self.model_registry_config.load_retries):
+            try:
+                model_bytes, preprocessor_bytes, version, fingerprint, metadata = self._read_pair()
+                break
+            except RuntimeError:
+                if attempt == self.model_registry_config.load_retries - 1:
+                    raise
+                time.sleep(self.model_registry_config.load_retry_delay)
+
+        model = load_object_from_bytes(model_bytes)
+        preprocessor = load_object_from_bytes(preprocessor_bytes)
+        load_seconds = time.perf_counter() - start_time
+
+        self.stats['loads'] += 1
+        self.stats['total_load_seconds'] += load_seconds
+
+        logging.info(f'Successfully loaded model version {version} into model registry in {load_seconds:.4f} seconds!!!')
+        return ModelVersion(version, model, preprocessor, fingerprint, time.time(), load_seconds, metadata)
+
+    def get(self):
+        '''
+        Return the current ModelVersion, loading it or swapping in a newer pair if the files on disk have changed
+        '''
+        current = self._current
+        now = time.monotonic()
+
+        if current is not None and now - self._last_check < self.check_interval:
+            self.stats['cache_hits'] += 1
+            return current
+
+        with self._lock:
+            current = self._current
+            self._last_check = now
+
+            if current is not None and current.fingerprint == self.fingerprint():
+                self.stats['cache_hits'] += 1
+                return current
+
+            try:
+                new_version = self._load()
+            except Exception:
+                # Keep serving the old pair, if any, when the new one cannot be loaded yet
+                self.stats['failed_loads'] += 1
+                if current is None:
+                    raise
+                logging.error('Could not load new model and pre-processor, continuing with the current version.', exc_info = True)
+                return current
+
+            self._swap(new_version)
+            return new_version
+
+    def _swap(self, new_version):
+        '''
+        Atomically replace the current ModelVersion
+        '''
+        if self._current is not None:
+            self.stats['swaps'] += 1
+            logging.info(f'Model registry swapped version {self._current.version} for version {new_version.version}')
+        self._current = new_version
+
+    def get_inference_kernel(self):
+        '''
+        Return a tuple of format (ModelVersion, kernel) where kernel is the compiled inference kernel of the current version.
+        The kernel is compiled and checked for parity once per version; kernel is None if the pair cannot be compiled.
+        '''
+        model_version = self.get()
+        kernels = self._kernels
+
+        if model_version.version not in kernels:
+            kernel = None
+            try:
+                kernel = compile_inference_kernel(model_version.preprocessor, model_version.model)
+                kernel.check_parity(model_version.preprocessor,
+                                    model_version.model,
+                                    synthetic_sample(kernel.input_columns),
+                                    model_version.metadata.get('inference_kernel_atol', 1e-6))
+                logging.info(f'Compiled inference kernel for model version {model_version.version}')
+            except (TypeError, ValueError):
+                kernel = None
+                logging.error(f'Could not compile inference kernel for model version {model_version.version}, using the model directly.', exc_info = True)
+
+            # Only the kernel of the current version is kept
+            kernels = {model_version.version: kernel}
+            self._kernels = kernels
+
+        return (model_version, kernels[model_version.version])
+
+    def publish(self, model, preprocessor, metadata):
+        '''
+        Swap in an already fitted model and pre-processor pair, which has just been saved to disk, without reloading it
+        '''
+        with self._lock:
+            new_version = ModelVersion(metadata['version'], model, preprocessor, self.fingerprint(), time.time(), 0.0, metadata)
+            self._swap(new_version)
+            self._last_check = time.monotonic()
+
+    def info(self):
+        '''
+        Return a dictionary describing the current version and the registry statistics
+        '''
+        current = self._current
+        info = dict(self.stats)
+        info['loaded'] = current is not None
+
+        if current is not None:
+            info['version'] = current.version
+            info['loaded_at'] = current.loaded_at
+            info['load_seconds'] = current.load_seconds
+            info['metadata'] = current.metadata
+
+        return info
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_model_registry(model_file_path = None, preprocessor_path = None):
+    '''
+    Return the process wide ModelRegistry for given model and pre-processor paths, creating it if required
+    '''
+    config = ModelRegistryConfig()
+    key = (os.path.abspath(model_file_path or config.model_file_path), os.path.abspath(preprocessor_path or config.preprocessor_path))
+
+    with _registries_lock:
+        if key not in _registries:
+            model_version_path = os.path.join(os.path.dirname(key[0]), os.path.basename(config.model_version_path))
+            _registries[key] = ModelRegistry(key[0], key[1], model_version_path)
+        return _registries[key]
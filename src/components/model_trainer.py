@@ -1,4 +1,5 @@
 from src.logger import logging
+from src.instrumentation import instrument_stage
 
 from sklearn.linear_model import LogisticRegression
 from sklearn.tree import DecisionTreeClassifier
@@ -8,6 +9,7 @@ class ModelTrainer:
     '''
     A class for training our model for training pipeline
     '''
+    @instrument_stage('model_trainer.train_model', rows_in = 'X_train')
     def train_model(self, model, params, X_train, Y_train):
         '''
         Method Description: Model training method
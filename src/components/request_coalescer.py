@@ -0,0 +1,140 @@
+import time
+import queue
+import threading
+from dataclasses import dataclass
+from concurrent.futures import Future
+
+import pandas as pd
+
+from src.logger import logging
+from src.instrumentation import metrics_registry
+
+@dataclass
+class RequestCoalescerConfig:
+    '''
+    A data class for storing settings related to coalescing of single-row prediction requests
+    '''
+    max_wait_ms = 2.0 # Time the first request of a batch waits for more requests to arrive
+    max_batch_size = 64
+    batch_size_buckets = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+    queue_delay_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+class RequestCoalescer:
+    '''
+    A class for coalescing concurrent single-row prediction requests into batches.
+    A background thread collects rows for up to max_wait_ms after the first one or until max_batch_size rows are waiting,
+    scores them with one call of score_batch and hands every caller its own fraud probability.
+    Rows missing any of the input columns are failed on submit, so a bad row never reaches a batch; if a batch still fails,
+    its rows are scored one at a time and only the callers whose rows fail get the error.
+    '''
+    def __init__(self, score_batch, max_wait_ms = None, max_batch_size = None, input_columns = None):
+        self.request_coalescer_config = RequestCoalescerConfig()
+        self.score_batch = score_batch # Takes a data frame of rows and returns their fraud probabilities
+        self.max_wait = (self.request_coalescer_config.max_wait_ms if max_wait_ms is None else max_wait_ms) / 1000
+        self.max_batch_size = max_batch_size or self.request_coalescer_config.max_batch_size
+        self.input_columns = input_columns # Returns the feature names every row must have, e.g. of the current model
+
+        self._queue = queue.Queue()
+        self.batch_size = metrics_registry.histogram('coalescer_batch_size', 'Rows per batch scored by the request coalescer.',
+                                                     buckets = self.request_coalescer_config.batch_size_buckets)
+        self.queue_delay = metrics_registry.histogram('coalescer_queue_delay_seconds', 'Time requests wait in the request coalescer before being scored.',
+                                                      buckets = self.request_coalescer_config.queue_delay_buckets)
+        self.errors = metrics_registry.counter('coalescer_errors_total', 'Batches of the request coalescer which failed to be scored.')
+        self.rejected = metrics_registry.counter('coalescer_rejected_rows_total', 'Rows rejected by the request coalescer for missing input columns.')
+
+        self._worker = threading.Thread(target = self._run, name = 'request-coalescer', daemon = True)
+        self._worker.start()
+
+    def submit(self, row):
+        '''
+        Queue one row, given as a dictionary of feature values, and return a Future of its fraud probability
+        '''
+        future = Future()
+        try:
+            columns = self.input_columns() if self.input_columns is not None else None
+            missing = [column for column in columns if column not in row] if columns is not None else []
+            if missing:
+                raise ValueError(f'Row is missing input columns {missing}.')
+        except Exception as e:
+            self.rejected.inc()
+            future.set_exception(e)
+            return future
+
+        self._queue.put((time.perf_counter(), row, future))
+        return future
+
+    def predict(self, row, timeout = None):
+        '''
+        Return the fraud probability of one row, given as a dictionary of feature values, once its batch has been scored
+        '''
+        return self.submit(row).result(timeout)
+
+    def _collect_batch(self):
+        '''
+        Block until a request arrives and return it with every request arriving within the wait window, up to max_batch_size
+        '''
+        batch = [self._queue.get()]
+        deadline = batch[0][0] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout = remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _frame(self, rows):
+        '''
+        Return a data frame of rows, limited to and ordered as the input columns when they are known
+        '''
+        columns = self.input_columns() if self.input_columns is not None else None
+        return pd.DataFrame.from_records(rows, columns = columns)
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            dispatched_at = time.perf_counter()
+
+            try:
+                fraud_prob = self.score_batch(self._frame([row for _, row, _ in batch]))
+            except Exception as e:
+                logging.error('Scoring of coalesced batch failed, scoring its rows one at a time.', exc_info = True)
+                self.errors.inc()
+                fraud_prob = None
+                if len(batch) == 1:
+                    batch[0][2].set_exception(e)
+
+            if fraud_prob is not None:
+                for (_, _, future), probability in zip(batch, fraud_prob):
+                    future.set_result(float(probability))
+            elif len(batch) > 1:
+                # Only the callers whose own rows fail get an error
+                for _, row, future in batch:
+                    try:
+                        future.set_result(float(self.score_batch(self._frame([row]))[0]))
+                    except Exception as e:
+                        future.set_exception(e)
+
+            self.batch_size.observe(len(batch))
+            for enqueued_at, _, _ in batch:
+                self.queue_delay.observe(dispatched_at - enqueued_at)
+
+    def stats(self):
+        '''
+        Return the batch size and queueing delay distributions as cumulative counts per bucket upper bound, along with totals
+        '''
+        batch_size = self.batch_size.snapshot()
+        queue_delay = self.queue_delay.snapshot()
+        return {'max_wait_ms': self.max_wait * 1000,
+                'max_batch_size': self.max_batch_size,
+                'batches': batch_size['count'],
+                'rows': int(batch_size['sum']),
+                'errors': self.errors.value(),
+                'rejected_rows': self.rejected.value(),
+                'queued': self._queue.qsize(),
+                'mean_batch_size': batch_size['sum'] / batch_size['count'] if batch_size['count'] else 0.0,
+                'mean_queue_delay_ms': queue_delay['sum'] * 1000 / queue_delay['count'] if queue_delay['count'] else 0.0,
+                'batch_size_buckets': {str(bucket): count for bucket, count in batch_size['buckets'].items()},
+                'queue_delay_ms_buckets': {str(bucket * 1000): count for bucket, count in queue_delay['buckets'].items()}}
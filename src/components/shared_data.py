@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.logger import logging
+
+# tmpfs backed directory, files in it live in shared memory
+SHARED_MEMORY_DIR = '/dev/shm'
+
+class SharedDataStore:
+    '''
+    A class for sharing data frames, series and arrays between processes without pickling them.
+    Each object is written once as a .npy file, in shared memory when available, and every process memory-maps it read-only.
+    '''
+    def __init__(self, directory = None):
+        if directory is None:
+            directory = SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) and os.access(SHARED_MEMORY_DIR, os.W_OK) else None
+        self.directory = tempfile.mkdtemp(prefix = 'credit_card_fraud_', dir = directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+    def _save_array(self, name, array):
+        path = os.path.join(self.directory, f'{name}.npy')
+        np.save(path, np.ascontiguousarray(array))
+        return path
+
+    def share(self, name, obj):
+        '''
+        Write a data frame, series or array to the store and return a small picklable descriptor for load_shared
+        '''
+        if isinstance(obj, pd.DataFrame):
+            return {'kind': 'frame',
+                    'values': self._save_array(name, obj.to_numpy()),
+                    'index': self._save_array(f'{name}_index', obj.index.to_numpy()),
+                    'columns': obj.columns.tolist()}
+        if isinstance(obj, pd.Series):
+            return {'kind': 'series',
+                    'values': self._save_array(name, obj.to_numpy()),
+                    'index': self._save_array(f'{name}_index', obj.index.to_numpy()),
+                    'name': obj.name}
+        return {'kind': 'array', 'values': self._save_array(name, np.asarray(obj))}
+
+    def cleanup(self):
+        '''
+        Remove the store and all of its files
+        '''
+        shutil.rmtree(self.directory, ignore_errors = True)
+        logging.info(f'Removed shared data store {self.directory}')
+
+def load_shared(descriptor):
+    '''
+    Memory-map an object written by SharedDataStore.share, without copying its values
+    '''
+    values = np.load(descriptor['values'], mmap_mode = 'r')
+
+    if descriptor['kind'] == 'frame':
+        index = pd.Index(np.load(descriptor['index'], mmap_mode = 'r'))
+        return pd.DataFrame(values, index = index, columns = descriptor['columns'], copy = False)
+    if descriptor['kind'] == 'series':
+        index = pd.Index(np.load(descriptor['index'], mmap_mode = 'r'))
+        return pd.Series(values, index = index, name = descriptor['name'], copy = False)
+    return values
@@ -0,0 +1,180 @@
+import os
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.components.model_evaluator import metric_greater_is_better
+from src.logger import logging
+
+@dataclass
+class SuccessiveHalvingConfig:
+    '''
+    A data class for storing settings related to successive halving model selection
+    '''
+    eta = 3 # Every rung keeps the best 1/eta of the candidates and gives them eta times the budget
+    min_budget = None # Smallest share of the train rows a rung trains on, the first rung is at 1/eta**(rungs - 1) otherwise
+    min_positive_rows = 50 # Fraud rows the first rung trains on at least, smaller subsamples rank candidates on noise
+    boosting_rounds_param = 'n_estimators' # Parameter of best_params scaled with the budget, for boosted models
+    time_budget_seconds = float(os.environ.get('SELECTION_TIME_BUDGET', '0')) or None # Wall-clock budget, once the next rung would exceed it only the best candidate is trained on all rows
+    random_state = 42
+
+def stratified_subsample(Y, fraction, random_state = 42):
+    '''
+    Return the sorted positions of a stratified subsample of fraction of the rows of Y, keeping at least one row of each class.
+    Subsamples of the same random_state are nested, the rows of a smaller fraction are part of every larger one.
+    '''
+    labels = np.asarray(Y)
+    rng = np.random.default_rng(random_state)
+    positions = []
+    for label in np.unique(labels):
+        class_positions = rng.permutation(np.flatnonzero(labels == label))
+        positions.append(class_positions[:max(1, math.ceil(fraction * len(class_positions)))])
+
+    return np.sort(np.concatenate(positions))
+
+class SuccessiveHalving:
+    '''
+    A class for choosing among the candidates of models_data without training every one of them on all the data.
+    All candidates are first trained on a small stratified subsample of the train set with proportionally fewer boosting rounds
+    and scored on the test set; the best 1/eta are promoted to eta times the rows and rounds, until the survivors are trained on
+    the full budget exactly as exhaustive training would train them. The report compares the time spent with an estimate of
+    training every candidate on the full budget, extrapolated linearly in rows from the last rung each candidate reached;
+    resampling and pre-processing grow with the rows, so leaving out the boosting rounds keeps the estimate on the low side.
+    '''
+    def __init__(self, training_pipeline, successive_halving_config = None):
+        self.training_pipeline = training_pipeline
+        self.successive_halving_config = successive_halving_config or SuccessiveHalvingConfig()
+
+    def budgets(self, n_candidates, n_positive_rows):
+        '''
+        Return the share of train rows of every rung, ending with 1.0. There are as many rungs as it takes eta to divide the
+        candidates down to one, less the rungs whose share would fall below the floor of min_budget and min_positive_rows.
+        '''
+        eta = self.successive_halving_config.eta
+        floor = max(self.successive_halving_config.min_budget or 0.0, self.successive_halving_config.min_positive_rows / max(n_positive_rows, 1))
+        if n_candidates <= 1 or floor >= 1.0:
+            return [1.0]
+
+        n_rungs = 1
+        while eta ** (n_rungs - 1) < n_candidates:
+            n_rungs += 1
+        if floor > 0.0:
+            n_rungs = max(2, min(n_rungs, 1 + math.floor(math.log(1 / floor, eta) + 1e-9)))
+
+        budgets = [eta ** -(n_rungs - 1 - rung) for rung in range(n_rungs)]
+        budgets[0] = max(budgets[0], floor)
+        return budgets
+
+    def scaled_candidate(self, model, budget):
+        '''
+        Return a copy of a candidate of models_data with its boosting rounds scaled to budget, and the share of rounds it keeps
+        '''
+        rounds_param = self.successive_halving_config.boosting_rounds_param
+        if budget >= 1.0 or rounds_param not in model['best_params']:
+            return (model, 1.0)
+
+        n_rounds = model['best_params'][rounds_param]
+        scaled_rounds = max(1, round(n_rounds * budget))
+        return ({**model, 'best_params': {**model['best_params'], rounds_param: scaled_rounds}}, scaled_rounds / n_rounds)
+
+    def rank(self, candidates):
+        '''
+        Return the candidates sorted from best to worst on the selection metric of the training pipeline, failed candidates last
+        '''
+        metric = self.training_pipeline.training_pipeline_config.selection_metric
+        greater_is_better = metric is None or metric_greater_is_better(metric)
+
+        def score(candidate):
+            if 'error' in candidate:
+                return -np.inf
+            value = candidate['test_score'] if metric is None else candidate['test_report'][metric]
+            return value if greater_is_better else -value
+
+        return sorted(candidates, key = score, reverse = True)
+
+    def run(self, models_data, X_train, Y_train, X_test, Y_test, n_workers = None):
+        '''
+        Run successive halving over models_data and return a tuple of format (candidates trained on the full budget, report).
+        The candidates are the survivors of the last rung, to choose the best model from as after exhaustive training.
+        '''
+        eta = self.successive_halving_config.eta
+        time_budget = self.successive_halving_config.time_budget_seconds
+        budgets = self.budgets(len(models_data), int(np.sum(np.asarray(Y_train) == 1)))
+        start_time = time.perf_counter()
+
+        survivors = list(models_data)
+        history = {model['name']: [] for model in models_data}
+        worker_stages = []
+        rungs = []
+
+        rung = 0
+        while True:
+            budget = budgets[rung]
+            is_last = budget >= 1.0
+            rung_start = time.perf_counter()
+
+            if is_last:
+                X_rung, Y_rung = X_train, Y_train
+            else:
+                positions = stratified_subsample(Y_train, budget, self.successive_halving_config.random_state)
+                X_rung, Y_rung = X_train.iloc[positions], Y_train.iloc[positions]
+
+            scaled = [self.scaled_candidate(model, budget) for model in survivors]
+            logging.info(f'Successive halving rung {rung}: {len(survivors)} candidates on {len(X_rung)} train rows')
+            candidates = self.training_pipeline.train_candidates([model for model, _ in scaled], X_rung, Y_rung, X_test, Y_test, n_workers)
+
+            for candidate, (_, rounds_share) in zip(candidates, scaled):
+                worker_stages.extend(candidate.pop('stages', []))
+                history[candidate['name']].append({'rung': rung,
+                                                   'budget': budget,
+                                                   'train_rows': len(X_rung),
+                                                   'rounds_share': rounds_share,
+                                                   'seconds': candidate.get('train_seconds'),
+                                                   'test_score': candidate.get('test_score'),
+                                                   'error': candidate.get('error')})
+
+            rung_seconds = time.perf_counter() - rung_start
+            rungs.append({'rung': rung, 'budget': budget, 'train_rows': len(X_rung), 'candidates': len(candidates), 'seconds': rung_seconds})
+            if is_last:
+                break
+
+            ranked = self.rank(candidates)
+            n_survivors = max(1, math.ceil(len(ranked) / eta))
+
+            # Skipping to the full budget with the best candidate alone, when the next rung would not fit in the time budget
+            if time_budget is not None:
+                next_seconds = rung_seconds * (n_survivors / len(ranked)) * (budgets[rung + 1] / budget)
+                if time.perf_counter() - start_time + next_seconds > time_budget:
+                    logging.info(f'Time budget of {time_budget} seconds reached, training {ranked[0]["name"]} on all rows')
+                    n_survivors = 1
+                    budgets = budgets[:rung + 1] + [1.0]
+
+            survivor_names = {candidate['name'] for candidate in ranked[:n_survivors] if 'error' not in candidate} or {ranked[0]['name']}
+            survivors = [model for model in survivors if model['name'] in survivor_names]
+            rung += 1
+
+        seconds = time.perf_counter() - start_time
+        candidate_seconds = sum(entry['seconds'] or 0.0 for entries in history.values() for entry in entries)
+        exhaustive_seconds = 0.0
+        for entries in history.values():
+            last = entries[-1]
+            if last['seconds'] is not None:
+                exhaustive_seconds += last['seconds'] / last['budget']
+
+        report = {'strategy': 'successive_halving',
+                  'eta': eta,
+                  'time_budget_seconds': time_budget,
+                  'rungs': rungs,
+                  'candidates': history,
+                  'finalists': [candidate['name'] for candidate in candidates],
+                  'seconds': seconds,
+                  'candidate_seconds': candidate_seconds,
+                  'estimated_exhaustive_candidate_seconds': exhaustive_seconds,
+                  'estimated_seconds_saved': exhaustive_seconds - candidate_seconds,
+                  'worker_stages': worker_stages}
+
+        logging.info(f'Successive halving trained {len(candidates)} of {len(models_data)} candidates on all rows in {seconds:.2f} seconds, '
+                     f'{report["estimated_seconds_saved"]:.2f} candidate seconds less than exhaustive training (estimated)')
+        return (candidates, report)
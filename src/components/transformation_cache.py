@@ -0,0 +1,142 @@
+import os
+import time
+import shutil
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator
+
+from src.logger import logging
+from src.utils import save_object, load_object, save_json
+
+@dataclass
+class TransformationCacheConfig:
+    '''
+    A data class for storing paths and settings related to the transformation cache
+    '''
+    cache_dir = os.path.join("artifacts", "transformation_cache")
+    max_size_mb = 2048 # Least recently used entries are evicted once the cache grows beyond this size
+
+def stable_fingerprint(obj):
+    '''
+    Return a string describing obj which is stable across processes and runs.
+    Estimators are described by their class and parameters, functions by their module and name and arrays by a hash of their bytes.
+    '''
+    if isinstance(obj, BaseEstimator):
+        params = obj.get_params(deep = False)
+        described_params = ', '.join(f'{name}={stable_fingerprint(params[name])}' for name in sorted(params))
+        return f'{type(obj).__module__}.{type(obj).__qualname__}({described_params})'
+    if callable(obj) and hasattr(obj, '__qualname__'):
+        return f'{obj.__module__}.{obj.__qualname__}'
+    if isinstance(obj, dict):
+        return '{' + ', '.join(f'{stable_fingerprint(key)}: {stable_fingerprint(obj[key])}' for key in sorted(obj, key = repr)) + '}'
+    if isinstance(obj, (list, tuple)):
+        return f'{type(obj).__name__}(' + ', '.join(stable_fingerprint(item) for item in obj) + ')'
+    if isinstance(obj, np.ndarray):
+        return f'ndarray({obj.dtype}, {obj.shape}, {hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()})'
+    return repr(obj)
+
+def dataset_fingerprint(X, Y):
+    '''
+    Return the sha256 of the values, index, columns and dtypes of X and Y
+    '''
+    digest = hashlib.sha256()
+    for data in (X, Y):
+        digest.update(repr(getattr(data, 'columns', getattr(data, 'name', None))).encode())
+        digest.update(repr(getattr(data, 'dtypes', getattr(data, 'dtype', None))).encode())
+        digest.update(pd.util.hash_pandas_object(data, index = True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def is_deterministic(*estimators):
+    '''
+    Return whether none of the estimators, including nested ones, leaves random_state unset
+    '''
+    for estimator in estimators:
+        params = estimator.get_params(deep = True)
+        if any(name.split('__')[-1] == 'random_state' and value is None for name, value in params.items()):
+            return False
+    return True
+
+class TransformationCache:
+    '''
+    A class for caching fitted pre-processors along with the pre-processed and resampled train data on disk.
+    Entries are keyed by the fingerprints of the pre-processor and resampler configurations and of the train data,
+    and evicted least recently used first once the cache is larger than its size limit.
+    '''
+    def __init__(self, cache_dir = None, max_size_mb = None):
+        self.transformation_cache_config = TransformationCacheConfig()
+        self.cache_dir = cache_dir or self.transformation_cache_config.cache_dir
+        self.max_size_mb = self.transformation_cache_config.max_size_mb if max_size_mb is None else max_size_mb
+
+    def key(self, pre_processor, resampler, data_fingerprint):
+        '''
+        Return the cache key of an unfitted pre-processor and resampler applied to the data with given fingerprint
+        '''
+        description = '|'.join((stable_fingerprint(pre_processor), stable_fingerprint(resampler), data_fingerprint))
+        return hashlib.sha256(description.encode()).hexdigest()[:24]
+
+    def get(self, key):
+        '''
+        Return the cached (fitted pre-processor, X_train_transformed, Y_train_transformed) for key, or None on a cache miss
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+
+        pre_processor = load_object(os.path.join(entry_dir, 'preprocessor.pkl'))
+        X_train_transformed = np.load(os.path.join(entry_dir, 'X.npy'), mmap_mode = 'r')
+        Y_train_transformed = np.load(os.path.join(entry_dir, 'Y.npy'), mmap_mode = 'r')
+
+        # Mark the entry as recently used
+        os.utime(meta_path)
+
+        logging.info(f'Loaded pre-processed and resampled train data from transformation cache entry {key}')
+        return (pre_processor, X_train_transformed, Y_train_transformed)
+
+    def put(self, key, pre_processor, X_train_transformed, Y_train_transformed):
+        '''
+        Store a fitted pre-processor and the pre-processed and resampled train data under key, then evict old entries if required
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        temp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+        shutil.rmtree(temp_dir, ignore_errors = True)
+        os.makedirs(temp_dir)
+
+        save_object(os.path.join(temp_dir, 'preprocessor.pkl'), pre_processor)
+        np.save(os.path.join(temp_dir, 'X.npy'), np.asarray(X_train_transformed))
+        np.save(os.path.join(temp_dir, 'Y.npy'), np.asarray(Y_train_transformed))
+        save_json(os.path.join(temp_dir, 'meta.json'), {'created_at': time.time()})
+
+        # Publishing the entry in one rename, so that a reader never sees a partial entry
+        shutil.rmtree(entry_dir, ignore_errors = True)
+        os.replace(temp_dir, entry_dir)
+        logging.info(f'Stored pre-processed and resampled train data in transformation cache entry {key}')
+
+        self.evict(keep = key)
+
+    def evict(self, keep = None):
+        '''
+        Remove least recently used entries, except keep, until the cache fits within its size limit
+        '''
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, key, 'meta.json')
+            if key == keep or not os.path.exists(meta_path):
+                continue
+            entry_dir = os.path.join(self.cache_dir, key)
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+            entries.append((os.stat(meta_path).st_mtime, size, key))
+
+        total_size = sum(size for _, size, _ in entries)
+        if keep is not None and os.path.isdir(os.path.join(self.cache_dir, keep)):
+            total_size += sum(entry.stat().st_size for entry in os.scandir(os.path.join(self.cache_dir, keep)) if entry.is_file())
+
+        for _, size, key in sorted(entries):
+            if total_size <= self.max_size_mb * 2**20:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors = True)
+            total_size -= size
+            logging.info(f'Evicted transformation cache entry {key}')
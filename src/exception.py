@@ -8,3 +8,7 @@ class CustomError(Exception):
     
     def __str__(self):
         return f"{self.type_of_error.__name__}: {self.exception_object}"
+
+
+class TrainingCancelled(Exception):
+    '''Exception raised at a stage boundary of the training pipeline when its training job has been cancelled'''
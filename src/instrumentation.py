@@ -0,0 +1,354 @@
+import os
+import sys
+import time
+import bisect
+import inspect
+import functools
+import threading
+import tracemalloc
+import contextlib
+from dataclasses import dataclass
+
+from src.logger import logging
+
+try:
+    import resource
+except ImportError: # Not available on Windows, peak resident memory is then not reported
+    resource = None
+
+@dataclass
+class InstrumentationConfig:
+    '''
+    A data class for storing settings related to instrumentation of pipeline stages
+    '''
+    enabled = os.environ.get('INSTRUMENTATION', '1') == '1'
+    trace_memory = os.environ.get('INSTRUMENTATION_TRACE_MEMORY', '0') == '1' # Peak Python and NumPy allocations per stage, slows allocations down
+    duration_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(label_names, label_values, extra = ()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    '''
+    Base class of metrics keeping one value per combination of label values
+    '''
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, label_names = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'Metric {self.name} expects labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        '''
+        Return the metric in the Prometheus text exposition format
+        '''
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.extend(self._render_value(label_values, value))
+        return '\n'.join(lines)
+
+    def _render_value(self, label_values, value):
+        return [f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}']
+
+class Counter(Metric):
+    '''
+    A metric which only goes up, such as a number of requests
+    '''
+    metric_type = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    '''
+    A metric holding the last value set, such as the peak memory of the latest run of a stage
+    '''
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+class Histogram(Metric):
+    '''
+    A metric counting observations, such as latencies, in cumulative buckets along with their sum
+    '''
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names = (), buckets = None):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets or InstrumentationConfig.duration_buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self, **labels):
+        '''
+        Return a dictionary with the cumulative count per bucket upper bound, the count and the sum of observations
+        '''
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ([0] * (len(self.buckets) + 1), 0.0))
+            counts = list(counts)
+        cumulative = [sum(counts[:i + 1]) for i in range(len(counts))]
+        return {'buckets': dict(zip(list(self.buckets) + [float('inf')], cumulative)), 'count': cumulative[-1], 'sum': total}
+
+    def _render_value(self, label_values, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for upper_bound, count in zip(list(self.buckets) + [float('inf')], counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, label_values, [('le', _format_value(float(upper_bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(self.label_names, label_values)} {_format_value(total)}')
+        lines.append(f'{self.name}_count{_format_labels(self.label_names, label_values)} {cumulative}')
+        return lines
+
+class MetricsRegistry:
+    '''
+    A class holding the metrics of the process, which are created once by name and rendered together
+    '''
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, documentation, label_names, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, documentation, label_names, **kwargs)
+            metric = self._metrics[name]
+        if not isinstance(metric, metric_class):
+            raise ValueError(f'Metric {name} is already registered as a {metric.metric_type}')
+        return metric
+
+    def counter(self, name, documentation, label_names = ()):
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names = ()):
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names = (), buckets = None):
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets = buckets)
+
+    def render(self):
+        '''
+        Return every metric in the Prometheus text exposition format
+        '''
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+metrics_registry = MetricsRegistry()
+
+stage_duration = metrics_registry.histogram('stage_duration_seconds', 'Wall clock time of pipeline stages.', ('stage',))
+stage_cpu = metrics_registry.counter('stage_cpu_seconds_total', 'CPU time of the process spent in pipeline stages.', ('stage',))
+stage_rows_in = metrics_registry.counter('stage_rows_in_total', 'Rows passed into pipeline stages.', ('stage',))
+stage_rows_out = metrics_registry.counter('stage_rows_out_total', 'Rows returned by pipeline stages.', ('stage',))
+stage_errors = metrics_registry.counter('stage_errors_total', 'Pipeline stages which raised an error.', ('stage',))
+stage_peak_memory = metrics_registry.gauge('stage_peak_memory_bytes', 'Peak traced memory of the latest run of pipeline stages, or the growth of the peak resident memory of the process during it without memory tracing.', ('stage',))
+
+@dataclass
+class StageRecord:
+    '''
+    A data class holding the measurements of one run of a stage
+    '''
+    stage: str
+    wall_seconds: float = None
+    cpu_seconds: float = None
+    rows_in: int = None
+    rows_out: int = None
+    peak_memory_bytes: int = None # Peak traced allocations when memory tracing is on, else how much the stage raised the peak resident memory of the process
+    error: str = None
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+_local = threading.local()
+
+def _active_stages():
+    if not hasattr(_local, 'stages'):
+        _local.stages = []
+    return _local.stages
+
+def _peak_resident_memory():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+@contextlib.contextmanager
+def stage(name, rows_in = None):
+    '''
+    Context manager measuring wall time, CPU time and peak memory of a stage, yielding its StageRecord on which rows_out can be set.
+    Without memory tracing, peak memory is the growth of the peak resident memory of the process during the stage, which is 0
+    for a stage staying below a peak reached earlier, since the operating system only reports the high-water mark of the process.
+    The measurements are added to the stage metrics and appended to the records of any enclosing collect_stages call.
+    They are logged at info level only within collect_stages, e.g. for a training run; per-request stages log at debug level.
+    CPU time is that of the whole process, so it includes other threads working at the same time.
+    '''
+    record = StageRecord(name, rows_in = rows_in)
+    if not InstrumentationConfig.enabled:
+        yield record
+        return
+
+    trace_memory = InstrumentationConfig.trace_memory
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # Handing the peak reached so far to the enclosing stages, then measuring this stage from its current usage
+        for outer in _active_stages():
+            outer._peak_memory = max(outer._peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        record._peak_memory = 0
+    else:
+        start_peak_resident_memory = _peak_resident_memory()
+
+    _active_stages().append(record)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = type(e).__name__
+        stage_errors.inc(stage = name)
+        raise
+    finally:
+        record.wall_seconds = time.perf_counter() - start_wall
+        record.cpu_seconds = time.process_time() - start_cpu
+        _active_stages().pop()
+
+        if trace_memory:
+            record.peak_memory_bytes = max(record.__dict__.pop('_peak_memory'), tracemalloc.get_traced_memory()[1])
+            for outer in _active_stages():
+                outer._peak_memory = max(outer._peak_memory, record.peak_memory_bytes)
+            tracemalloc.reset_peak()
+        else:
+            end_peak_resident_memory = _peak_resident_memory()
+            if end_peak_resident_memory is not None:
+                record.peak_memory_bytes = end_peak_resident_memory - start_peak_resident_memory
+
+        stage_duration.observe(record.wall_seconds, stage = name)
+        stage_cpu.inc(record.cpu_seconds, stage = name)
+        if record.rows_in is not None:
+            stage_rows_in.inc(record.rows_in, stage = name)
+        if record.rows_out is not None:
+            stage_rows_out.inc(record.rows_out, stage = name)
+        if record.peak_memory_bytes is not None:
+            stage_peak_memory.set(record.peak_memory_bytes, stage = name)
+
+        collectors = getattr(_local, 'collectors', [])
+        for collected in collectors:
+            collected.append(record)
+
+        log_level = logging.INFO if collectors else logging.DEBUG
+        if logging.getLogger().isEnabledFor(log_level):
+            logging.log(log_level, f'Stage {name}: {record.wall_seconds:.4f}s wall, {record.cpu_seconds:.4f}s CPU, '
+                                   f'rows in {record.rows_in}, rows out {record.rows_out}, peak memory {record.peak_memory_bytes} bytes')
+
+def instrument_stage(name, rows_in = None, rows_out = None):
+    '''
+    Decorator running a function as a stage. rows_in names the argument whose length is the number of rows going in,
+    rows_out is called with the result of the function to count the rows going out; either may be None.
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            n_rows_in = len(signature.bind(*args, **kwargs).arguments[rows_in]) if rows_in is not None else None
+            with stage(name, n_rows_in) as record:
+                result = func(*args, **kwargs)
+                if rows_out is not None:
+                    record.rows_out = rows_out(result)
+                return result
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def collect_stages():
+    '''
+    Context manager yielding a list which receives the StageRecord of every stage finished in this thread meanwhile
+    '''
+    collected = []
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    _local.collectors.append(collected)
+    try:
+        yield collected
+    finally:
+        _local.collectors.remove(collected)
+
+@contextlib.contextmanager
+def profiled(output_path, profiler = 'cprofile'):
+    '''
+    Context manager profiling the code it wraps and saving the profile in output_path.
+    With 'cprofile' the pstats file is saved along with a text summary of the 40 most expensive functions in output_path.txt;
+    with 'pyinstrument', a sampling profiler which has to be installed separately, an html report is saved.
+    Only the calling process is profiled, not worker processes it starts.
+    '''
+    dir_path = os.path.dirname(output_path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok = True)
+
+    if profiler == 'cprofile':
+        import cProfile
+        import pstats
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(output_path)
+            with open(f'{output_path}.txt', 'w') as file_obj:
+                pstats.Stats(profile, stream = file_obj).sort_stats('cumulative').print_stats(40)
+            logging.info(f'Saved cProfile profile to {output_path}')
+    elif profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise ImportError('The pyinstrument profiler requires the pyinstrument package, install it with pip install pyinstrument') from e
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(output_path, 'w') as file_obj:
+                file_obj.write(profile.output_html())
+            logging.info(f'Saved pyinstrument profile to {output_path}')
+    else:
+        raise ValueError(f"Unknown profiler {profiler}, expected 'cprofile' or 'pyinstrument'")
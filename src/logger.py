@@ -4,7 +4,8 @@ import os
 import json
 
 # make log directory, if it does not exist
-os.makedirs('logs', exist_ok = True)
+log_dir = os.environ.get('LOG_DIR', 'logs')
+os.makedirs(log_dir, exist_ok = True)
 
 cwd = os.getcwd()
 config_file_path = os.path.join(cwd, 'src/logging_config.json')
@@ -13,6 +14,9 @@ config_file_path = os.path.join(cwd, 'src/logging_config.json')
 with open(config_file_path, 'r') as config_file:
     config_dict = json.load(config_file)
 
+# Writing the log file into the log directory
+config_dict['handlers']['rotating_file']['filename'] = os.path.join(log_dir, 'app.log')
+
 # Setting up the config
 logging.config.dictConfig(config_dict)
 
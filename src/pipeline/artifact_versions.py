@@ -0,0 +1,46 @@
+import sys
+import time
+import argparse
+
+from src.components.artifact_store import ArtifactStore
+from src.exception import CustomError
+from src.logger import logging
+
+def list_versions(artifact_store):
+    '''
+    Return a summary of every stored version, newest first
+    '''
+    current_version = artifact_store.current_version()
+    return [{'version': manifest['version'],
+             'current': manifest['version'] == current_version,
+             'created_at': manifest['created_at'],
+             'model': manifest['metadata'].get('name'),
+             'test_score': manifest['metadata'].get('test_score'),
+             'files': len(manifest['files']),
+             'bytes': sum(entry['size'] for entry in manifest['files'].values())} for manifest in artifact_store.list_versions()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'List, roll back and evict versions of the artifact store')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    subparsers.add_parser('list', help = 'list stored versions, newest first')
+    rollback_parser = subparsers.add_parser('rollback', help = 'publish an earlier version again')
+    rollback_parser.add_argument('version', nargs = '?', default = None, help = 'version to publish, by default the one before the current')
+    gc_parser = subparsers.add_parser('gc', help = 'evict old versions and the blobs only they refer to')
+    gc_parser.add_argument('--keep', type = int, default = None, help = 'versions kept besides the current one')
+    gc_parser.add_argument('--max-size-mb', type = float, default = None, help = 'evict older versions while the blobs take more space')
+    args = parser.parse_args()
+
+    artifact_store = ArtifactStore()
+    try:
+        if args.command == 'list':
+            for version in list_versions(artifact_store):
+                print(f"{'*' if version['current'] else ' '} {version['version']}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(version['created_at']))}  "
+                      f"{version['model']}  test score {version['test_score']}  {version['files']} files, {version['bytes'] / 2**20:.1f} MiB")
+        elif args.command == 'rollback':
+            print(f"Published version {artifact_store.rollback(args.version)['version']}")
+        else:
+            print(artifact_store.gc(args.keep, args.max_size_mb))
+    except:
+        error_obj = CustomError(*sys.exc_info())
+        logging.error(error_obj, exc_info = True)
+        raise error_obj
@@ -0,0 +1,254 @@
+import sys
+import copy
+import time
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from sklearn.preprocessing import StandardScaler
+from sklearn.linear_model import LogisticRegression
+from xgboost import XGBClassifier
+
+from src.pipeline.training_pipeline import TrainingPipeline, TrainingPipelineConfig, wait_for_artifacts
+from src.components.data_ingestion import RowHashSet
+from src.components.data_transformation import DataPreProcessor
+from src.components.data_resampler import DataResampler
+from src.components.model_evaluator import ModelEvaluator
+from src.components.dataset_cache import DatasetCache
+from src.components.artifact_store import wait_for_writes
+from src.utils import load_object, load_json
+
+from src.instrumentation import instrument_stage
+from src.exception import CustomError
+from src.logger import logging
+
+@dataclass
+class IncrementalTrainingConfig:
+    '''
+    A data class for storing settings related to incremental training
+    '''
+    target_class = 'Class'
+    test_size = 0.33 # Share of the new rows of each class added to the test set, as in full training
+    random_state = 42
+    xgboost_extra_rounds = None # Boosting rounds added to an XGBoost model, None adds half of its current rounds (at least one)
+    max_score_drop = 0.0 # The updated model is promoted unless its test score is more than this below the current model's on the same test set
+
+class IncrementalTrainingPipeline:
+    '''
+    A class for updating the saved model with new labeled data instead of rerunning the whole training pipeline.
+    New rows are de-duplicated against the stored train and test sets and split between them. Logistic regression is
+    warm-started from its current coefficients and XGBoost is boosted for more rounds, other models are refitted in their
+    current configuration; the scaler statistics are updated incrementally unless the model keeps trees split on the old scale.
+    The updated model is compared with the current one on the extended test set before it is promoted.
+    '''
+    def __init__(self, stage_callback = None):
+        self.incremental_training_config = IncrementalTrainingConfig()
+        self.training_pipeline_config = TrainingPipelineConfig()
+        self.stage_callback = stage_callback
+
+    def report_progress(self, stage, status):
+        if self.stage_callback is not None:
+            self.stage_callback(stage, status)
+
+    def load_current(self):
+        '''
+        Return the saved model, pre-processor, version information and the train and test sets it was trained on,
+        as a tuple of format (model, preprocessor, model_version, (X_train, X_test, Y_train, Y_test))
+        '''
+        # Artifacts of a training of this process may still be being written
+        wait_for_writes()
+
+        data_arr = DatasetCache().load_entry(self.training_pipeline_config.training_data_dir)
+        if data_arr is None:
+            raise FileNotFoundError(f'No training data in {self.training_pipeline_config.training_data_dir}, run a full training first.')
+
+        model = load_object(self.training_pipeline_config.model_obj_file_path)
+        preprocessor = load_object(self.training_pipeline_config.preprocessor_obj_file_path)
+        model_version = load_json(self.training_pipeline_config.model_version_file_path)
+
+        return (model, preprocessor, model_version, data_arr)
+
+    @instrument_stage('incremental_training.ingest_new_data', rows_out = lambda data_arr: len(data_arr[0]) + len(data_arr[1]))
+    def ingest_new_data(self, path, X_train, X_test, Y_train, Y_test):
+        '''
+        Load the new labeled rows of the csv file at path in the dtypes of the stored data, drop rows already stored or repeated,
+        and split each class between train and test at the test size of the config.
+        Returns a tuple of format (X_train_new, X_test_new, Y_train_new, Y_test_new).
+        '''
+        target_class = self.incremental_training_config.target_class
+        df = pd.read_csv(path, dtype = {**X_train.dtypes.to_dict(), target_class: Y_train.dtype})
+        df = df[X_train.columns.tolist() + [target_class]]
+
+        # Dropping duplicates within the new rows and of stored rows, as ingestion does
+        row_hashes = RowHashSet()
+        for X, Y in ((X_train, Y_train), (X_test, Y_test)):
+            row_hashes.add_new(pd.util.hash_pandas_object(pd.concat((X, Y), axis = 1), index = False).to_numpy())
+        df = df[row_hashes.add_new(pd.util.hash_pandas_object(df, index = False).to_numpy())]
+
+        # New rows are numbered after the stored ones
+        first_index = max(X_train.index.max(), X_test.index.max()) + 1
+        df.index = pd.RangeIndex(start = first_index, stop = first_index + len(df))
+
+        rng = np.random.default_rng(self.incremental_training_config.random_state)
+        is_test = np.zeros(len(df), dtype = bool)
+        labels = df[target_class].to_numpy()
+        for label in np.unique(labels):
+            positions = np.flatnonzero(labels == label)
+            is_test[rng.choice(positions, size = int(round(self.incremental_training_config.test_size * len(positions))), replace = False)] = True
+
+        X, Y = df.drop(target_class, axis = 1), df[target_class]
+        return (X[~is_test], X[is_test], Y[~is_test], Y[is_test])
+
+    def update_strategy(self, model):
+        '''
+        Return how model is updated: 'warm_start' for logistic regression, 'boosting' for XGBoost and 'refit' otherwise
+        '''
+        if isinstance(model, LogisticRegression) and model.solver != 'liblinear':
+            return 'warm_start'
+        if isinstance(model, XGBClassifier):
+            return 'boosting'
+        return 'refit'
+
+    def update_preprocessor(self, preprocessor, X_new):
+        '''
+        Update the mean and variance of every StandardScaler step of the fitted pre-processor with the new rows X_new,
+        leaving the other steps as fitted. Returns the pre-processor.
+        '''
+        steps = [step for _, step in preprocessor.steps] if hasattr(preprocessor, 'steps') else [preprocessor]
+        Z = X_new
+        for step in steps:
+            if step is None or step == 'passthrough':
+                continue
+            if isinstance(step, StandardScaler):
+                step.partial_fit(Z)
+            Z = step.transform(Z)
+
+        return preprocessor
+
+    @instrument_stage('incremental_training.update_model', rows_in = 'X')
+    def update_model(self, model, strategy, X, Y):
+        '''
+        Continue training model on the transformed and resampled train set X, Y with given strategy
+        '''
+        if strategy == 'warm_start':
+            model.set_params(warm_start = True)
+            model.fit(X, Y)
+            model.set_params(warm_start = False)
+        elif strategy == 'boosting':
+            n_rounds = model.get_booster().num_boosted_rounds()
+            extra_rounds = self.incremental_training_config.xgboost_extra_rounds or max(1, n_rounds // 2)
+            model.set_params(n_estimators = extra_rounds)
+            model.fit(X, Y, xgb_model = model.get_booster())
+            model.set_params(n_estimators = n_rounds + extra_rounds)
+        else:
+            model.fit(X, Y)
+
+        return model
+
+    def resampler_for(self, name):
+        '''
+        Return an unfitted copy of the resampler the model of given name was trained with in models_data
+        '''
+        training_pipeline = TrainingPipeline()
+        for model in load_object(self.training_pipeline_config.models_data_path):
+            if model['name'] == name:
+                return training_pipeline.scalable_resampler(training_pipeline.prepare_candidate(model)['resampler'])
+        raise ValueError(f'Model {name} is not in models data, its resampler is unknown.')
+
+    @instrument_stage('incremental_training.run_pipeline')
+    def run_pipeline(self, new_data_path, score_threshold = None, max_score_drop = None):
+        '''
+        Update the saved model with the labeled rows of the csv file at new_data_path and promote it if its test score,
+        on the test set extended with part of the new rows, is at least that of the current model less max_score_drop
+        and, if given, at least score_threshold. Returns a summary dictionary, with saved 'pending' while the artifacts of a
+        promoted model are written in the background.
+        '''
+        max_score_drop = self.incremental_training_config.max_score_drop if max_score_drop is None else max_score_drop
+
+        logging.info(f'Started incremental training with {new_data_path}...')
+        start_time = time.perf_counter()
+        try:
+            self.report_progress('ingest_new_data', 'started')
+            model, preprocessor, model_version, (X_train, X_test, Y_train, Y_test) = self.load_current()
+            X_train_new, X_test_new, Y_train_new, Y_test_new = self.ingest_new_data(new_data_path, X_train, X_test, Y_train, Y_test)
+            self.report_progress('ingest_new_data', 'finished')
+
+            summary = {'base_version': model_version.get('version'),
+                       'best_model': model_version.get('name'),
+                       'train_rows_added': len(X_train_new),
+                       'test_rows_added': len(X_test_new),
+                       'saved': False}
+            if len(X_train_new) == 0:
+                logging.info('No new rows to train on, the current model is kept.')
+                summary['seconds'] = time.perf_counter() - start_time
+                return summary
+
+            X_train, Y_train = pd.concat((X_train, X_train_new)), pd.concat((Y_train, Y_train_new))
+            X_test, Y_test = pd.concat((X_test, X_test_new)), pd.concat((Y_test, Y_test_new))
+
+            # Scoring the current model on the extended test set, it is updated on a copy
+            model_evaluator = ModelEvaluator()
+            current_report = model_evaluator.evaluate_report(preprocessor, model, X_test, Y_test, 'test')
+
+            self.report_progress('update_model', 'started')
+            strategy = self.update_strategy(model)
+            model, preprocessor = copy.deepcopy(model), copy.deepcopy(preprocessor)
+
+            # Trees of a boosted model split on the scale they were grown on, so the scaler is only updated for refitted coefficients
+            if strategy != 'boosting':
+                self.update_preprocessor(preprocessor, X_train_new)
+
+            X_train_transformed = DataPreProcessor().transform(preprocessor, X_train)
+            X_train_resampled, Y_train_resampled = DataResampler().fit_resample(self.resampler_for(model_version['name']), X_train_transformed, Y_train)
+            self.update_model(model, strategy, X_train_resampled, Y_train_resampled)
+            self.report_progress('update_model', 'finished')
+
+            train_report = model_evaluator.evaluate_report(preprocessor, model, X_train, Y_train, 'train')
+            test_report = model_evaluator.evaluate_report(preprocessor, model, X_test, Y_test, 'test')
+            summary.update({'strategy': strategy,
+                            'current_test_score': current_report['pr_auc'],
+                            'train_score': train_report['pr_auc'],
+                            'test_score': test_report['pr_auc'],
+                            'test_report': test_report})
+
+            promote = test_report['pr_auc'] >= current_report['pr_auc'] - max_score_drop
+            if score_threshold is not None:
+                promote = promote and test_report['pr_auc'] >= score_threshold
+
+            if promote:
+                self.report_progress('save_artifacts', 'started')
+                summary['version'], write = TrainingPipeline().save_data(X_train, Y_train, X_test, Y_test, new_data_path, preprocessor, model,
+                                             {'name': model_version['name'],
+                                              'train_score': train_report['pr_auc'],
+                                              'test_score': test_report['pr_auc'],
+                                              'test_report': test_report,
+                                              'incremental': {'base_version': summary['base_version'],
+                                                              'strategy': strategy,
+                                                              'train_rows_added': len(X_train_new),
+                                                              'test_rows_added': len(X_test_new)}})
+                self.report_progress('save_artifacts', 'finished')
+                summary['saved'] = True if write.done() and write.exception() is None else 'pending'
+                logging.info(f'Promoted incrementally trained model with test score {test_report["pr_auc"]} over {current_report["pr_auc"]}')
+            else:
+                logging.info(f'Incrementally trained model was not promoted, test score {test_report["pr_auc"]} against {current_report["pr_auc"]}')
+
+            summary['seconds'] = time.perf_counter() - start_time
+        except:
+            error_obj = CustomError(*sys.exc_info())
+            logging.error(error_obj, exc_info = True)
+            raise error_obj
+        else:
+            logging.info('Successfully completed incremental training!!!')
+            return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Update the saved model with new labeled transactions')
+    parser.add_argument('new_data_path', help = 'csv file of new labeled transactions')
+    parser.add_argument('--score-threshold', type = float, default = None, help = 'minimum test score of the updated model to be promoted')
+    parser.add_argument('--max-score-drop', type = float, default = None, help = 'largest drop of test score against the current model still promoted')
+    args = parser.parse_args()
+
+    summary = wait_for_artifacts(IncrementalTrainingPipeline().run_pipeline(args.new_data_path, args.score_threshold, args.max_score_drop))
+    print({key: value for key, value in summary.items() if key != 'test_report'})
@@ -1,10 +1,15 @@
 import os
 import sys
+import numpy as np
 import pandas as pd
 from dataclasses import dataclass
 
 from src.components.data_transformation import DataPreProcessor
-from src.utils import load_object
+from src.components.model_registry import get_model_registry
+from src.components.inference_kernel import compile_inference_kernel
+from src.components.kernel_artifact import get_kernel_artifact
+from src.utils import load_object, load_json
+from src.instrumentation import instrument_stage
 
 from src.logger import logging
 from src.exception import CustomError
@@ -16,34 +21,182 @@ class PredictionPipelineConfig:
     '''
     preprocessor_path = os.path.join('artifacts', 'preprocessor.pkl')
     model_file_path = os.path.join('artifacts', 'model.pkl' )
+    batch_chunk_size = 10000
+    use_model_registry = True # Keep the model and pre-processor in memory instead of loading them on every call
+    use_inference_kernel = False # Score with the compiled NumPy kernel of the model and pre-processor, if it can be compiled
+    use_kernel_artifact = False # Score with the memory-mapped kernel artifact saved by training, if there is one, without unpickling anything
+    kernel_artifact_dir = os.path.join('artifacts', 'inference_kernel')
+    model_version_path = os.path.join('artifacts', 'model_version.json')
+    compute_dtype = os.environ.get('COMPUTE_DTYPE') or None # Overrides the dtype features are cast to before pre-processing, by default the dtype the model was trained in
 
 class PredictPipeline:
     '''
     A class for running the prediction pipeline
     '''
-    def __init__(self):
+    def __init__(self, use_inference_kernel = None, use_kernel_artifact = None):
         self.prediction_pipeline_config = PredictionPipelineConfig()
+        if use_inference_kernel is not None:
+            self.prediction_pipeline_config.use_inference_kernel = use_inference_kernel
+        if use_kernel_artifact is not None:
+            self.prediction_pipeline_config.use_kernel_artifact = use_kernel_artifact
 
-    def transform(self, pre_processor, X):
+    def compute_dtype(self):
         '''
-        Take in the pre-processor, X, Y and pre-process X & Y to return the transformed version of X for prediction
+        Return the dtype features are cast to before pre-processing: COMPUTE_DTYPE if set, otherwise the dtype recorded
+        in the version of the current model, i.e. the dtype it was trained in, or None for versions without one.
+        Features are never cast to a dtype other than a float one, which would truncate them.
         '''
+        compute_dtype = self.prediction_pipeline_config.compute_dtype
+        if compute_dtype is None:
+            compute_dtype = self.model_metadata().get('compute_dtype')
+
+        if compute_dtype is None or not np.issubdtype(np.dtype(compute_dtype), np.floating):
+            return None
+        return compute_dtype
+
+    def model_metadata(self):
+        '''
+        Return the version information of the current model and pre-processor pair, or an empty dictionary if there is none
+        '''
+        if self.prediction_pipeline_config.use_model_registry:
+            metadata = get_model_registry(self.prediction_pipeline_config.model_file_path,
+                                          self.prediction_pipeline_config.preprocessor_path).get().metadata
+        elif os.path.exists(self.prediction_pipeline_config.model_version_path):
+            metadata = load_json(self.prediction_pipeline_config.model_version_path)
+        else:
+            metadata = {}
+        return metadata
+
+    def transform(self, pre_processor, X, compute_dtype = None):
+        '''
+        Take in the pre-processor, X, Y and pre-process X & Y to return the transformed version of X for prediction.
+        X is cast to compute_dtype first, by default to the dtype of compute_dtype().
+        '''
+        compute_dtype = compute_dtype or self.compute_dtype()
+        if compute_dtype is not None:
+            X = X.astype(compute_dtype)
+
         data_transformation = DataPreProcessor()
         X_transformed = data_transformation.transform(pre_processor, X)
         
         return X_transformed
 
+    def load_artifacts(self):
+        '''
+        Load and return the model and pre-processor as a tuple of format (model, preprocessor).
+        When the inference kernel is enabled and the pair can be compiled, the kernel is returned in place of the model
+        along with a pre-processor of None, since the kernel works on raw X. The same goes for the kernel artifact when it is enabled.
+        '''
+        if self.prediction_pipeline_config.use_kernel_artifact:
+            kernel = self.load_kernel_artifact()
+            if kernel is not None:
+                return (kernel, None)
+
+        if self.prediction_pipeline_config.use_inference_kernel:
+            kernel = self.load_inference_kernel()
+            if kernel is not None:
+                return (kernel, None)
+
+        if self.prediction_pipeline_config.use_model_registry:
+            model_version = get_model_registry(self.prediction_pipeline_config.model_file_path,
+                                               self.prediction_pipeline_config.preprocessor_path).get()
+            return (model_version.model, model_version.preprocessor)
+
+        logging.info('Loading model and pre-processor...')
+        model = load_object(self.prediction_pipeline_config.model_file_path)
+        preprocessor = load_object(self.prediction_pipeline_config.preprocessor_path)
+        logging.info('Successfully completed loading of model and pre-processor!!!')
+
+        return (model, preprocessor)
+
+    def load_kernel_artifact(self):
+        '''
+        Return the memory-mapped kernel artifact of the current model and pre-processor, or None if there is none or it cannot be loaded
+        '''
+        try:
+            return get_kernel_artifact(self.prediction_pipeline_config.kernel_artifact_dir)
+        except (OSError, ValueError):
+            logging.error('Could not load kernel artifact, using the pickled model and pre-processor.', exc_info = True)
+            return None
+
+    def load_inference_kernel(self):
+        '''
+        Return the compiled inference kernel of the current model and pre-processor, or None if they cannot be compiled
+        '''
+        if self.prediction_pipeline_config.use_model_registry:
+            _, kernel = get_model_registry(self.prediction_pipeline_config.model_file_path,
+                                           self.prediction_pipeline_config.preprocessor_path).get_inference_kernel()
+            return kernel
+
+        model = load_object(self.prediction_pipeline_config.model_file_path)
+        preprocessor = load_object(self.prediction_pipeline_config.preprocessor_path)
+        try:
+            return compile_inference_kernel(preprocessor, model)
+        except TypeError:
+            logging.info('Model and pre-processor cannot be compiled into an inference kernel.', exc_info = True)
+            return None
+
+    def model_version(self):
+        '''
+        Return the version of the current model and pre-processor pair, from the version file or derived from their sha256
+        '''
+        return get_model_registry(self.prediction_pipeline_config.model_file_path,
+                                  self.prediction_pipeline_config.preprocessor_path).get().version
+
+    def input_columns(self):
+        '''
+        Return the names of the features the current model takes, or None if its pre-processor does not record them
+        '''
+        model, preprocessor = self.load_artifacts()
+        if preprocessor is None:
+            # Inference kernels take raw X and keep the columns their pre-processor was fitted on
+            return getattr(model, 'input_columns', None)
+
+        columns = getattr(preprocessor, 'feature_names_in_', None)
+        return None if columns is None else [str(column) for column in columns]
+
+    def predict_proba(self, model, preprocessor, X, chunk_size = None):
+        '''
+        Take in the model, pre-processor and X and return the fraud probability of every row of X.
+        X is processed in blocks of chunk_size rows, so that one transform and one predict_proba call covers a whole block.
+        '''
+        if chunk_size is None:
+            chunk_size = self.prediction_pipeline_config.batch_chunk_size
+        if chunk_size <= 0:
+            raise ValueError(f'chunk_size must be a positive integer, got {chunk_size}')
+
+        fraud_prob = np.empty(len(X), dtype = np.float64)
+        compute_dtype = self.compute_dtype() if preprocessor is not None else None
+
+        for start in range(0, len(X), chunk_size):
+            X_chunk = X.iloc[start:start + chunk_size]
+
+            # Transforming the chunk by passing it to the pre-processor, an inference kernel takes raw X
+            X_transformed = X_chunk if preprocessor is None else self.transform(preprocessor, X_chunk, compute_dtype)
+
+            # Predicting the probabilities
+            fraud_prob[start:start + len(X_chunk)] = model.predict_proba(X_transformed)[:, 1]
+
+        return fraud_prob
+
+    @instrument_stage('prediction_pipeline.score', rows_in = 'X', rows_out = len)
+    def score(self, X):
+        '''
+        Load the model and pre-processor and return the fraud probability of every row of X, without logging per call.
+        Used by the request coalescer, which scores many small batches a second.
+        '''
+        model, preprocessor = self.load_artifacts()
+        return self.predict_proba(model, preprocessor, X)
+
+    @instrument_stage('prediction_pipeline.run_pipeline', rows_in = 'X', rows_out = lambda result: 1)
     def run_pipeline(self, X, fraud_prob_threshold = 0.5):
         logging.info('Initiating prediction pipeline...')
         try:
             # Loading model and pre-processor
-            logging.info('Loading model and pre-processor...')
-            model = load_object(self.prediction_pipeline_config.model_file_path)
-            preprocessor = load_object(self.prediction_pipeline_config.preprocessor_path)
-            logging.info('Successfully completed loading of model and pre-processor!!!')
+            model, preprocessor = self.load_artifacts()
 
-            # Transforming X by passing it to the pre-processor
-            X_transformed = self.transform(preprocessor, X)
+            # Transforming X by passing it to the pre-processor, an inference kernel takes raw X
+            X_transformed = X if preprocessor is None else self.transform(preprocessor, X)
 
             # Predicting the probabilities
             prediction = model.predict_proba(X_transformed)
@@ -58,4 +211,31 @@ class PredictPipeline:
             if prediction[0, 1] > fraud_prob_threshold:
                 return "Fraudulent transaction"
             else:
-                return "Genuine transaction"
\ No newline at end of file
+                return "Genuine transaction"
+
+    @instrument_stage('prediction_pipeline.run_pipeline_batch', rows_in = 'X', rows_out = len)
+    def run_pipeline_batch(self, X, fraud_prob_threshold = 0.5, chunk_size = None):
+        '''
+        Score every row of X in one go and return a data frame, aligned with the index of X, having the columns
+        fraud_probability, is_fraud and result.
+        '''
+        logging.info(f'Initiating batch prediction pipeline for {len(X)} rows...')
+        try:
+            # Loading model and pre-processor only once for the whole batch
+            model, preprocessor = self.load_artifacts()
+
+            fraud_prob = self.predict_proba(model, preprocessor, X, chunk_size)
+        except:
+            error_obj = CustomError(*sys.exc_info())
+            logging.error(error_obj, exc_info = True)
+            raise error_obj
+        else:
+            logging.info('Successfully completed batch prediction pipeline!!!')
+
+            # Based on given threshold determine whether each transaction is Fraudulent or Genuine
+            is_fraud = fraud_prob > fraud_prob_threshold
+
+            return pd.DataFrame({'fraud_probability': fraud_prob,
+                                 'is_fraud': is_fraud.astype(int),
+                                 'result': np.where(is_fraud, "Fraudulent transaction", "Genuine transaction")},
+                                index = X.index)
@@ -0,0 +1,232 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from src.pipeline.prediction_pipeline import PredictPipeline
+from src.utils import save_json, load_json
+from src.instrumentation import instrument_stage
+
+from src.logger import logging
+from src.exception import CustomError
+
+@dataclass
+class ScoringPipelineConfig:
+    '''
+    A data class for storing settings related to offline bulk scoring of csv files
+    '''
+    chunk_size = 100000 # Number of csv rows read and scored at a time
+    n_workers = 1 # Number of processes scoring chunks in parallel, 1 scores them in this process and -1 uses all cores
+    mp_start_method = "spawn"
+    max_chunks_in_flight_per_worker = 2 # Chunks read ahead per worker, bounds the memory used by the pipeline
+    target_class = 'Class' # Dropped from the input when present, it is not a predictor
+    progress_file_suffix = '.progress.json' # Sidecar of the output file recording the chunks already written
+
+class ScoringPipeline:
+    '''
+    A class for scoring large csv files of transactions in chunks with the current model and pre-processor.
+    Chunks are scored across a pool of worker processes, each loading the model once, and written to the output in input order.
+    A progress file next to the output records the completed chunks, so an interrupted run resumes after the last one.
+    '''
+    def __init__(self, use_inference_kernel = None, use_kernel_artifact = None):
+        self.scoring_pipeline_config = ScoringPipelineConfig()
+        self.use_inference_kernel = use_inference_kernel
+        self.use_kernel_artifact = use_kernel_artifact
+
+    def progress_path(self, output_path):
+        return output_path + self.scoring_pipeline_config.progress_file_suffix
+
+    def load_progress(self, input_path, output_path, run_settings):
+        '''
+        Return the progress of an earlier run with the same input and settings, model version included, whose output is still in place, or None
+        '''
+        progress_path = self.progress_path(output_path)
+        if not (os.path.exists(progress_path) and os.path.exists(output_path)):
+            return None
+
+        progress = load_json(progress_path)
+        stat_result = os.stat(input_path)
+        if (progress['input_path'] != os.path.abspath(input_path) or progress['input_size'] != stat_result.st_size
+                or progress['input_mtime_ns'] != stat_result.st_mtime_ns or progress['settings'] != run_settings
+                or os.path.getsize(output_path) < progress['output_bytes']):
+            logging.info(f'Ignoring progress file {progress_path}, it belongs to a different input, settings, model version or output')
+            return None
+
+        return progress
+
+    def save_progress(self, input_path, output_path, run_settings, chunks_done, rows_done, output_bytes):
+        stat_result = os.stat(input_path)
+        save_json(self.progress_path(output_path), {'input_path': os.path.abspath(input_path),
+                                                    'input_size': stat_result.st_size,
+                                                    'input_mtime_ns': stat_result.st_mtime_ns,
+                                                    'settings': run_settings,
+                                                    'chunks_done': chunks_done,
+                                                    'rows_done': rows_done,
+                                                    'output_bytes': output_bytes,
+                                                    'updated_at': time.time()})
+
+    def label_chunk(self, chunk, fraud_prob, fraud_prob_threshold, id_column = None):
+        '''
+        Return the output rows of a scored chunk: the id column if given, fraud_probability, is_fraud and result
+        '''
+        is_fraud = fraud_prob > fraud_prob_threshold
+        output = pd.DataFrame({'fraud_probability': fraud_prob,
+                               'is_fraud': is_fraud.astype(int),
+                               'result': np.where(is_fraud, "Fraudulent transaction", "Genuine transaction")})
+        if id_column is not None:
+            output.insert(0, id_column, chunk[id_column].to_numpy())
+        return output
+
+    @instrument_stage('scoring_pipeline.run_pipeline', rows_out = lambda summary: summary['rows_scored'])
+    def run_pipeline(self, input_path, output_path, fraud_prob_threshold = 0.5, chunk_size = None, n_workers = None, id_column = None, resume = True):
+        '''
+        Score every row of the csv file at input_path and write the results to the csv file at output_path, keeping the input order.
+        With resume, a run interrupted earlier continues after the last chunk it completed, if it scored with the same model version.
+        Returns a summary with the number of rows scored and the rows per second.
+        '''
+        chunk_size = chunk_size or self.scoring_pipeline_config.chunk_size
+        n_workers = self.scoring_pipeline_config.n_workers if n_workers is None else n_workers
+        if n_workers == -1:
+            n_workers = os.cpu_count() or 1
+        # Progress of a run with another model is stale, its rows would be scored by two models
+        run_settings = {'chunk_size': chunk_size, 'fraud_prob_threshold': fraud_prob_threshold, 'id_column': id_column,
+                        'model_version': PredictPipeline(self.use_inference_kernel, self.use_kernel_artifact).model_version()}
+
+        logging.info(f'Initiating scoring pipeline for {input_path}...')
+        try:
+            if not resume and os.path.exists(self.progress_path(output_path)):
+                os.remove(self.progress_path(output_path))
+            progress = self.load_progress(input_path, output_path, run_settings) if resume else None
+            chunks_done, rows_done, output_bytes = (progress['chunks_done'], progress['rows_done'], progress['output_bytes']) if progress else (0, 0, 0)
+            if progress:
+                logging.info(f'Resuming after chunk {chunks_done - 1} with {rows_done} rows already scored')
+
+            # Rows skipped on resume are only tokenized, not converted
+            chunks = pd.read_csv(input_path, chunksize = chunk_size, skiprows = range(1, rows_done + 1))
+
+            output_dir = os.path.dirname(output_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok = True)
+
+            start_time = time.perf_counter()
+            rows_scored = 0
+
+            with open(output_path, 'r+b' if progress else 'wb') as output_file:
+                # Dropping any rows written after the last recorded chunk
+                output_file.truncate(output_bytes)
+                output_file.seek(output_bytes)
+
+                for chunk, fraud_prob in self.score_chunks(chunks, n_workers, id_column):
+                    output = self.label_chunk(chunk, fraud_prob, fraud_prob_threshold, id_column)
+                    output_file.write(output.to_csv(index = False, header = output_bytes == 0).encode())
+                    output_file.flush()
+                    os.fsync(output_file.fileno())
+
+                    output_bytes = output_file.tell()
+                    chunks_done += 1
+                    rows_done += len(chunk)
+                    rows_scored += len(chunk)
+                    self.save_progress(input_path, output_path, run_settings, chunks_done, rows_done, output_bytes)
+
+                    elapsed = time.perf_counter() - start_time
+                    logging.info(f'Scored chunk {chunks_done - 1}, {rows_done} rows in total at {rows_scored / elapsed:.0f} rows/sec')
+
+            elapsed = time.perf_counter() - start_time
+            summary = {'rows': rows_done,
+                       'rows_scored': rows_scored,
+                       'chunks': chunks_done,
+                       'seconds': elapsed,
+                       'rows_per_second': rows_scored / elapsed if elapsed > 0 else 0.0,
+                       'resumed': progress is not None}
+        except:
+            error_obj = CustomError(*sys.exc_info())
+            logging.error(error_obj, exc_info = True)
+            raise error_obj
+        else:
+            logging.info(f'Successfully completed scoring pipeline of {rows_done} rows at {summary["rows_per_second"]:.0f} rows/sec!!!')
+            return summary
+
+    def score_chunks(self, chunks, n_workers, id_column = None):
+        '''
+        Yield (chunk, fraud_prob) for every chunk in input order, scoring up to max_chunks_in_flight_per_worker chunks per worker ahead
+        '''
+        drop_columns = [self.scoring_pipeline_config.target_class] + ([id_column] if id_column is not None else [])
+        # Resuming a finished run leaves an empty chunk to read
+        chunks = (chunk for chunk in chunks if len(chunk))
+
+        if n_workers <= 1:
+            prediction_pipeline = PredictPipeline(self.use_inference_kernel, self.use_kernel_artifact)
+            for chunk in chunks:
+                yield (chunk, prediction_pipeline.score(chunk.drop(columns = drop_columns, errors = 'ignore')))
+            return
+
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        mp_context = multiprocessing.get_context(self.scoring_pipeline_config.mp_start_method)
+        with ProcessPoolExecutor(max_workers = n_workers, mp_context = mp_context,
+                                 initializer = init_scoring_worker, initargs = (self.use_inference_kernel, self.use_kernel_artifact, n_threads)) as executor:
+            in_flight = deque()
+            for chunk in chunks:
+                in_flight.append((chunk, executor.submit(score_chunk_in_worker, chunk.drop(columns = drop_columns, errors = 'ignore'))))
+                if len(in_flight) >= n_workers * self.scoring_pipeline_config.max_chunks_in_flight_per_worker:
+                    chunk, future = in_flight.popleft()
+                    yield (chunk, future.result())
+            while in_flight:
+                chunk, future = in_flight.popleft()
+                yield (chunk, future.result())
+
+_worker_artifacts = None
+
+def init_scoring_worker(use_inference_kernel, use_kernel_artifact, n_threads):
+    '''
+    Load the model and pre-processor once per worker process and limit its native thread pools to n_threads
+    '''
+    global _worker_artifacts
+    threadpool_limits(limits = n_threads)
+    prediction_pipeline = PredictPipeline(use_inference_kernel, use_kernel_artifact)
+    _worker_artifacts = (prediction_pipeline, *prediction_pipeline.load_artifacts())
+
+def score_chunk_in_worker(X):
+    '''
+    Return the fraud probability of every row of X using the artifacts loaded by init_scoring_worker
+    '''
+    prediction_pipeline, model, preprocessor = _worker_artifacts
+    return prediction_pipeline.predict_proba(model, preprocessor, X)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Credit card fraud detection batch jobs')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+    score_parser = subparsers.add_parser('score', help = 'Score a csv file of transactions with the current model')
+    score_parser.add_argument('input_path', help = 'csv file of transactions')
+    score_parser.add_argument('output_path', help = 'csv file the fraud probabilities and labels are written to')
+    score_parser.add_argument('--threshold', type = float, default = 0.5, help = 'fraud probability above which a transaction is fraudulent')
+    score_parser.add_argument('--chunk-size', type = int, default = None, help = 'rows read and scored at a time')
+    score_parser.add_argument('--workers', type = int, default = None, help = 'scoring processes, -1 uses all cores')
+    score_parser.add_argument('--id-column', default = None, help = 'input column copied to the output to identify rows')
+    score_parser.add_argument('--inference-kernel', action = 'store_true', help = 'score with the compiled inference kernel when available')
+    score_parser.add_argument('--kernel-artifact', action = 'store_true', help = 'score with the memory-mapped kernel artifact when available')
+    score_parser.add_argument('--no-resume', action = 'store_true', help = 'start over instead of resuming an interrupted run')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'score':
+        scoring_pipeline = ScoringPipeline(args.inference_kernel or None, args.kernel_artifact or None)
+        summary = scoring_pipeline.run_pipeline(args.input_path, args.output_path,
+                                                fraud_prob_threshold = args.threshold,
+                                                chunk_size = args.chunk_size,
+                                                n_workers = args.workers,
+                                                id_column = args.id_column,
+                                                resume = not args.no_resume)
+        print(f"Scored {summary['rows']} rows ({summary['rows_scored']} in this run) in {summary['seconds']:.1f}s "
+              f"at {summary['rows_per_second']:.0f} rows/sec")
+
+if __name__ == "__main__":
+    main()
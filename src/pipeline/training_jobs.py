@@ -0,0 +1,367 @@
+import os
+import sys
+import time
+import uuid
+import contextlib
+import threading
+import multiprocessing
+from dataclasses import dataclass, field, fields
+
+from src.pipeline.training_pipeline import TrainingPipeline, wait_for_artifacts
+from src.pipeline.incremental_training import IncrementalTrainingPipeline
+from src.instrumentation import profiled
+from src.utils import FileLock, save_json, load_json
+
+from src.logger import logging
+from src.exception import CustomError, TrainingCancelled
+
+@dataclass
+class TrainingJobsConfig:
+    '''
+    A data class for storing paths and settings related to asynchronous training jobs
+    '''
+    job_lock_file_path = os.path.join("artifacts", ".training_job.lock") # Held by the running job, so only one job runs on the machine
+    job_store_file_path = os.path.join("artifacts", "training_jobs.json") # State of the jobs, shared by every web worker and job process
+    job_store_lock_file_path = os.path.join("artifacts", ".training_jobs.lock")
+    mp_start_method = "spawn"
+    cancel_grace_seconds = 10.0 # Time given to a cancelled job to stop at a stage boundary before its process is terminated
+    uninterruptible_stages = ('save_artifacts', 'publish_artifacts') # Stopping while the artifacts are written could leave an unversioned pair
+    poll_interval_seconds = 0.5 # Time between two checks of a running job for cancellation
+    max_finished_jobs = 50 # Number of finished jobs kept for status queries
+    profile_dir = os.path.join("artifacts", "profiles") # Profiles of jobs submitted with profiling switched on
+
+@dataclass
+class TrainingJob:
+    '''
+    A data class holding the state of one training job
+    '''
+    job_id: str
+    file_path: str
+    score_threshold: float
+    profile_path: str = None
+    mode: str = 'full' # full retrain of every candidate, or incremental update of the saved model
+    status: str = 'queued' # queued, running, succeeded, failed or cancelled
+    created_at: float = field(default_factory = time.time)
+    started_at: float = None
+    finished_at: float = None
+    current_stage: str = None
+    stages: list = field(default_factory = list)
+    result: dict = None
+    message: str = None
+    cancel_requested: bool = False
+    worker_pid: int = None # Web worker process running the job
+    pid: int = None # Process of the job itself
+
+    @classmethod
+    def from_dict(cls, job):
+        names = {job_field.name for job_field in fields(cls)}
+        return cls(**{key: value for key, value in job.items() if key in names})
+
+    def to_dict(self):
+        '''
+        Return the job as a json serializable dictionary
+        '''
+        job = {key: value for key, value in self.__dict__.items()}
+        job['stages'] = [dict(stage) for stage in self.stages]
+        job['elapsed_seconds'] = ((self.finished_at or time.time()) - self.started_at) if self.started_at else None
+        return job
+
+    def record_stage(self, stage, status, at):
+        '''
+        Record that a stage of the job has started or finished at given time
+        '''
+        if status == 'started':
+            self.current_stage = stage
+            self.stages.append({'stage': stage, 'status': 'running', 'started_at': at, 'seconds': None})
+            return
+
+        for stage_entry in reversed(self.stages):
+            if stage_entry['stage'] == stage:
+                stage_entry['status'] = 'finished'
+                stage_entry['seconds'] = at - stage_entry['started_at']
+                break
+
+    def finish(self, status, result = None, message = None):
+        self.status = status
+        self.result = result
+        self.message = message
+        self.finished_at = time.time()
+        self.current_stage = None
+
+def pid_alive(pid):
+    '''
+    Return whether a process of given id is running on this machine
+    '''
+    if pid is None or os.name == 'nt':
+        return pid is not None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class TrainingJobStore:
+    '''
+    A class for keeping the state of training jobs in a json file shared by every process on the machine, so that any web
+    worker can report on or cancel a job, and a job process records its own progress even if the worker which started it
+    has been replaced. Every read-modify-write of the file holds a FileLock.
+    '''
+    def __init__(self, file_path = None, lock_file_path = None, max_finished_jobs = None):
+        training_jobs_config = TrainingJobsConfig()
+        self.file_path = file_path or training_jobs_config.job_store_file_path
+        self.lock_file_path = lock_file_path or training_jobs_config.job_store_lock_file_path
+        self.max_finished_jobs = training_jobs_config.max_finished_jobs if max_finished_jobs is None else max_finished_jobs
+
+    def _load(self):
+        if not os.path.exists(self.file_path):
+            return {}
+        return {job_id: TrainingJob.from_dict(job) for job_id, job in load_json(self.file_path).items()}
+
+    def _save(self, jobs):
+        # Only the most recent finished jobs are kept
+        finished = sorted((job for job in jobs.values() if job.finished_at is not None), key = lambda job: job.created_at, reverse = True)
+        for job in finished[self.max_finished_jobs:]:
+            del jobs[job.job_id]
+
+        stored = {}
+        for job_id, job in jobs.items():
+            stored[job_id] = job.to_dict()
+            del stored[job_id]['elapsed_seconds']
+        save_json(self.file_path, stored)
+
+    def get(self, job_id):
+        '''
+        Return the job with given id or None
+        '''
+        with FileLock(self.lock_file_path):
+            return self._load().get(job_id)
+
+    def list_jobs(self):
+        '''
+        Return all stored jobs, most recent first
+        '''
+        with FileLock(self.lock_file_path):
+            jobs = self._load()
+        return sorted(jobs.values(), key = lambda job: job.created_at, reverse = True)
+
+    def add(self, job):
+        with FileLock(self.lock_file_path):
+            jobs = self._load()
+            jobs[job.job_id] = job
+            self._save(jobs)
+
+    def update(self, job_id, function):
+        '''
+        Apply function to the job with given id and store it, under the lock. Returns the updated job or None if there is no such job.
+        '''
+        with FileLock(self.lock_file_path):
+            jobs = self._load()
+            job = jobs.get(job_id)
+            if job is None:
+                return None
+            function(job)
+            self._save(jobs)
+        return job
+
+    def finish(self, job_id, status, result = None, message = None):
+        '''
+        Finish the job with given id unless it has finished already, and return it
+        '''
+        def finish_job(job):
+            if job.finished_at is None:
+                job.finish(status, result, message)
+        return self.update(job_id, finish_job)
+
+    def claim_next(self, worker_pid):
+        '''
+        Mark the oldest queued job as running in the worker process of given id and return it, or None if no job is queued
+        '''
+        with FileLock(self.lock_file_path):
+            jobs = self._load()
+            queued = sorted((job for job in jobs.values() if job.status == 'queued'), key = lambda job: job.created_at)
+            if not queued:
+                return None
+
+            job = queued[0]
+            job.status = 'running'
+            job.started_at = time.time()
+            job.current_stage = 'waiting_for_lock'
+            job.worker_pid = worker_pid
+            self._save(jobs)
+        return job
+
+def run_training_job(job_id, file_path, score_threshold, profile_path = None, mode = 'full'):
+    '''
+    Run the training pipeline, or the incremental training pipeline with mode 'incremental', in a job process, recording
+    the stages and the result of the job in the job store. The job waits for any job of another process to finish first
+    and stops at the next stage boundary once its cancellation has been requested in the job store.
+    If profile_path is given, the run is profiled with cProfile and the profile saved there.
+    '''
+    training_jobs_config = TrainingJobsConfig()
+    job_store = TrainingJobStore()
+
+    def stage_callback(stage, status):
+        job = job_store.update(job_id, lambda job: job.record_stage(stage, status, time.time()))
+        if job.cancel_requested and stage not in training_jobs_config.uninterruptible_stages:
+            raise TrainingCancelled(f'Training job cancelled at {stage} {status}.')
+
+    def start(job):
+        job.started_at = time.time()
+        job.current_stage = None
+
+    try:
+        with FileLock(training_jobs_config.job_lock_file_path):
+            job_store.update(job_id, start)
+            if mode == 'incremental':
+                with (profiled(profile_path) if profile_path else contextlib.nullcontext()):
+                    summary = IncrementalTrainingPipeline(stage_callback).run_pipeline(file_path, score_threshold)
+            else:
+                summary = TrainingPipeline(stage_callback).run_pipeline(score_threshold, file_path, profile_path = profile_path)
+
+            # The job is only done, and the lock released, once its artifacts are published; meanwhile its result reports them pending
+            if summary['saved'] == 'pending':
+                def publishing(job):
+                    job.result = summary
+                    job.record_stage('publish_artifacts', 'started', time.time())
+                job_store.update(job_id, publishing)
+                wait_for_artifacts(summary)
+                job_store.update(job_id, lambda job: job.record_stage('publish_artifacts', 'finished', time.time()))
+        job_store.finish(job_id, 'succeeded', summary, 'Training completed successfully.' if summary['saved'] else 'No model met the score threshold, artifacts were not replaced.')
+    except CustomError as e:
+        job_store.finish(job_id, 'cancelled' if e.type_of_error is TrainingCancelled else 'failed', message = str(e.exception_object))
+    except Exception as e:
+        job_store.finish(job_id, 'failed', message = str(e))
+
+class TrainingJobManager:
+    '''
+    A class for running training jobs one at a time in a background process, so that web requests are not blocked and
+    prediction traffic keeps the interpreter of the web app to itself. The state of the jobs is kept in a TrainingJobStore,
+    so every worker process of the web app sees every job; queued jobs are run by whichever worker claims them first.
+    '''
+    def __init__(self, job_store = None):
+        self.training_jobs_config = TrainingJobsConfig()
+        self.job_store = job_store or TrainingJobStore()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._mp_context = multiprocessing.get_context(self.training_jobs_config.mp_start_method)
+
+    def submit(self, file_path, score_threshold, profile = False, mode = 'full'):
+        '''
+        Queue a training job and return it. With profile, the run of the job is profiled into the profile directory.
+        With mode 'incremental', the saved model is updated with the rows of file_path instead of retraining every candidate.
+        '''
+        if mode not in ('full', 'incremental'):
+            raise ValueError(f"Unknown training mode {mode}, expected 'full' or 'incremental'.")
+
+        job_id = uuid.uuid4().hex
+        profile_path = os.path.join(self.training_jobs_config.profile_dir, f'{job_id}.prof') if profile else None
+        job = TrainingJob(job_id, file_path, score_threshold, profile_path, mode)
+
+        self.job_store.add(job)
+        self._ensure_worker()
+        logging.info(f'Queued {mode} training job {job.job_id} for {file_path}')
+        return job
+
+    def get(self, job_id):
+        '''
+        Return the job with given id or None
+        '''
+        job = self.job_store.get(job_id)
+        return self._reconcile([job])[0] if job is not None else None
+
+    def list_jobs(self):
+        '''
+        Return all known jobs, most recent first
+        '''
+        return self._reconcile(self.job_store.list_jobs())
+
+    def cancel(self, job_id):
+        '''
+        Request cancellation of a job and return it, or None if there is no such job
+        '''
+        def request_cancellation(job):
+            if job.status in ('queued', 'running'):
+                job.cancel_requested = True
+                if job.status == 'queued':
+                    job.finish('cancelled', message = 'Training job cancelled before it started.')
+
+        job = self.job_store.update(job_id, request_cancellation)
+        if job is not None and job.cancel_requested:
+            logging.info(f'Cancellation requested for training job {job_id}')
+        return job
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target = self._run_worker, name = 'training-job-worker', daemon = True)
+                self._worker.start()
+
+    def _reconcile(self, jobs):
+        '''
+        Fail the running jobs whose worker and job processes have both exited without finishing them, e.g. when the
+        worker was killed, and take over queued jobs, whose worker may have been replaced before running them
+        '''
+        for index, job in enumerate(jobs):
+            if job.status == 'queued':
+                self._ensure_worker()
+            elif job.status == 'running' and not pid_alive(job.worker_pid) and not pid_alive(job.pid):
+                jobs[index] = self.job_store.finish(job.job_id, 'failed', message = 'Training job process exited without finishing the job.') or job
+        return jobs
+
+    def _run_worker(self):
+        while True:
+            with self._lock:
+                job = self.job_store.claim_next(os.getpid())
+                if job is None:
+                    self._worker = None
+                    return
+            try:
+                self._run_job(job)
+            except:
+                error_obj = CustomError(*sys.exc_info())
+                logging.error(error_obj, exc_info = True)
+                self.job_store.finish(job.job_id, 'failed', message = str(error_obj))
+
+    def _run_job(self, job):
+        '''
+        Run a job in its own process until it ends, terminating it if it does not stop in time after being cancelled.
+        The job process records its own progress in the job store.
+        '''
+        logging.info(f'Starting training job {job.job_id}...')
+        process = self._mp_context.Process(target = run_training_job,
+                                           args = (job.job_id, job.file_path, job.score_threshold, job.profile_path, job.mode),
+                                           name = f'training-job-{job.job_id}',
+                                           daemon = False) # Parallel training starts worker processes of its own
+        process.start()
+        self.job_store.update(job.job_id, lambda job: setattr(job, 'pid', process.pid))
+        cancel_deadline = None
+
+        while process.is_alive():
+            process.join(self.training_jobs_config.poll_interval_seconds)
+            job = self.job_store.get(job.job_id)
+            if job.cancel_requested and cancel_deadline is None:
+                cancel_deadline = time.monotonic() + self.training_jobs_config.cancel_grace_seconds
+
+            if cancel_deadline is not None and time.monotonic() > cancel_deadline and job.current_stage not in self.training_jobs_config.uninterruptible_stages and process.is_alive():
+                process.terminate()
+                process.join()
+                self.job_store.finish(job.job_id, 'cancelled', message = 'Training job process terminated after cancellation.')
+
+        process.join()
+        job = self.job_store.finish(job.job_id, 'failed', message = f'Training job process exited with code {process.exitcode}.')
+        logging.info(f'Training job {job.job_id} finished with status {job.status}')
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_training_job_manager():
+    '''
+    Return the process wide TrainingJobManager, creating it if required
+    '''
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = TrainingJobManager()
+        return _manager
@@ -4,15 +4,36 @@ from dataclasses import dataclass
 import numpy as np
 import pandas as pd
 import shutil
+import time
+import hashlib
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from sklearn.base import clone
+from threadpoolctl import threadpool_limits
 
 from src.components.data_ingestion import DataIngestion
 from src.components.data_transformation import DataPreProcessor
 from src.components.model_trainer import ModelTrainer
 from src.components.data_resampler import DataResampler
-from src.components.model_evaluator import ModelEvaluator
-from src.utils import load_object, area_under_precision_recall_curve, save_object, double_log_transform, cube_root_transform
+from src.components.chunked_smote import as_chunked_smote
+from src.components.model_evaluator import ModelEvaluator, metric_greater_is_better
+from src.components.successive_halving import SuccessiveHalving, SuccessiveHalvingConfig
+from src.components.cross_validation import CrossValidation, CrossValidationConfig
+from src.components.model_registry import get_model_registry
+from src.components.inference_kernel import export_inference_kernel
+from src.components.kernel_artifact import save_kernel_artifact, remove_kernel_artifact
+from src.components.artifact_store import ArtifactStore, ArtifactStoreConfig, submit_write, wait_for_writes
+from src.components.drift_monitor import save_reference
+from src.components.shared_data import SharedDataStore, load_shared
+from src.components.dataset_cache import DatasetCache
+from src.components.transformation_cache import TransformationCache, dataset_fingerprint, is_deterministic
+from src.utils import load_object, dump_object_to_bytes, save_json, FileLock, double_log_transform, cube_root_transform
 
-from src.exception import CustomError
+from src.instrumentation import instrument_stage, collect_stages, profiled
+from src.exception import CustomError, TrainingCancelled
 from src.logger import logging
 
 @dataclass
@@ -22,24 +43,91 @@ class TrainingPipelineConfig:
     '''
     preprocessor_obj_file_path = os.path.join("artifacts", "preprocessor.pkl")
     model_obj_file_path = os.path.join("artifacts", "model.pkl")
+    model_version_file_path = os.path.join("artifacts", "model_version.json")
+    artifacts_lock_file_path = os.path.join("artifacts", ".artifacts.lock")
     raw_data_path = os.path.join("artifacts", "raw_data.csv")
     train_data_path = os.path.join("artifacts", "train.csv")
     test_data_path = os.path.join("artifacts", "test.csv")
     train_data_describe_path = os.path.join("artifacts", "train_data_describe.csv")
+    drift_reference_path = os.path.join("artifacts", "drift_reference.json") # Quantile bins of the train features, used by the drift monitor
+    training_data_dir = os.path.join("artifacts", "training_data") # Train and test sets of the saved model, extended by incremental training
+    save_training_data = True
+    inference_kernel_sample_size = 10000 # Number of test rows used to check the compiled inference kernel against the model
+    kernel_artifact_dir = os.path.join("artifacts", "inference_kernel")
+    export_kernel_artifact = True # Also save the compiled inference kernel as memory-mappable arrays, loaded without unpickling
+    models_data_path = os.path.join("notebook", "models", "models_data.pkl")
+    n_workers = 1 # Number of processes training candidates in parallel, 1 trains them one after another and -1 uses all cores
+    mp_start_method = "spawn" # Start method of worker processes, spawn is safe to use from within the multi-threaded web app
+    ingestion_chunk_size = None # Rows per chunk for streaming ingestion of files larger than memory, None loads the whole file
+    ingestion_max_memory_mb = None # Memory budget of the chunk buffers of streaming ingestion, overrides ingestion_chunk_size when set; training still loads the whole train and test sets
+    use_dataset_cache = True # Reuse the ingested data of a file seen before from the binary dataset cache
+    export_csv = False # Also write a copy of the raw file and the train and test sets as csv files
+    use_transformation_cache = True # Reuse fitted pre-processors and resampled train data of identical configurations
+    selection_metric = None # Test report metric the best model is chosen on, e.g. 'roc_auc' or 'min_cost'; None uses the test score (PR-AUC)
+    use_chunked_smote = True # Resample with ChunkedSMOTE in place of imblearn's SMOTE, sharing the minority neighbour index across candidates
+    smote_chunk_size = 4096 # Rows per neighbour query and per block of synthetic rows of ChunkedSMOTE
+    smote_n_jobs = None # Threads running neighbour queries of ChunkedSMOTE, None uses all cores
+    smote_approximate = False # Search neighbours of ChunkedSMOTE in a random projection, faster but not exact on very large minority classes
+    compute_dtype = os.environ.get('COMPUTE_DTYPE') or None # 'float32' keeps features in float32 from csv parse to predict_proba, None keeps the parsed dtype
+    in_place_transforms = True # Let scaler and PCA steps of pre-processors transform the intermediate arrays of the pipeline in place
+    model_selection = os.environ.get('MODEL_SELECTION', 'exhaustive') # 'exhaustive' trains every candidate on all rows, 'successive_halving' eliminates weak ones on subsamples first,
+                                                                       # 'cross_validation' chooses on the mean score of stratified k-fold cross-validation of the train set
 
 class TrainingPipeline:
     '''
     A class for running the whole training pipeline
     '''
-    def __init__(self):
+    def __init__(self, stage_callback = None):
         self.training_pipeline_config = TrainingPipelineConfig()
+        self.stage_callback = stage_callback # Called as stage_callback(stage, status) when a stage starts or finishes
+
+    def report_progress(self, stage, status):
+        '''
+        Notify the stage callback, if any, that given stage has 'started' or 'finished'.
+        The callback may raise TrainingCancelled to stop the pipeline at a stage boundary.
+        '''
+        if self.stage_callback is not None:
+            self.stage_callback(stage, status)
 
+    @instrument_stage('training_pipeline.ingest_data', rows_out = lambda data_arr: len(data_arr[0]) + len(data_arr[1]))
     def ingest_data(self, path, target_class, test_size, random_state):
         '''
-        Loads data from given file path of csv file, splits it into test-train, saves the data and returns it further for data transformation
+        Loads data from given file path of csv file, splits it into test-train, saves the data and returns it further for data transformation.
+        If a chunk size or memory budget is configured, the file is streamed into train and test shards which are then loaded with compact dtypes.
+        The memory budget covers streaming the csv file only, the loaded train and test sets take the size of the whole data set.
+        Features are returned in the compute dtype of the config, if set. Ingested data is kept in the dataset cache, from which later runs over the same file and settings load it without parsing the csv.
         '''
+        ingestion_settings = {'target_class': target_class,
+                              'test_size': test_size,
+                              'random_state': random_state,
+                              'chunked': self.training_pipeline_config.ingestion_chunk_size is not None or self.training_pipeline_config.ingestion_max_memory_mb is not None,
+                              'dtype': self.training_pipeline_config.compute_dtype}
+
+        if self.training_pipeline_config.use_dataset_cache:
+            dataset_cache = DatasetCache()
+            data_arr = dataset_cache.load(path, **ingestion_settings)
+            if data_arr is not None:
+                return data_arr
+
         data_ingestion = DataIngestion()
-        data_arr = data_ingestion.ingest_data(path, target_class, test_size, random_state)
+
+        if not ingestion_settings['chunked']:
+            data_arr = data_ingestion.ingest_data(path, target_class, test_size, random_state, ingestion_settings['dtype'])
+        else:
+            train_shards, test_shards = data_ingestion.ingest_data_chunked(path,
+                                                                           target_class,
+                                                                           test_size,
+                                                                           random_state,
+                                                                           self.training_pipeline_config.ingestion_chunk_size,
+                                                                           self.training_pipeline_config.ingestion_max_memory_mb)
+            X_train, Y_train = data_ingestion.load_shards(train_shards, target_class)
+            X_test, Y_test = data_ingestion.load_shards(test_shards, target_class)
+            if ingestion_settings['dtype'] is not None:
+                X_train, X_test = X_train.astype(ingestion_settings['dtype']), X_test.astype(ingestion_settings['dtype'])
+            data_arr = (X_train, X_test, Y_train, Y_test)
+
+        if self.training_pipeline_config.use_dataset_cache:
+            dataset_cache.store(path, *data_arr, **ingestion_settings)
 
         return data_arr
 
@@ -52,10 +140,45 @@ class TrainingPipeline:
         X_train_transformed = data_transformation.fit_transform(pre_processor, X_train, Y_train)
 
         # fitting resampler and resampling already transformed X_train
+        resampler = self.scalable_resampler(resampler)
         data_resampler = DataResampler()
         X_train_transformed, Y_train_transformed = data_resampler.fit_resample(resampler, X_train_transformed, Y_train)
 
         return (X_train_transformed, Y_train_transformed)
+
+    def scalable_resampler(self, resampler):
+        '''
+        Return the ChunkedSMOTE equivalent of an imblearn SMOTE resampler if enabled in the config, else the resampler itself
+        '''
+        if not self.training_pipeline_config.use_chunked_smote:
+            return resampler
+
+        return as_chunked_smote(resampler,
+                                chunk_size = self.training_pipeline_config.smote_chunk_size,
+                                n_jobs = self.training_pipeline_config.smote_n_jobs,
+                                approximate = self.training_pipeline_config.smote_approximate)
+
+    def cached_transform_data_with_resampling(self, pre_processor, resampler, X_train, Y_train, data_fingerprint = None):
+        '''
+        Same as transform_data_with_resampling, but reuses the result of an identical pre-processor and resampler configuration
+        on the same train data from the transformation cache. Returns a tuple of format (fitted pre-processor, X_train_transformed, Y_train_transformed),
+        where the pre-processor is the cached one on a cache hit.
+        '''
+        if not self.training_pipeline_config.use_transformation_cache or not is_deterministic(pre_processor, resampler):
+            return (pre_processor, *self.transform_data_with_resampling(pre_processor, resampler, X_train, Y_train))
+
+        resampler = self.scalable_resampler(resampler)
+        transformation_cache = TransformationCache()
+        key = transformation_cache.key(pre_processor, resampler, data_fingerprint or dataset_fingerprint(X_train, Y_train))
+
+        cached = transformation_cache.get(key)
+        if cached is not None:
+            return cached
+
+        X_train_transformed, Y_train_transformed = self.transform_data_with_resampling(pre_processor, resampler, X_train, Y_train)
+        transformation_cache.put(key, pre_processor, X_train_transformed, Y_train_transformed)
+
+        return (pre_processor, X_train_transformed, Y_train_transformed)
         
     def train_model(self, model, params, X_train, Y_train):
         '''
@@ -73,117 +196,406 @@ class TrainingPipeline:
         score = model_evaluator.evaluate(pre_processor, model, X, Y, scorer_func, name_for_data)  
 
         return score      
+
+    def evaluate_model_report(self, pre_processor, model, X, Y, name_for_data):
+        '''
+        Take in the pre-processor, model, X, Y, name or title for data set and return the report of every evaluation metric
+        '''
+        model_evaluator = ModelEvaluator()
+
+        return model_evaluator.evaluate_report(pre_processor, model, X, Y, name_for_data)
     
-    def find_best_model(self, models_data, greater_is_better = True):
+    def prepare_candidate(self, model):
         '''
-        Find the best modesl index in models_data which has the best test score
+        Return a copy of a candidate of models_data having its own unfitted pre-processor, resampler and model.
+        Candidates in models_data share some pre-processing steps, which every candidate would otherwise refit in turn.
         '''
+        candidate = dict(model)
+        for key in ('pre-processor', 'resampler', 'model'):
+            candidate[key] = clone(model[key])
+
+        if self.training_pipeline_config.in_place_transforms:
+            DataPreProcessor().set_in_place(candidate['pre-processor'])
+
+        return candidate
+
+    @instrument_stage('training_pipeline.train_candidate', rows_in = 'X_train')
+    def train_candidate(self, model, X_train, Y_train, X_test, Y_test, data_fingerprint = None):
+        '''
+        Pre-process, resample, train and evaluate one candidate of models_data, storing its train and test reports in it
+        along with their PR-AUC as train and test scores, and the seconds all of it took
+        '''
+        logging.info(f'For model - {model['name'].replace("_", " ")}:')
+        start_time = time.perf_counter()
+
+        # Transforming data by pre-processing and resampling, or reusing the result of an identical configuration
+        model['pre-processor'], X_train_transformed, Y_train_transformed = self.cached_transform_data_with_resampling(model['pre-processor'],
+                                                                                                                     model['resampler'],
+                                                                                                                     X_train,
+                                                                                                                     Y_train,
+                                                                                                                     data_fingerprint)
+
+        # Training the model
+        self.train_model(model['model'],
+                         model['best_params'],
+                         X_train_transformed,
+                         Y_train_transformed)
+
+        # Evaluating model on train set
+        model['train_report'] = self.evaluate_model_report(model['pre-processor'], model['model'], X_train, Y_train, 'train')
+        model['train_score'] = model['train_report']['pr_auc']
+
+        # Evaluating model on test set
+        model['test_report'] = self.evaluate_model_report(model['pre-processor'], model['model'], X_test, Y_test, 'test')
+        model['test_score'] = model['test_report']['pr_auc']
+        model['train_seconds'] = time.perf_counter() - start_time
+
+        return model
+
+    def train_candidates(self, models_data, X_train, Y_train, X_test, Y_test, n_workers = None):
+        '''
+        Train and evaluate every candidate of models_data, in parallel processes if n_workers is more than 1.
+        Returns the candidates in the order of models_data. A candidate which fails gets an 'error' entry instead of scores.
+        '''
+        if n_workers is None:
+            n_workers = self.training_pipeline_config.n_workers
+        if n_workers == -1:
+            n_workers = os.cpu_count()
+        n_workers = max(1, min(n_workers, len(models_data)))
+
+        candidates = [self.prepare_candidate(model) for model in models_data]
+        data_fingerprint = dataset_fingerprint(X_train, Y_train) if self.training_pipeline_config.use_transformation_cache else None
+
+        if n_workers == 1:
+            for candidate in candidates:
+                self.report_progress(f'train_{candidate['name']}', 'started')
+                try:
+                    self.train_candidate(candidate, X_train, Y_train, X_test, Y_test, data_fingerprint)
+                except Exception as e:
+                    candidate['error'] = f'{type(e).__name__}: {e}'
+                    logging.error(f'Training of model - {candidate['name'].replace("_", " ")} failed.', exc_info = True)
+                self.report_progress(f'train_{candidate['name']}', 'finished')
+            return candidates
+
+        # Split the cores among the workers, so that estimators with their own n_jobs do not oversubscribe the machine
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        logging.info(f'Training {len(candidates)} candidates with {n_workers} workers of {n_threads} threads each...')
+
+        with SharedDataStore() as shared_data_store:
+            shared_data = {'X_train': shared_data_store.share('X_train', X_train),
+                           'Y_train': shared_data_store.share('Y_train', Y_train),
+                           'X_test': shared_data_store.share('X_test', X_test),
+                           'Y_test': shared_data_store.share('Y_test', Y_test)}
+
+            mp_context = multiprocessing.get_context(self.training_pipeline_config.mp_start_method)
+            with ProcessPoolExecutor(max_workers = n_workers, mp_context = mp_context) as executor:
+                futures = [executor.submit(train_candidate_in_worker, candidate, shared_data, n_threads, data_fingerprint) for candidate in candidates]
+                for candidate in candidates:
+                    self.report_progress(f'train_{candidate['name']}', 'started')
+
+                for index, future in enumerate(futures):
+                    try:
+                        candidates[index] = future.result()
+                    except Exception as e:
+                        # Failures of the worker process itself, failures of training are caught within the worker
+                        candidates[index]['error'] = f'{type(e).__name__}: {e}'
+                        logging.error(f'Worker training model - {candidates[index]['name'].replace("_", " ")} failed.', exc_info = True)
+                    try:
+                        self.report_progress(f'train_{candidates[index]['name']}', 'finished')
+                    except TrainingCancelled:
+                        for pending_future in futures:
+                            pending_future.cancel()
+                        raise
+
+        return candidates
+
+    def find_best_model(self, models_data, greater_is_better = None, metric = None):
+        '''
+        Find the best modesl index in models_data which has the best test score, or the best value of metric in the test report.
+        Whether greater is better is looked up for the metric when not given.
+        '''
+        def test_score(model):
+            return model['test_score'] if metric is None else model['test_report'][metric]
+
+        if greater_is_better is None:
+            greater_is_better = metric is None or metric_greater_is_better(metric)
+
         if greater_is_better:
             best_model_score = -np.inf
             for index, model in enumerate(models_data):
-                if model['test_score'] > best_model_score:
+                if test_score(model) > best_model_score:
                     best_model_index = index
-                    best_model_score = model['test_score']
+                    best_model_score = test_score(model)
         else:
             best_model_score = np.inf
             for index, model in enumerate(models_data):
-                if model['test_score'] < best_model_score:
+                if test_score(model) < best_model_score:
                     best_model_index = index
-                    best_model_score = model['test_score']  
+                    best_model_score = test_score(model)
 
         return best_model_index
     
-    def save_data(self, X_train, Y_train, X_test, Y_test, ingestion_path, preprocessor, model):
+    def compute_dtype_of(self, X):
         '''
-        Save raw data, train set, test set, train data description, pre-processor and model in given locations
+        Return the name of the dtype prediction casts features to for a model trained on X: the compute dtype of the config
+        if set, otherwise the common dtype of the features of X, float64 when they are not all floats
         '''
-        df_train = pd.concat((X_train, Y_train), axis = 1)
+        if self.training_pipeline_config.compute_dtype is not None:
+            return str(np.dtype(self.training_pipeline_config.compute_dtype))
 
-        # Create required directories, if not exist
-        os.makedirs(os.path.dirname(self.training_pipeline_config.raw_data_path), exist_ok = True)
+        dtype = np.result_type(*X.dtypes)
+        return str(dtype if np.issubdtype(dtype, np.floating) else np.dtype(np.float64))
 
-        # Copying the raw file
-        shutil.copyfile(ingestion_path,
-                        self.training_pipeline_config.raw_data_path)
+    @instrument_stage('training_pipeline.save_data')
+    def save_data(self, X_train, Y_train, X_test, Y_test, ingestion_path, preprocessor, model, model_info = None):
+        '''
+        Save a new version of the artifacts to the artifact store and publish it: train data description, drift reference,
+        pre-processor, model, inference kernel and the train and test sets the pair was trained and evaluated on, along with
+        raw data, train set and test set if csv export is enabled. The pair is pickled, versioned and compiled here, and the
+        files are written, committed and published by the background artifact writer if background writes are enabled.
+        Returns a tuple of format (version, future), the future is done once the version is published and raises the error
+        of a failed write.
+        '''
+        # Pickling and versioning the pair
+        preprocessor_bytes = dump_object_to_bytes(preprocessor)
+        model_bytes = dump_object_to_bytes(model)
+        model_sha256 = hashlib.sha256(model_bytes).hexdigest()
+        preprocessor_sha256 = hashlib.sha256(preprocessor_bytes).hexdigest()
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{hashlib.sha256((model_sha256 + preprocessor_sha256).encode()).hexdigest()[:8]}"
 
-        # Saving the train data
-        df_train.to_csv(self.training_pipeline_config.train_data_path,
-                        index = True,
-                        header = True)
-        
-        # Saving train data description
-        df_train.iloc[:, :-1].describe().loc[['min', '50%', 'max'], :].to_csv(self.training_pipeline_config.train_data_describe_path, index = True, header = True)
-        
-        # Saving the test data
-        pd.concat((X_test, Y_test), axis = 1).to_csv(self.training_pipeline_config.test_data_path,
-                                                     index = True,
-                                                     header = True)
-        
-        # Saving the pre-processor
-        save_object(self.training_pipeline_config.preprocessor_obj_file_path,
-                    preprocessor)
-        
-        # Saving the model
-        save_object(self.training_pipeline_config.model_obj_file_path,
-                    model)
+        model_version = dict(model_info or {})
+        model_version['compute_dtype'] = self.compute_dtype_of(X_train)
 
-    def run_pipeline(self, score_threshold, ingestion_path = 'notebook/Data/creditcard.csv'):
-        logging.info('Started training pipeline...')
+        # Checking that the pair compiles into an inference kernel which matches it on the test set
+        kernel = None
         try:
-            # Loading the data
-            X_train, X_test, Y_train, Y_test = self.ingest_data(ingestion_path, 'Class', 0.33, 42)
-
-            # Loding the pre-processor and model configurations
-            models_data = load_object('notebook/models/models_data.pkl')
-
-            for model in models_data:
-                logging.info(f'For model - {model['name'].replace("_", " ")}:')
-
-                # Transforming data by pre-processing and resampling
-                X_train_transformed, Y_train_transformed = self.transform_data_with_resampling(model['pre-processor'],
-                                                                                               model['resampler'],
-                                                                                               X_train,
-                                                                                               Y_train)
-
-                # Training the model
-                self.train_model(model['model'],
-                                 model['best_params'],
-                                 X_train_transformed,
-                                 Y_train_transformed)
-                
-                # Evaluating model on train set
-                model['train_score'] = self.evaluate_model(model['pre-processor'], model['model'], X_train, Y_train, area_under_precision_recall_curve, 'train')
-
-                # Evaluating model on test set
-                model['test_score'] = self.evaluate_model(model['pre-processor'], model['model'], X_test, Y_test, area_under_precision_recall_curve, 'test')
-
-            # Finding best model based on test score
-            best_model_index = self.find_best_model(models_data)
-
-            if models_data[best_model_index]['test_score'] >= score_threshold:
-                # Saving the related files
-                self.save_data(X_train,
-                               Y_train,
-                               X_test,
-                               Y_test,
-                               ingestion_path,
-                               models_data[best_model_index]['pre-processor'],
-                               models_data[best_model_index]['model'])
-                # Print the best performance
-                print(f"Training pipeline completed.")
-                print(f'Best model - {models_data[best_model_index]['name'].replace("_", " ")}')
-                print(f'Train Score - {models_data[best_model_index]['train_score']}')
-                print(f'Test Score - {models_data[best_model_index]['test_score']}')
-                logging.info(f'Best model - {models_data[best_model_index]['name'].replace("_", " ")}. Train Score - {models_data[best_model_index]['train_score']}. Test Score - {models_data[best_model_index]['test_score']}')
-            else:
-                print(f'No appropriate model found based on scoring threshold of {score_threshold}')
-        except:
-            error_obj = CustomError(*sys.exc_info())
-            logging.error(error_obj, exc_info = True)
-            raise error_obj
+            kernel, model_version['inference_kernel_max_abs_diff'] = export_inference_kernel(preprocessor, model, X_test.iloc[:self.training_pipeline_config.inference_kernel_sample_size])
+        except (TypeError, ValueError):
+            model_version['inference_kernel_max_abs_diff'] = None
+            logging.error('Best model cannot be compiled into an inference kernel.', exc_info = True)
+
+        model_version['kernel_artifact'] = self.training_pipeline_config.kernel_artifact_dir if kernel is not None and self.training_pipeline_config.export_kernel_artifact else None
+        model_version.update({'version': version,
+                              'created_at': time.time(),
+                              'model_sha256': model_sha256,
+                              'preprocessor_sha256': preprocessor_sha256})
+
+        if ArtifactStoreConfig().background_writes:
+            write = submit_write(self.write_artifacts, X_train, Y_train, X_test, Y_test, ingestion_path, preprocessor, model,
+                                 preprocessor_bytes, model_bytes, kernel, model_version)
         else:
-            logging.info('Successfully completed training pipeline!!!')
+            write = Future()
+            self.write_artifacts(X_train, Y_train, X_test, Y_test, ingestion_path, preprocessor, model,
+                                 preprocessor_bytes, model_bytes, kernel, model_version)
+            write.set_result(version)
+
+        return (version, write)
+
+    def write_artifacts(self, X_train, Y_train, X_test, Y_test, ingestion_path, preprocessor, model, preprocessor_bytes, model_bytes, kernel, model_version):
+        '''
+        Write the files of a version into a staging directory of the artifact store, commit them and publish the version.
+        Files at the paths of the config end up at the same paths, unchanged blobs like the raw dataset are not copied again,
+        and versions beyond the retention of the store are evicted afterwards. Returns the version.
+        '''
+        artifact_store = ArtifactStore()
+        staging_dir = artifact_store.staging_dir()
+        version = model_version['version']
+
+        def staged(path):
+            return os.path.join(staging_dir, os.path.relpath(path, artifact_store.artifacts_dir))
+
+        def relative(path):
+            return os.path.relpath(path, artifact_store.artifacts_dir).replace(os.sep, '/')
+
+        try:
+            # Saving the pre-processor and model
+            for path, data in ((self.training_pipeline_config.preprocessor_obj_file_path, preprocessor_bytes),
+                               (self.training_pipeline_config.model_obj_file_path, model_bytes)):
+                os.makedirs(os.path.dirname(staged(path)), exist_ok = True)
+                with open(staged(path), 'wb') as file_obj:
+                    file_obj.write(data)
+
+            # Saving train data description
+            X_train.describe().loc[['min', '50%', 'max'], :].to_csv(staged(self.training_pipeline_config.train_data_describe_path), index = True, header = True)
+
+            # Saving the train and test data, the raw file is added to the store as it is
+            external_files = {}
+            if self.training_pipeline_config.export_csv:
+                external_files[relative(self.training_pipeline_config.raw_data_path)] = ingestion_path
+                pd.concat((X_train, Y_train), axis = 1).to_csv(staged(self.training_pipeline_config.train_data_path), index = True, header = True)
+                pd.concat((X_test, Y_test), axis = 1).to_csv(staged(self.training_pipeline_config.test_data_path), index = True, header = True)
+
+            # Saving the kernel as memory-mappable arrays
+            if model_version['kernel_artifact'] is not None:
+                save_kernel_artifact(kernel, staged(self.training_pipeline_config.kernel_artifact_dir), {'version': version})
+
+            # Saving the distribution of the train features, against which the drift of prediction traffic is measured
+            save_reference(X_train, staged(self.training_pipeline_config.drift_reference_path), version = version)
+
+            # Saving the train and test sets, which incremental training extends with new data
+            if self.training_pipeline_config.save_training_data:
+                DatasetCache().store_entry(staged(self.training_pipeline_config.training_data_dir), X_train, X_test, Y_train, Y_test, {'version': version})
+
+            # Saving the version of the pre-processor and model pair, which the model registry checks the pair against
+            save_json(staged(self.training_pipeline_config.model_version_file_path), model_version)
+
+            artifact_store.commit(staging_dir, version, model_version, external_files)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors = True)
+
+        # Only one process at a time publishes a version, a kernel of an earlier version is not left to be served with this one
+        with FileLock(self.training_pipeline_config.artifacts_lock_file_path):
+            if model_version['kernel_artifact'] is None:
+                remove_kernel_artifact(self.training_pipeline_config.kernel_artifact_dir)
+            artifact_store.publish(version)
+
+            # Swapping the new pair into the in-process model registry
+            get_model_registry(self.training_pipeline_config.model_obj_file_path,
+                               self.training_pipeline_config.preprocessor_obj_file_path).publish(model, preprocessor, model_version)
+
+        artifact_store.gc()
+        return version
+
+    @instrument_stage('training_pipeline.run_pipeline')
+    def run_pipeline(self, score_threshold, ingestion_path = 'notebook/Data/creditcard.csv', n_workers = None, profile_path = None, profiler = 'cprofile'):
+        '''
+        Run the whole training pipeline and return a summary dictionary with the best model, its scores, whether it was saved
+        and the measurements of every stage. 'saved' is 'pending' while the artifacts are still being written in the background,
+        wait_for_artifacts resolves it. If profile_path is given, the run is profiled with profiler ('cprofile' or 'pyinstrument')
+        and the profile is saved there.
+        '''
+        with collect_stages() as stages, (profiled(profile_path, profiler) if profile_path else contextlib.nullcontext()):
+            logging.info('Started training pipeline...')
+            try:
+                # Loading the data
+                self.report_progress('ingest_data', 'started')
+                X_train, X_test, Y_train, Y_test = self.ingest_data(ingestion_path, 'Class', 0.33, 42)
+                self.report_progress('ingest_data', 'finished')
+
+                # Loding the pre-processor and model configurations
+                models_data = load_object(self.training_pipeline_config.models_data_path)
+
+                # Training and evaluating every candidate, or the survivors of successive halving, failed candidates are left out of model selection
+                selection_report = None
+                if self.training_pipeline_config.model_selection == 'successive_halving':
+                    models_data, selection_report = SuccessiveHalving(self).run(models_data, X_train, Y_train, X_test, Y_test, n_workers)
+                elif self.training_pipeline_config.model_selection == 'cross_validation':
+                    models_data, selection_report = CrossValidation(self).run(models_data, X_train, Y_train, X_test, Y_test, n_workers)
+                elif self.training_pipeline_config.model_selection == 'exhaustive':
+                    models_data = self.train_candidates(models_data, X_train, Y_train, X_test, Y_test, n_workers)
+                else:
+                    raise ValueError(f"Unknown model selection {self.training_pipeline_config.model_selection}, expected 'exhaustive', 'successive_halving' or 'cross_validation'.")
+                worker_stages = [stage_record for model in models_data for stage_record in model.pop('stages', [])]
+                if selection_report is not None:
+                    worker_stages += selection_report.pop('worker_stages', [])
+                models_data = [model for model in models_data if 'error' not in model]
+                if not models_data:
+                    raise RuntimeError('Training failed for every model in models data.')
+
+                # Finding best model based on test score
+                best_model_index = self.find_best_model(models_data, metric = self.training_pipeline_config.selection_metric)
+                summary = {'best_model': models_data[best_model_index]['name'],
+                           'train_score': float(models_data[best_model_index]['train_score']),
+                           'test_score': float(models_data[best_model_index]['test_score']),
+                           'test_report': models_data[best_model_index]['test_report'],
+                           'saved': False}
+                if selection_report is not None:
+                    summary['model_selection'] = selection_report
+
+                if models_data[best_model_index]['test_score'] >= score_threshold:
+                    # Saving the related files
+                    self.report_progress('save_artifacts', 'started')
+                    summary['version'], write = self.save_data(X_train,
+                                   Y_train,
+                                   X_test,
+                                   Y_test,
+                                   ingestion_path,
+                                   models_data[best_model_index]['pre-processor'],
+                                   models_data[best_model_index]['model'],
+                                   {'name': models_data[best_model_index]['name'],
+                                    'train_score': models_data[best_model_index]['train_score'],
+                                    'test_score': models_data[best_model_index]['test_score'],
+                                    'test_report': models_data[best_model_index]['test_report']})
+                    self.report_progress('save_artifacts', 'finished')
+                    summary['saved'] = True if write.done() and write.exception() is None else 'pending'
+
+                    # Print the best performance
+                    print(f"Training pipeline completed.")
+                    print(f'Best model - {models_data[best_model_index]['name'].replace("_", " ")}')
+                    print(f'Train Score - {models_data[best_model_index]['train_score']}')
+                    print(f'Test Score - {models_data[best_model_index]['test_score']}')
+                    logging.info(f'Best model - {models_data[best_model_index]['name'].replace("_", " ")}. Train Score - {models_data[best_model_index]['train_score']}. Test Score - {models_data[best_model_index]['test_score']}')
+                else:
+                    print(f'No appropriate model found based on scoring threshold of {score_threshold}')
+            except:
+                error_obj = CustomError(*sys.exc_info())
+                logging.error(error_obj, exc_info = True)
+                raise error_obj
+            else:
+                logging.info('Successfully completed training pipeline!!!')
+                summary['stages'] = [stage_record.to_dict() for stage_record in stages] + worker_stages
+                return summary
+
+def train_candidate_in_worker(model, shared_data, n_threads, data_fingerprint = None):
+    '''
+    Train and evaluate one candidate inside a worker process on data memory-mapped from a SharedDataStore.
+    The estimator and the native thread pools are limited to n_threads; n_jobs of the estimator is restored afterwards.
+    '''
+    X_train, Y_train, X_test, Y_test = (load_shared(shared_data[name]) for name in ('X_train', 'Y_train', 'X_test', 'Y_test'))
+
+    estimator_params = model['model'].get_params()
+    if 'n_jobs' in estimator_params:
+        model['model'].set_params(n_jobs = n_threads)
+
+    try:
+        # Stages measured here are handed back with the candidate, so that the parent can report them
+        with threadpool_limits(limits = n_threads), collect_stages() as stages:
+            TrainingPipeline().train_candidate(model, X_train, Y_train, X_test, Y_test, data_fingerprint)
+        model['stages'] = [stage_record.to_dict() for stage_record in stages]
+    except Exception as e:
+        model['error'] = f'{type(e).__name__}: {e}'
+        logging.error(f'Training of model - {model['name'].replace("_", " ")} failed.', exc_info = True)
+    finally:
+        if 'n_jobs' in estimator_params:
+            model['model'].set_params(n_jobs = estimator_params['n_jobs'])
+
+    return model
+
+def wait_for_artifacts(summary):
+    '''
+    Wait until the artifacts of a run summary with saved 'pending' are published and mark them saved.
+    The error of a failed write is raised instead.
+    '''
+    wait_for_writes()
+    if summary.get('saved') == 'pending':
+        summary['saved'] = True
+    return summary
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Run the training pipeline')
+    parser.add_argument('--profile', default = None, help = 'save a profile of the run to given path')
+    parser.add_argument('--profiler', default = 'cprofile', choices = ['cprofile', 'pyinstrument'])
+    parser.add_argument('--dtype', default = None, choices = ['float32', 'float64'], help = 'compute dtype of the features, overrides COMPUTE_DTYPE')
+    parser.add_argument('--selection', default = None, choices = ['exhaustive', 'successive_halving', 'cross_validation'], help = 'model selection, overrides MODEL_SELECTION')
+    parser.add_argument('--time-budget', type = float, default = None, help = 'wall-clock seconds of successive halving, overrides SELECTION_TIME_BUDGET')
+    parser.add_argument('--folds', type = int, default = None, help = 'folds of cross-validation, overrides CV_FOLDS')
+    args = parser.parse_args()
+
+    if args.dtype is not None:
+        TrainingPipelineConfig.compute_dtype = args.dtype
+    if args.selection is not None:
+        TrainingPipelineConfig.model_selection = args.selection
+    if args.time_budget is not None:
+        SuccessiveHalvingConfig.time_budget_seconds = args.time_budget
+    if args.folds is not None:
+        CrossValidationConfig.n_splits = args.folds
+
     training_pipeline_obj = TrainingPipeline()
-    training_pipeline_obj.run_pipeline(0.6)
\ No newline at end of file
+    summary = wait_for_artifacts(training_pipeline_obj.run_pipeline(0.6, profile_path = args.profile, profiler = args.profiler))
+    if summary.get('model_selection', {}).get('strategy') == 'successive_halving':
+        print(f"Successive halving - {summary['model_selection']['seconds']:.2f} seconds, "
+              f"{summary['model_selection']['estimated_seconds_saved']:.2f} candidate seconds saved against exhaustive training (estimated)")
+    elif summary.get('model_selection', {}).get('strategy') == 'cross_validation':
+        for name, result in summary['model_selection']['candidates'].items():
+            print(f"{name.replace('_', ' ')} - {result['mean']:.5f} ± {result['std']:.5f} over {summary['model_selection']['n_splits']} folds"
+                  if 'error' not in result else f"{name.replace('_', ' ')} - failed, {result['error']}")
\ No newline at end of file
@@ -1,9 +1,19 @@
+import io
 import os
+import json
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import dill
 import pickle
 
 import numpy as np
+import pandas as pd
 
 from sklearn.metrics import auc, precision_recall_curve
 
@@ -24,20 +34,105 @@ class CustomFormatter(logging.Formatter):
 
 def save_object(file_path, obj):
     '''
-    Save an object in given path as a pickle file
+    Save an object in given path as a pickle file.
+    The object is written to a temporary file first and then moved in place, so readers never see a half-written file.
     '''
     dir_path = os.path.dirname(file_path)
     os.makedirs(dir_path, exist_ok = True)
 
-    with open(file_path, "wb") as file_obj:
+    temp_file_path = f'{file_path}.{os.getpid()}.tmp'
+    with open(temp_file_path, "wb") as file_obj:
         pickle.dump(obj, file_obj)
+    os.replace(temp_file_path, file_path)
     
+class ArtifactUnpickler(pickle.Unpickler):
+    '''
+    Unpickler which resolves the pre-processing functions pickled from a notebook or script, i.e. from module __main__,
+    to the ones of this module, so that artifacts can be loaded from any entry point or worker process
+    '''
+    main_module_functions = ('double_log_transform', 'cube_root_transform')
+
+    def find_class(self, module, name):
+        if module == '__main__' and name in self.main_module_functions:
+            return globals()[name]
+        return super().find_class(module, name)
+
 def load_object(file_path):
     '''
     Load an object from given path of a pickle file
     '''
     with open(file_path, "rb") as file_obj:
-        return pickle.load(file_obj)
+        return ArtifactUnpickler(file_obj).load()
+
+def dump_object_to_bytes(obj):
+    '''
+    Return the bytes of an object pickled as save_object pickles it
+    '''
+    return pickle.dumps(obj)
+
+def load_object_from_bytes(data):
+    '''
+    Load an object from the bytes of a pickle file
+    '''
+    return ArtifactUnpickler(io.BytesIO(data)).load()
+
+class FileLock:
+    '''
+    An exclusive lock on a file shared by all processes on the machine, used as a context manager.
+    Falls back to a lock within the process where fcntl is not available.
+    '''
+    _thread_locks = {}
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file_obj = None
+        self._thread_lock = self._thread_locks.setdefault(os.path.abspath(file_path), threading.Lock())
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok = True)
+            self._file_obj = open(self.file_path, "a")
+            fcntl.flock(self._file_obj.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file_obj is not None:
+            fcntl.flock(self._file_obj.fileno(), fcntl.LOCK_UN)
+            self._file_obj.close()
+            self._file_obj = None
+        self._thread_lock.release()
+
+def save_json(file_path, obj):
+    '''
+    Save a json serializable object in given path, atomically replacing any existing file
+    '''
+    dir_path = os.path.dirname(file_path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok = True)
+
+    temp_file_path = f'{file_path}.{os.getpid()}.tmp'
+    with open(temp_file_path, "w") as file_obj:
+        json.dump(obj, file_obj, indent = 4)
+    os.replace(temp_file_path, file_path)
+
+def load_json(file_path):
+    '''
+    Load a json file from given path
+    '''
+    with open(file_path, "r") as file_obj:
+        return json.load(file_obj)
+
+def file_sha256(file_path, block_size = 1 << 20):
+    '''
+    Compute the sha256 hex digest of a file by reading it in blocks
+    '''
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
     
 def area_under_precision_recall_curve(y_true, y_pred):
     '''
@@ -48,12 +143,35 @@ def area_under_precision_recall_curve(y_true, y_pred):
 
     return auc_precision_recall
 
+def _float_values(x):
+    '''
+    Return a new float array with the values of x, keeping float32 data in float32
+    '''
+    values = np.asarray(x)
+    return np.array(values, dtype = values.dtype if values.dtype.kind == 'f' else np.float64)
+
+def _like(x, values):
+    '''
+    Wrap values in the pandas type of x, if any, so that column names and index are kept
+    '''
+    if isinstance(x, pd.DataFrame):
+        return pd.DataFrame(values, index = x.index, columns = x.columns, copy = False)
+    if isinstance(x, pd.Series):
+        return pd.Series(values, index = x.index, name = x.name, copy = False)
+    return values
+
 def double_log_transform(x):
     '''Transform x by taking the log of the data after shifting by 1. This operation is done two times iteratively.'''
-    return np.log10(np.log10(x + 1) + 1)
+    # One output array, transformed in place, in the float dtype of x
+    values = _float_values(x)
+    values += 1
+    np.log10(values, out = values)
+    values += 1
+    np.log10(values, out = values)
+    return _like(x, values)
 
 def cube_root_transform(x):
     '''Transform x by taking the cube root of the data.'''
-    return np.cbrt(x)
-
-
+    values = _float_values(x)
+    np.cbrt(values, out = values)
+    return _like(x, values)
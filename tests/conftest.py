@@ -0,0 +1,84 @@
+import os
+import logging
+import tempfile
+
+import pytest
+
+# The logger reads its configuration relative to the working directory, so it is set up before any test changes directory,
+# with its log file outside the repository; every test then logs into its own temporary directory
+os.environ.setdefault('LOG_DIR', tempfile.mkdtemp(prefix = 'credit-card-fraud-detection-logs-'))
+import src.logger
+
+from benchmarks.synthetic_data import write_creditcard_csv
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(autouse = True)
+def test_log(tmp_path):
+    '''
+    Send the log records of a test to app.log in its temporary directory instead of the log file of the app
+    '''
+    root_logger = logging.getLogger()
+    handlers = root_logger.handlers[:]
+    file_handler = logging.FileHandler(tmp_path / 'app.log', encoding = 'utf8')
+    file_handler.setFormatter(handlers[0].formatter if handlers else None)
+
+    for handler in handlers:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(file_handler)
+    try:
+        yield tmp_path / 'app.log'
+    finally:
+        root_logger.removeHandler(file_handler)
+        file_handler.close()
+        for handler in handlers:
+            root_logger.addHandler(handler)
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    '''
+    Run the test from an empty directory, in which the relative artifacts paths of the configs resolve
+    '''
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def creditcard_csv(work_dir):
+    '''
+    Return a function writing synthetic credit card data of n_rows rows to a csv file of given name in the work directory
+    '''
+    def write(name, n_rows = 3000, random_state = 42):
+        return write_creditcard_csv(str(work_dir / name), n_rows, fraud_rate = 0.02, duplicate_rate = 0.0, random_state = random_state)
+    return write
+
+@pytest.fixture
+def models_data(work_dir, monkeypatch):
+    '''
+    Return the logistic regression candidate of the models data of the notebook, saved as the models data of the training pipeline
+    '''
+    from src.pipeline.training_pipeline import TrainingPipelineConfig
+    from src.utils import load_object, save_object
+
+    models_data = [model for model in load_object(os.path.join(REPO_DIR, 'notebook', 'models', 'models_data.pkl'))
+                   if model['name'] == 'Logistic_Regression']
+    save_object(str(work_dir / 'models_data.pkl'), models_data)
+    monkeypatch.setattr(TrainingPipelineConfig, 'models_data_path', str(work_dir / 'models_data.pkl'))
+    return models_data
+
+@pytest.fixture
+def train_model(models_data):
+    '''
+    Return a function training and publishing a logistic regression on a csv file and returning the training summary
+    '''
+    from src.pipeline.training_pipeline import TrainingPipeline, wait_for_artifacts
+
+    def train(file_path):
+        return wait_for_artifacts(TrainingPipeline().run_pipeline(0.0, file_path))
+    return train
+
+@pytest.fixture
+def trained_artifacts(creditcard_csv, train_model):
+    '''
+    Train and publish a logistic regression on synthetic data in the work directory and return the training summary
+    '''
+    return train_model(creditcard_csv('train.csv'))
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from src.components.artifact_store import ArtifactStore
+from src.utils import save_json, load_json
+
+def commit_version(artifact_store, version, files):
+    '''
+    Write files, a dictionary of relative path to text, into a staging directory and commit them as version
+    '''
+    staging_dir = artifact_store.staging_dir()
+    for relative_path, text in files.items():
+        path = os.path.join(staging_dir, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, 'w') as file_obj:
+            file_obj.write(text)
+    return artifact_store.commit(staging_dir, version)
+
+def read(path):
+    with open(path) as file_obj:
+        return file_obj.read()
+
+@pytest.fixture
+def artifact_store(tmp_path):
+    return ArtifactStore(str(tmp_path / 'store'), str(tmp_path / 'artifacts'))
+
+def test_publish_replaces_files_of_previous_version(artifact_store):
+    commit_version(artifact_store, 'v1', {'model.pkl': 'model 1', 'old.csv': 'old', 'model_version.json': '{"version": "v1"}'})
+    commit_version(artifact_store, 'v2', {'model.pkl': 'model 2', 'model_version.json': '{"version": "v2"}'})
+
+    artifact_store.publish('v1')
+    artifact_store.publish('v2')
+
+    assert artifact_store.current_version() == 'v2'
+    assert read(os.path.join(artifact_store.artifacts_dir, 'model.pkl')) == 'model 2'
+    assert not os.path.exists(os.path.join(artifact_store.artifacts_dir, 'old.csv'))
+
+def test_publish_places_data_before_manifests_and_version_file_last(artifact_store, monkeypatch):
+    commit_version(artifact_store, 'v1', {'model_version.json': '{}',
+                                          'inference_kernel/manifest.json': '{}',
+                                          'inference_kernel/weights-0123.bin': 'weights',
+                                          'training_data/meta.json': '{}',
+                                          'training_data/features.npy': 'features',
+                                          'model.pkl': 'model'})
+    placed = []
+    place = artifact_store._place
+    monkeypatch.setattr(artifact_store, '_place', lambda blob_path, target_path: (placed.append(os.path.relpath(target_path, artifact_store.artifacts_dir)),
+                                                                                  place(blob_path, target_path)))
+    artifact_store.publish('v1')
+
+    placed = [path.replace(os.sep, '/') for path in placed]
+    assert placed[-1] == 'model_version.json'
+    assert placed.index('inference_kernel/weights-0123.bin') < placed.index('inference_kernel/manifest.json')
+    assert placed.index('training_data/features.npy') < placed.index('training_data/meta.json')
+
+def test_unchanged_files_are_stored_once(artifact_store):
+    commit_version(artifact_store, 'v1', {'raw.csv': 'rows', 'model.pkl': 'model 1'})
+    commit_version(artifact_store, 'v2', {'raw.csv': 'rows', 'model.pkl': 'model 2'})
+
+    blobs = [file_name for _, _, file_names in os.walk(artifact_store.blobs_dir) for file_name in file_names]
+    assert len(blobs) == 3
+
+def test_rollback_publishes_previous_version(artifact_store):
+    commit_version(artifact_store, 'v1', {'model.pkl': 'model 1'})
+    artifact_store.publish('v1')
+    commit_version(artifact_store, 'v2', {'model.pkl': 'model 2'})
+    artifact_store.publish('v2')
+
+    assert artifact_store.rollback()['version'] == 'v1'
+    assert artifact_store.current_version() == 'v1'
+    assert read(os.path.join(artifact_store.artifacts_dir, 'model.pkl')) == 'model 1'
+    assert load_json(artifact_store.current_path)['previous'] == 'v2'
+
+def test_rollback_without_earlier_version_fails(artifact_store):
+    commit_version(artifact_store, 'v1', {'model.pkl': 'model 1'})
+    artifact_store.publish('v1')
+
+    with pytest.raises(ValueError):
+        artifact_store.rollback()
+    with pytest.raises(ValueError):
+        artifact_store.rollback('missing')
+
+def test_gc_keeps_current_version_and_removes_unreferenced_blobs(artifact_store):
+    for number in range(1, 4):
+        commit_version(artifact_store, f'v{number}', {'model.pkl': f'model {number}', 'raw.csv': 'rows'})
+        save_json(os.path.join(artifact_store.versions_dir, f'v{number}.json'),
+                  {**artifact_store.load_manifest(f'v{number}'), 'created_at': number})
+    artifact_store.publish('v1')
+
+    removed = artifact_store.gc(keep_versions = 1)
+
+    assert sorted(removed['evicted_versions']) == ['v2']
+    assert [manifest['version'] for manifest in artifact_store.list_versions()] == ['v3', 'v1']
+    assert removed['removed_blobs'] == 1
+    for manifest in artifact_store.list_versions():
+        for entry in manifest['files'].values():
+            assert os.path.exists(artifact_store.blob_path(entry['sha256']))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from imblearn.over_sampling import SMOTE
+
+from src.components.chunked_smote import ChunkedSMOTE, as_chunked_smote
+
+@pytest.fixture
+def imbalanced_data():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((600, 6))
+    y = np.zeros(600, dtype = np.int64)
+    y[:40] = 1
+    X[:40] += 1.5
+    return (X, y)
+
+@pytest.mark.parametrize('chunk_size', [7, 4096])
+def test_matches_imblearn_smote(imbalanced_data, chunk_size):
+    X, y = imbalanced_data
+
+    X_expected, y_expected = SMOTE(random_state = 42).fit_resample(X, y)
+    X_resampled, y_resampled = ChunkedSMOTE(random_state = 42, chunk_size = chunk_size).fit_resample(X, y)
+
+    np.testing.assert_array_equal(y_resampled, y_expected)
+    np.testing.assert_allclose(X_resampled, X_expected, rtol = 1e-6, atol = 1e-6)
+
+def test_matches_imblearn_smote_with_sampling_strategy(imbalanced_data):
+    X, y = imbalanced_data
+
+    X_expected, y_expected = SMOTE(sampling_strategy = 0.5, k_neighbors = 3, random_state = 7).fit_resample(X, y)
+    X_resampled, y_resampled = as_chunked_smote(SMOTE(sampling_strategy = 0.5, k_neighbors = 3, random_state = 7)).fit_resample(X, y)
+
+    np.testing.assert_array_equal(y_resampled, y_expected)
+    np.testing.assert_allclose(X_resampled, X_expected, rtol = 1e-6, atol = 1e-6)
+
+def test_too_few_minority_rows_fail(imbalanced_data):
+    X, y = imbalanced_data
+    y = np.zeros_like(y)
+    y[:3] = 1
+
+    with pytest.raises(ValueError):
+        ChunkedSMOTE(random_state = 42).fit_resample(X, y)
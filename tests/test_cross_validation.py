@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from src.components.cross_validation import CrossValidation, CrossValidationConfig, stratified_fold_ids
+from src.components.data_transformation import DataPreProcessor
+from src.pipeline.training_pipeline import TrainingPipeline
+
+def test_fold_ids_keep_class_proportions():
+    Y = pd.Series(np.r_[np.ones(50, dtype = int), np.zeros(950, dtype = int)])
+    fold_ids = stratified_fold_ids(Y, 5, random_state = 0)
+
+    assert fold_ids.dtype == np.int8
+    assert sorted(np.unique(fold_ids)) == list(range(5))
+    for fold in range(5):
+        assert (fold_ids == fold).sum() == 200
+        assert Y[fold_ids == fold].sum() == 10
+
+def test_pre_processing_is_fitted_inside_each_fold(models_data, creditcard_csv, monkeypatch):
+    data = pd.read_csv(creditcard_csv('train.csv', n_rows = 2000))
+    X_train, Y_train = data.drop(columns = ['Class']), data['Class']
+
+    fitted_rows = []
+    fit_transform = DataPreProcessor.fit_transform
+
+    def recording_fit_transform(self, pre_processor, X, Y):
+        fitted_rows.append(set(X.index))
+        return fit_transform(self, pre_processor, X, Y)
+
+    monkeypatch.setattr(DataPreProcessor, 'fit_transform', recording_fit_transform)
+    results = CrossValidation(TrainingPipeline()).cross_validate(models_data, X_train, Y_train, n_workers = 1)
+
+    cross_validation_config = CrossValidationConfig()
+    fold_ids = stratified_fold_ids(Y_train, cross_validation_config.n_splits, cross_validation_config.random_state)
+    assert 'error' not in results['Logistic_Regression']
+    assert len(fitted_rows) == cross_validation_config.n_splits
+    for fold, rows in enumerate(fitted_rows):
+        assert rows == set(X_train.index[fold_ids != fold])
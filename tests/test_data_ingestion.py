@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import write_creditcard_csv
+from src.components.data_ingestion import DataIngestion, DataIngestionConfig
+
+def ingest_chunked(path, shards_dir, test_size = 0.2, chunk_size = 400):
+    data_ingestion = DataIngestion()
+    train_shards, test_shards = data_ingestion.ingest_data_chunked(path, 'Class', test_size, 42, chunk_size, shards_dir = str(shards_dir))
+    X_train, Y_train = data_ingestion.load_shards(train_shards, 'Class')
+    X_test, Y_test = data_ingestion.load_shards(test_shards, 'Class')
+    return X_train, X_test, Y_train, Y_test
+
+def test_duplicates_are_dropped_across_chunks(tmp_path):
+    path = write_creditcard_csv(str(tmp_path / 'data.csv'), 4000, fraud_rate = 0.02, duplicate_rate = 0.1, random_state = 0)
+    X_train, X_test, Y_train, Y_test = ingest_chunked(path, tmp_path / 'shards')
+
+    data = pd.read_csv(path, dtype = DataIngestionConfig().column_dtypes)
+    first_rows = data[~data.duplicated()]
+    assert len(first_rows) < len(data)
+
+    # Every row is kept once, at its first occurrence in the file, in the train or the test set
+    index = X_train.index.append(X_test.index)
+    assert index.is_unique
+    assert sorted(index) == list(first_rows.index)
+    pd.testing.assert_frame_equal(X_train, first_rows.loc[X_train.index].drop(columns = ['Class']), check_names = False)
+
+def test_test_share_of_every_class_is_test_size(tmp_path):
+    path = write_creditcard_csv(str(tmp_path / 'data.csv'), 6000, fraud_rate = 0.03, duplicate_rate = 0.0, random_state = 1)
+    X_train, X_test, Y_train, Y_test = ingest_chunked(path, tmp_path / 'shards', test_size = 0.25, chunk_size = 250)
+
+    labels = pd.concat([Y_train, Y_test])
+    for label in np.unique(labels):
+        n_class, n_test = int((labels == label).sum()), int((Y_test == label).sum())
+        assert abs(n_test - 0.25 * n_class) <= 1
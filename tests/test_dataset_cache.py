@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.components.dataset_cache import DatasetCache
+
+SETTINGS = {'target_class': 'Class', 'test_size': 0.2, 'random_state': 42}
+
+def write_source(tmp_path, name, n_rows, random_state = 0):
+    '''
+    Write a small csv file and return its path along with its train and test sets
+    '''
+    rng = np.random.default_rng(random_state)
+    data = pd.DataFrame({'V1': rng.normal(size = n_rows), 'V2': rng.normal(size = n_rows), 'Class': rng.integers(0, 2, n_rows)})
+    path = str(tmp_path / name)
+    data.to_csv(path, index = False)
+
+    n_train = int(n_rows * 0.8)
+    X, Y = data.drop(columns = ['Class']), data['Class']
+    return path, (X.iloc[:n_train], X.iloc[n_train:], Y.iloc[:n_train], Y.iloc[n_train:])
+
+def is_memory_mapped(array):
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    return array is not None
+
+def entry_keys(dataset_cache):
+    return {key for key in os.listdir(dataset_cache.cache_dir) if os.path.isdir(os.path.join(dataset_cache.cache_dir, key))}
+
+def set_last_used(dataset_cache, path, seconds_ago, **ingestion_settings):
+    meta_path = os.path.join(dataset_cache.entry_dir(path, **ingestion_settings), 'meta.json')
+    last_used = os.stat(meta_path).st_mtime - seconds_ago
+    os.utime(meta_path, (last_used, last_used))
+
+def test_stored_data_is_loaded_for_same_file_and_settings(tmp_path):
+    dataset_cache = DatasetCache(str(tmp_path / 'cache'))
+    path, data_arr = write_source(tmp_path, 'data.csv', 100)
+    assert dataset_cache.load(path, **SETTINGS) is None
+
+    dataset_cache.store(path, *data_arr, **SETTINGS)
+
+    for loaded, expected in zip(dataset_cache.load(path, **SETTINGS), data_arr):
+        assert is_memory_mapped(loaded.to_numpy())
+        np.testing.assert_array_equal(loaded.to_numpy(), expected.to_numpy())
+        np.testing.assert_array_equal(loaded.index.to_numpy(), expected.index.to_numpy())
+    assert dataset_cache.load(path, **{**SETTINGS, 'random_state': 0}) is None
+
+def test_entries_of_changed_files_are_evicted(tmp_path):
+    dataset_cache = DatasetCache(str(tmp_path / 'cache'))
+    path, data_arr = write_source(tmp_path, 'data.csv', 100)
+    dataset_cache.store(path, *data_arr, **SETTINGS)
+    stale_key = os.path.basename(dataset_cache.entry_dir(path, **SETTINGS))
+
+    path, data_arr = write_source(tmp_path, 'data.csv', 120, random_state = 1)
+    dataset_cache.store(path, *data_arr, **SETTINGS)
+
+    assert entry_keys(dataset_cache) == {os.path.basename(dataset_cache.entry_dir(path, **SETTINGS))}
+    assert stale_key not in entry_keys(dataset_cache)
+
+def test_least_recently_used_entries_are_evicted_beyond_entry_limit(tmp_path):
+    dataset_cache = DatasetCache(str(tmp_path / 'cache'), max_entries = 2)
+    paths = []
+    for number in range(2):
+        path, data_arr = write_source(tmp_path, f'data_{number}.csv', 100, random_state = number)
+        dataset_cache.store(path, *data_arr, **SETTINGS)
+        set_last_used(dataset_cache, path, 100 - number * 10, **SETTINGS)
+        paths.append(path)
+
+    # Using the older entry makes the other one the least recently used
+    assert dataset_cache.load(paths[0], **SETTINGS) is not None
+    path, data_arr = write_source(tmp_path, 'data_2.csv', 100, random_state = 2)
+    dataset_cache.store(path, *data_arr, **SETTINGS)
+
+    assert dataset_cache.load(paths[1], **SETTINGS) is None
+    assert dataset_cache.load(paths[0], **SETTINGS) is not None
+    assert dataset_cache.load(path, **SETTINGS) is not None
@@ -0,0 +1,53 @@
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.components.drift_monitor import DriftMonitor, build_reference
+
+def features(n_rows, random_state, shift = 0.0):
+    rng = np.random.default_rng(random_state)
+    return pd.DataFrame({'V1': rng.normal(shift, 1.0, n_rows), 'V2': rng.normal(0.0, 1.0, n_rows)})
+
+def test_shifted_feature_is_reported_as_drifted(tmp_path):
+    drift_monitor = DriftMonitor(build_reference(features(20000, 0)), tmp_path)
+    drift_monitor.observe(features(5000, 1, shift = 1.0))
+
+    report = drift_monitor.report()
+
+    assert report['live_rows'] == 5000
+    assert report['features']['V1']['status'] == 'alert'
+    assert report['features']['V1']['psi'] > 0.25
+    assert report['features']['V1']['ks'] > 0.3
+    assert report['features']['V2']['status'] == 'ok'
+    assert report['features']['V2']['psi'] < 0.1
+    assert report['features']['V2']['ks'] < 0.05
+    assert report['drifted_features'] == ['V1']
+
+def test_single_rows_are_reported_once_flushed(tmp_path):
+    drift_monitor = DriftMonitor(build_reference(features(20000, 0)), tmp_path)
+    for row in features(10, 1).to_dict(orient = 'records'):
+        drift_monitor.observe_row(row)
+
+    assert drift_monitor.report()['live_rows'] == 10
+
+def observe_in_worker(drift_monitor, X):
+    drift_monitor.observe(X)
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason = 'Workers are forked from the master')
+def test_rows_of_all_workers_are_merged(tmp_path):
+    # Created before forking, as in the gunicorn master with preload_app
+    drift_monitor = DriftMonitor(build_reference(features(20000, 0)), tmp_path)
+    drift_monitor.observe(features(300, 1))
+
+    worker = multiprocessing.get_context('fork').Process(target = observe_in_worker, args = (drift_monitor, features(200, 2)))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    assert drift_monitor.report()['live_rows'] == 500
+    assert DriftMonitor(drift_monitor.reference, tmp_path).report()['live_rows'] == 500
+
+    drift_monitor.reset()
+    assert drift_monitor.report()['live_rows'] == 0
@@ -0,0 +1,33 @@
+from src.pipeline.incremental_training import IncrementalTrainingPipeline
+from src.pipeline.training_pipeline import TrainingPipelineConfig, wait_for_artifacts
+from src.utils import load_json
+
+def current_version():
+    return load_json(TrainingPipelineConfig.model_version_file_path)
+
+def test_promoted_update_is_published_as_new_version(trained_artifacts, creditcard_csv):
+    summary = wait_for_artifacts(IncrementalTrainingPipeline().run_pipeline(creditcard_csv('new.csv', n_rows = 600, random_state = 7),
+                                                                            max_score_drop = 1.0))
+
+    assert summary['saved'] is True
+    assert summary['base_version'] == trained_artifacts['version']
+    assert summary['strategy'] == 'warm_start'
+    assert summary['train_rows_added'] + summary['test_rows_added'] == 600
+
+    model_version = current_version()
+    assert model_version['version'] == summary['version'] != trained_artifacts['version']
+    assert model_version['incremental']['base_version'] == trained_artifacts['version']
+
+def test_update_below_score_threshold_is_not_promoted(trained_artifacts, creditcard_csv):
+    summary = IncrementalTrainingPipeline().run_pipeline(creditcard_csv('new.csv', n_rows = 600, random_state = 7), score_threshold = 2.0)
+
+    assert summary['saved'] is False
+    assert 'version' not in summary
+    assert current_version()['version'] == trained_artifacts['version']
+
+def test_rows_already_trained_on_are_not_added(trained_artifacts, creditcard_csv):
+    summary = IncrementalTrainingPipeline().run_pipeline(creditcard_csv('train.csv'))
+
+    assert summary['train_rows_added'] == 0
+    assert summary['saved'] is False
+    assert current_version()['version'] == trained_artifacts['version']
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from src.instrumentation import InstrumentationConfig, stage, resource
+
+@pytest.mark.skipif(resource is None, reason = 'The peak resident memory is not available on this platform')
+def test_peak_memory_is_measured_per_stage(monkeypatch):
+    monkeypatch.setattr(InstrumentationConfig, 'enabled', True)
+    monkeypatch.setattr(InstrumentationConfig, 'trace_memory', False)
+
+    with stage('test.large') as large:
+        data = np.ones(2**26 // 8)
+        del data
+    with stage('test.small') as small:
+        data = np.ones(2**23 // 8)
+        del data
+
+    # The small stage stays below the peak the large one reached, rather than reporting the peak of the whole process
+    assert large.peak_memory_bytes >= 0
+    assert small.peak_memory_bytes < 2**23
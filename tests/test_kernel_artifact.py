@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.tree import DecisionTreeClassifier
+
+from src.components.data_transformation import DataPreProcessor
+from src.components.inference_kernel import compile_inference_kernel
+from src.components.kernel_artifact import save_kernel_artifact, load_kernel_artifact
+from src.pipeline.prediction_pipeline import PredictionPipelineConfig
+from src.utils import load_object, load_json
+
+@pytest.fixture
+def pickled_pair(trained_artifacts, creditcard_csv):
+    '''
+    Return the trained model and pre-processor along with rows to score
+    '''
+    prediction_pipeline_config = PredictionPipelineConfig()
+    model = load_object(prediction_pipeline_config.model_file_path)
+    preprocessor = load_object(prediction_pipeline_config.preprocessor_path)
+    X = pd.read_csv(creditcard_csv('score.csv', n_rows = 500, random_state = 1)).drop(columns = ['Class'])
+    return model, preprocessor, X
+
+def tree_model(preprocessor, X):
+    Y = (X['V1'] + X['V2'] > 0).astype(int)
+    return DecisionTreeClassifier(max_depth = 6, random_state = 42).fit(DataPreProcessor().transform(preprocessor, X), Y)
+
+@pytest.mark.parametrize('model_kind', ['linear', 'tree'])
+def test_round_trip_matches_pickled_pair(pickled_pair, tmp_path, model_kind):
+    model, preprocessor, X = pickled_pair
+    if model_kind == 'tree':
+        model = tree_model(preprocessor, X)
+    kernel = compile_inference_kernel(preprocessor, model)
+
+    save_kernel_artifact(kernel, str(tmp_path / 'kernel'), {'version': 'test'})
+    loaded_kernel = load_kernel_artifact(str(tmp_path / 'kernel'))
+
+    expected = model.predict_proba(DataPreProcessor().transform(preprocessor, X))[:, 1]
+    assert type(loaded_kernel) is type(kernel)
+    assert loaded_kernel.input_columns == kernel.input_columns
+    np.testing.assert_array_equal(loaded_kernel.predict_fraud_proba(X), kernel.predict_fraud_proba(X))
+    np.testing.assert_allclose(loaded_kernel.predict_fraud_proba(X), expected, atol = 1e-6)
+
+def test_checksum_mismatch_raises_value_error(pickled_pair, tmp_path):
+    model, preprocessor, X = pickled_pair
+    manifest_path = save_kernel_artifact(compile_inference_kernel(preprocessor, model), str(tmp_path / 'kernel'))
+
+    # Corrupt one byte of the weights, keeping the size recorded in the manifest
+    data_path = tmp_path / 'kernel' / load_json(manifest_path)['data_file']
+    data = bytearray(data_path.read_bytes())
+    data[-1] ^= 0xFF
+    data_path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match = 'checksum'):
+        load_kernel_artifact(str(tmp_path / 'kernel'))
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_creditcard_data
+from src.pipeline.prediction_pipeline import PredictPipeline, PredictionPipelineConfig
+from src.components.data_transformation import DataPreProcessor
+from src.utils import load_object, load_json, save_json
+
+def test_integer_time_column_is_not_truncated(work_dir, train_model):
+    data = generate_creditcard_data(n_rows = 3000, fraud_rate = 0.02, duplicate_rate = 0.0, random_state = 42)
+    data['Time'] = data['Time'].astype(np.int64)
+    data.to_csv('train.csv', index = False)
+    train_model('train.csv')
+
+    prediction_pipeline_config = PredictionPipelineConfig()
+    assert load_json(prediction_pipeline_config.model_version_path)['compute_dtype'] == 'float64'
+    assert PredictPipeline().compute_dtype() == 'float64'
+
+    X = pd.read_csv('train.csv').drop(columns = ['Class']).iloc[:500]
+    model = load_object(prediction_pipeline_config.model_file_path)
+    preprocessor = load_object(prediction_pipeline_config.preprocessor_path)
+    expected = model.predict_proba(DataPreProcessor().transform(preprocessor, X))[:, 1]
+
+    np.testing.assert_allclose(PredictPipeline().score(X), expected)
+
+def test_integer_compute_dtype_of_a_model_version_is_ignored(trained_artifacts):
+    prediction_pipeline_config = PredictionPipelineConfig()
+    model_version = load_json(prediction_pipeline_config.model_version_path)
+    model_version['compute_dtype'] = 'int64'
+    save_json(prediction_pipeline_config.model_version_path, model_version)
+
+    # Read the version file rather than the in-memory registry, which keeps the metadata the pair was published with
+    prediction_pipeline = PredictPipeline()
+    prediction_pipeline.prediction_pipeline_config.use_model_registry = False
+    assert prediction_pipeline.compute_dtype() is None
@@ -0,0 +1,61 @@
+import pytest
+
+from src.components.request_coalescer import RequestCoalescer
+
+COLUMNS = ['Time', 'V1', 'Amount']
+
+def row(value):
+    return {'Time': 1.0, 'V1': value, 'Amount': 10.0}
+
+def score_batch(X):
+    '''
+    Score rows by their V1 value, failing any batch with a negative one
+    '''
+    assert X.columns.tolist() == COLUMNS
+    if (X['V1'] < 0).any():
+        raise ValueError('negative V1')
+    return X['V1'].to_numpy() / 10
+
+def test_rows_of_a_batch_get_their_own_probability():
+    request_coalescer = RequestCoalescer(score_batch, max_wait_ms = 50, input_columns = lambda: COLUMNS)
+
+    futures = [request_coalescer.submit(row(value)) for value in (1.0, 2.0, 3.0)]
+
+    assert [future.result(5) for future in futures] == pytest.approx([0.1, 0.2, 0.3])
+
+def test_row_missing_a_column_fails_alone():
+    request_coalescer = RequestCoalescer(score_batch, max_wait_ms = 50, input_columns = lambda: COLUMNS)
+    missing_row = row(2.0)
+    del missing_row['Amount']
+
+    futures = [request_coalescer.submit(row(1.0)), request_coalescer.submit(missing_row), request_coalescer.submit(row(3.0))]
+
+    assert futures[0].result(5) == pytest.approx(0.1)
+    with pytest.raises(ValueError, match = 'Amount'):
+        futures[1].result(5)
+    assert futures[2].result(5) == pytest.approx(0.3)
+    assert request_coalescer.stats()['rejected_rows'] == 1
+
+def test_extra_columns_are_not_scored():
+    request_coalescer = RequestCoalescer(score_batch, max_wait_ms = 50, input_columns = lambda: COLUMNS)
+
+    futures = [request_coalescer.submit({**row(1.0), 'extra': 5.0}), request_coalescer.submit(row(2.0))]
+
+    assert [future.result(5) for future in futures] == pytest.approx([0.1, 0.2])
+
+def test_failed_batch_is_retried_row_by_row():
+    request_coalescer = RequestCoalescer(score_batch, max_wait_ms = 50, input_columns = lambda: COLUMNS)
+
+    futures = [request_coalescer.submit(row(value)) for value in (1.0, -1.0, 3.0)]
+
+    assert futures[0].result(5) == pytest.approx(0.1)
+    with pytest.raises(ValueError, match = 'negative V1'):
+        futures[1].result(5)
+    assert futures[2].result(5) == pytest.approx(0.3)
+    assert request_coalescer.stats()['errors'] >= 1
+
+def test_failed_single_row_gets_the_error():
+    request_coalescer = RequestCoalescer(score_batch, max_wait_ms = 0)
+
+    with pytest.raises(ValueError, match = 'negative V1'):
+        request_coalescer.predict(row(-1.0), timeout = 5)
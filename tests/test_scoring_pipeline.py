@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src.pipeline.scoring_pipeline import ScoringPipeline
+from src.pipeline.prediction_pipeline import PredictPipeline
+from src.exception import CustomError
+
+def interrupt_after(monkeypatch, n_chunks):
+    '''
+    Make label_chunk fail once n_chunks chunks have been labelled, as if the run was stopped there
+    '''
+    label_chunk = ScoringPipeline.label_chunk
+    calls = []
+
+    def failing_label_chunk(self, *args, **kwargs):
+        if len(calls) == n_chunks:
+            raise KeyboardInterrupt('Interrupted')
+        calls.append(1)
+        return label_chunk(self, *args, **kwargs)
+
+    monkeypatch.setattr(ScoringPipeline, 'label_chunk', failing_label_chunk)
+
+def test_interrupted_run_resumes_after_last_chunk(trained_artifacts, creditcard_csv, monkeypatch):
+    input_path = creditcard_csv('score.csv', n_rows = 1000, random_state = 1)
+    ScoringPipeline().run_pipeline(input_path, 'expected.csv', chunk_size = 150)
+
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 3)
+        with pytest.raises((CustomError, KeyboardInterrupt)):
+            ScoringPipeline().run_pipeline(input_path, 'scored.csv', chunk_size = 150)
+
+    summary = ScoringPipeline().run_pipeline(input_path, 'scored.csv', chunk_size = 150)
+
+    assert summary['resumed']
+    assert summary['rows_scored'] == 1000 - 3 * 150
+    pd.testing.assert_frame_equal(pd.read_csv('scored.csv'), pd.read_csv('expected.csv'))
+
+def test_progress_of_another_model_version_is_ignored(trained_artifacts, creditcard_csv, monkeypatch):
+    input_path = creditcard_csv('score.csv', n_rows = 1000, random_state = 1)
+
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 3)
+        with pytest.raises((CustomError, KeyboardInterrupt)):
+            ScoringPipeline().run_pipeline(input_path, 'scored.csv', chunk_size = 150)
+
+    monkeypatch.setattr(PredictPipeline, 'model_version', lambda self: 'another-version')
+    summary = ScoringPipeline().run_pipeline(input_path, 'scored.csv', chunk_size = 150)
+
+    assert not summary['resumed']
+    assert summary['rows_scored'] == 1000
+    assert len(pd.read_csv('scored.csv')) == 1000
+
+def test_changed_settings_start_over(trained_artifacts, creditcard_csv):
+    input_path = creditcard_csv('score.csv', n_rows = 500, random_state = 1)
+    ScoringPipeline().run_pipeline(input_path, 'scored.csv', chunk_size = 100)
+
+    summary = ScoringPipeline().run_pipeline(input_path, 'scored.csv', chunk_size = 100, fraud_prob_threshold = 0.9)
+
+    assert not summary['resumed']
+    assert summary['rows_scored'] == 500
+    assert os.path.exists('scored.csv.progress.json')
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from src.components.successive_halving import SuccessiveHalving, SuccessiveHalvingConfig, stratified_subsample
+
+@pytest.fixture
+def successive_halving():
+    successive_halving_config = SuccessiveHalvingConfig()
+    successive_halving_config.min_positive_rows = 0
+    return SuccessiveHalving(None, successive_halving_config)
+
+def test_budgets_divide_candidates_down_to_one(successive_halving):
+    assert successive_halving.budgets(9, 10000) == pytest.approx([1 / 9, 1 / 3, 1.0])
+    assert successive_halving.budgets(3, 10000) == pytest.approx([1 / 3, 1.0])
+    assert successive_halving.budgets(1, 10000) == [1.0]
+
+def test_budgets_respect_the_floor_of_positive_rows(successive_halving):
+    successive_halving.successive_halving_config.min_positive_rows = 50
+
+    # A floor of 50 of 100 fraud rows leaves room for one rung below the full budget
+    assert successive_halving.budgets(9, 100) == pytest.approx([0.5, 1.0])
+    assert successive_halving.budgets(9, 40) == [1.0]
+    assert successive_halving.budgets(9, 450) == pytest.approx([1 / 9, 1 / 3, 1.0])
+
+def test_budgets_respect_min_budget(successive_halving):
+    successive_halving.successive_halving_config.min_budget = 0.2
+
+    budgets = successive_halving.budgets(27, 10000)
+    assert budgets[-1] == 1.0
+    assert min(budgets) >= 0.2
+    assert budgets == sorted(budgets)
+
+def test_scaled_candidate_scales_boosting_rounds(successive_halving):
+    model = {'name': 'XGBoost', 'best_params': {'n_estimators': 90, 'max_depth': 2}}
+
+    scaled, rounds_share = successive_halving.scaled_candidate(model, 1 / 3)
+    assert scaled['best_params'] == {'n_estimators': 30, 'max_depth': 2}
+    assert rounds_share == pytest.approx(1 / 3)
+    assert model['best_params']['n_estimators'] == 90
+    assert successive_halving.scaled_candidate(model, 1.0) == (model, 1.0)
+
+def test_stratified_subsamples_are_nested_and_keep_every_class():
+    Y = np.array([0] * 990 + [1] * 10)
+
+    small = stratified_subsample(Y, 0.05)
+    large = stratified_subsample(Y, 0.5)
+
+    assert set(small) <= set(large)
+    assert set(Y[small]) == {0, 1}
+    assert np.sum(Y[large] == 1) == 5
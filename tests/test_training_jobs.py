@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from src.pipeline.training_jobs import TrainingJob, TrainingJobStore, run_training_job
+from src.pipeline.training_pipeline import TrainingPipeline
+from src.pipeline.prediction_pipeline import PredictionPipelineConfig
+
+def cancel_at(monkeypatch, job_id, cancel_stage, cancel_status):
+    '''
+    Request the cancellation of the job in the job store when the pipeline reaches given stage and status, as the app would
+    '''
+    report_progress = TrainingPipeline.report_progress
+
+    def cancelling_report_progress(self, stage, status):
+        if (stage, status) == (cancel_stage, cancel_status):
+            TrainingJobStore().update(job_id, lambda job: setattr(job, 'cancel_requested', True))
+        return report_progress(self, stage, status)
+
+    monkeypatch.setattr(TrainingPipeline, 'report_progress', cancelling_report_progress)
+
+@pytest.fixture
+def job(models_data, creditcard_csv):
+    job = TrainingJob('job', creditcard_csv('train.csv'), 0.0)
+    TrainingJobStore().add(job)
+    return job
+
+def test_cancelled_job_stops_at_next_stage_boundary(job, monkeypatch):
+    cancel_at(monkeypatch, job.job_id, 'ingest_data', 'finished')
+    run_training_job(job.job_id, job.file_path, job.score_threshold)
+
+    job = TrainingJobStore().get(job.job_id)
+    assert job.status == 'cancelled'
+    assert [(stage['stage'], stage['status']) for stage in job.stages] == [('ingest_data', 'finished')]
+    assert not os.path.exists(PredictionPipelineConfig().model_file_path)
+
+def test_cancellation_waits_for_artifacts_to_be_saved(job, monkeypatch):
+    cancel_at(monkeypatch, job.job_id, 'save_artifacts', 'started')
+    run_training_job(job.job_id, job.file_path, job.score_threshold)
+
+    job = TrainingJobStore().get(job.job_id)
+    assert job.status == 'succeeded'
+    assert job.result['saved'] is True
+    assert os.path.exists(PredictionPipelineConfig().model_file_path)
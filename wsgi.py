@@ -0,0 +1,16 @@
+'''
+Production entry point of the web app, served by gunicorn with the settings of gunicorn.conf.py:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With preload_app, this module is imported once in the gunicorn master, which loads and warms up the model before
+forking the workers, so that they start ready to serve and share the loaded model copy-on-write.
+'''
+from app import app, warm_up
+from src.logger import logging
+
+try:
+    warm_up()
+except Exception:
+    # Serving starts anyway, /readyz reports not ready until a model and pre-processor are available
+    logging.error('Could not warm up the app, the model and pre-processor will be loaded on the first request.', exc_info = True)